@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # Advisory locks are only available on POSIX systems
+    fcntl = None
+
+
+def get_temp_file_name(file_name, suffix = '.tmp'):
+    # Create an empty uniquely named temporary file next to file_name so it can replace file_name with a rename
+    file_path = Path(file_name)
+    temp_file_descriptor, temp_file_name = tempfile.mkstemp(dir = file_path.parent, prefix = '.' + file_path.name + '.', suffix = suffix)
+    os.close(temp_file_descriptor)
+
+    return temp_file_name
+
+
+def replace_file(temp_file_name, file_name):
+    # Move a finished temporary file into place. Readers see the old file or the new file and never a partial file
+    try:
+        os.chmod(temp_file_name, 0o644)
+        os.replace(temp_file_name, file_name)
+    except OSError:
+        remove_file(temp_file_name)
+        raise
+
+
+def remove_file(file_name):
+    try:
+        os.unlink(file_name)
+    except FileNotFoundError:
+        pass
+
+
+def write_bytes_atomic(file_name, data):
+    temp_file_name = get_temp_file_name(file_name)
+
+    try:
+        with open(temp_file_name, 'wb') as f:
+            f.write(data)
+    except OSError:
+        remove_file(temp_file_name)
+        raise
+
+    replace_file(temp_file_name, file_name)
+
+
+def write_text_atomic(file_name, text):
+    write_bytes_atomic(file_name, text.encode('utf-8'))
+
+
+def link_or_copy_atomic(source_file_name, file_name):
+    # Hardlink source_file_name to file_name, or copy it when hardlinks are not supported, replacing file_name in one step
+    temp_file_name = get_temp_file_name(file_name)
+    remove_file(temp_file_name)
+
+    try:
+        os.link(source_file_name, temp_file_name)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(source_file_name, temp_file_name)
+
+    try:
+        os.replace(temp_file_name, file_name)
+    except OSError:
+        remove_file(temp_file_name)
+        raise
+
+
+
+class FileLock():
+    """
+    Advisory lock on a lock file shared by all processes that use the same lock file
+
+    Used as a context manager around changes to files that several runs share, such as the render cache
+    and the render history. On systems without fcntl the lock does nothing
+
+    ...
+
+    Attributes
+    ----------
+    lock_file_name : str
+        The lock file. It is created if it does not exist and is never removed
+
+    shared : bool, default False
+        Take a shared lock that only excludes exclusive locks
+
+    Methods
+    -------
+    acquire()
+        Block until the lock is held
+    release()
+        Release the lock
+    """
+
+    def __init__(self, lock_file_name, shared = False):
+
+        self.lock_file_name = Path(lock_file_name)
+        self.shared = shared
+
+        self.lock_file = None
+
+
+    def acquire(self):
+        if fcntl is None:
+            return
+
+        self.lock_file_name.parent.mkdir(parents = True, exist_ok = True)
+        self.lock_file = open(self.lock_file_name, 'a')
+
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_SH if self.shared == True else fcntl.LOCK_EX)
+        except OSError:
+            self.lock_file.close()
+            self.lock_file = None
+            raise
+
+
+    def release(self):
+        if self.lock_file is None:
+            return
+
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,86 @@
+import logging
+import time
+from pathlib import Path
+
+
+
+class FileWatcher():
+    """
+    Poll a set of files for changes
+
+    A change is only reported once the files have stopped changing for debounce seconds so a burst of
+    saves from an editor is handled as one change
+
+    ...
+
+    Attributes
+    ----------
+    file_list : list
+        The files to watch
+
+    poll_interval : float, default 0.5
+        Seconds between checks of the files
+
+    debounce : float, default 1.0
+        Seconds the files must be unchanged before a change is reported
+
+    Methods
+    -------
+    get_changed_files()
+        Get the files that changed since the last call without waiting
+    wait_for_change()
+        Block until one or more files change and stop changing. Returns the list of changed files
+    """
+
+    def __init__(self, file_list, poll_interval = 0.5, debounce = 1.0):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.file_list = [Path(file_name) for file_name in file_list if file_name is not None]
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+
+        self.signature_dict = {file_path: self.get_signature(file_path) for file_path in self.file_list}
+
+
+    def get_signature(self, file_path: Path):
+        # Modification time and size. None while the file is missing, for example during an editor's atomic save
+        try:
+            stat_result = file_path.stat()
+        except OSError:
+            return None
+
+        return (stat_result.st_mtime_ns, stat_result.st_size)
+
+
+    def get_changed_files(self):
+        changed_list = []
+
+        for file_path in self.file_list:
+            signature = self.get_signature(file_path)
+
+            if signature != self.signature_dict[file_path]:
+                self.signature_dict[file_path] = signature
+                changed_list.append(file_path)
+
+        return changed_list
+
+
+    def wait_for_change(self):
+        changed_list = []
+        last_change_time = None
+
+        while True:
+            for file_path in self.get_changed_files():
+                self.logger.debug('Changed: %s', file_path)
+                last_change_time = time.monotonic()
+
+                if file_path not in changed_list:
+                    changed_list.append(file_path)
+
+            # Report the change once the files have settled and are all readable
+            if last_change_time is not None and time.monotonic() - last_change_time >= self.debounce:
+                if all(self.signature_dict[file_path] is not None for file_path in changed_list):
+                    return changed_list
+
+            time.sleep(self.poll_interval)
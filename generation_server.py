@@ -0,0 +1,565 @@
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+import re
+import shutil
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from keyboard import Keyboard
+from layout_file import parse_layout_text
+from keyboard_api import build_keyboard
+from render_queue import RenderJob, RenderQueue
+from scad_writer import ScadWriter
+
+
+
+class GenerationJob():
+    """
+    A layout and parameters submitted to the GenerationServer and the files built from them
+
+    ...
+
+    Attributes
+    ----------
+    job_id : str
+        Hash of the normalized request. Identical requests get the same job id
+
+    request_dict : dict
+        The normalized request
+
+    output_folder : Path
+        Folder the scad and STL files of the job are written to
+
+    Methods
+    -------
+    to_dict()
+        Get the job status and artifact list as a JSON serializable dict
+    """
+
+    STATUS_QUEUED = 'queued'
+    STATUS_GENERATING = 'generating'
+    STATUS_RENDERING = 'rendering'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self, job_id, request_dict, output_folder):
+
+        self.job_id = job_id
+        self.request_dict = request_dict
+        self.output_folder = Path(output_folder)
+
+        self.status = self.STATUS_QUEUED
+        self.error = None
+
+        # File names relative to output_folder that can be downloaded, in the order they were finished
+        self.artifact_list = []
+        self.failed_artifact_list = []
+        self.render_job_list = []
+
+        self.submit_count = 1
+        self.created = time.time()
+        self.finished = None
+
+        # Set once the job is done or failed. Created by the server inside its event loop
+        self.done_event = None
+
+
+    def is_finished(self):
+        return self.status in [self.STATUS_DONE, self.STATUS_FAILED]
+
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'error': self.error,
+            'artifacts': list(self.artifact_list),
+            'failed_artifacts': list(self.failed_artifact_list),
+            'submit_count': self.submit_count,
+            'created': self.created,
+            'finished': self.finished
+        }
+
+
+
+class GenerationServer():
+    """
+    Resident HTTP server that builds keyboard parts for submitted layouts
+
+    Processed keyboards, generated SCAD text, switch cutout polygons and rendered STL files are kept
+    between requests. Identical submissions share one job
+
+    Endpoints:
+        POST /jobs                          Submit a job. Returns the job id
+        GET  /jobs                          List the jobs
+        GET  /jobs/<job_id>?wait=seconds    Job status. wait blocks until the job finishes or the time runs out
+        GET  /jobs/<job_id>/stream          One JSON line per artifact as soon as it is finished
+        GET  /jobs/<job_id>/artifacts/<n>   Download an artifact
+
+    ...
+
+    Attributes
+    ----------
+    output_folder : str
+        Folder the jobs are written to. Each job has its own sub folder
+
+    host : str, default '127.0.0.1'
+        Address to listen on
+
+    port : int, default 8765
+        Port to listen on
+
+    render_queue : RenderQueue, default None
+        Queue used to render STL files. Jobs that ask for renders fail if there is no render queue
+
+    keyboard_cache_size : int, default 8
+        The number of processed keyboards kept in memory
+
+    scad_cache_size : int, default 512
+        The number of generated SCAD files kept in memory
+
+    max_jobs : int, default 100
+        The number of jobs kept. The oldest finished jobs and their output folders are removed beyond it
+
+    job_ttl : float, default 86400
+        Finished jobs and their output folders are removed this many seconds after they finished. None keeps them
+
+    Methods
+    -------
+    submit(request_dict)
+        Add a job or get the existing job for an identical request. Returns (job, coalesced)
+    remove_old_jobs()
+        Remove finished jobs past job_ttl or beyond max_jobs together with their output folders
+    serve_forever()
+        Run the server until interrupted
+    """
+
+    MAX_BODY_SIZE = 16 * 1024 * 1024
+    CHUNK_SIZE = 64 * 1024
+
+    # Seconds between checks for jobs past job_ttl
+    REMOVE_INTERVAL = 60
+
+    def __init__(self, output_folder, host = '127.0.0.1', port = 8765, render_queue: RenderQueue = None, keyboard_cache_size = 8, scad_cache_size = 512, max_jobs = 100, job_ttl = 86400):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.output_folder = Path(output_folder)
+        self.host = host
+        self.port = port
+        self.render_queue = render_queue
+
+        self.keyboard_cache_size = keyboard_cache_size
+        self.scad_cache_size = scad_cache_size
+
+        self.max_jobs = max_jobs
+        self.job_ttl = job_ttl
+
+        self.job_dict = {}
+
+        # Least recently used first
+        self.keyboard_cache = collections.OrderedDict()
+        self.scad_cache = collections.OrderedDict()
+        self.scad_writer_dict = {}
+
+        # Keyboard objects keep the current section as state so parts are generated one at a time
+        self.generation_executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'generation')
+
+        self.loop = None
+
+
+    def get_hash(self, value):
+        return hashlib.sha256(json.dumps(value, sort_keys = True).encode('utf-8')).hexdigest()
+
+
+    def normalize_request(self, request_dict):
+        # Fill in defaults and check types so equivalent requests have the same hash
+        if isinstance(request_dict, dict) == False:
+            raise ValueError('Request must be a JSON object')
+
+        layout = request_dict.get('layout')
+        if isinstance(layout, str):
+            layout = parse_layout_text(layout)
+        if isinstance(layout, list) == False:
+            raise ValueError('layout must be keyboard layout editor JSON')
+
+        parameters = request_dict.get('parameters')
+        if parameters is not None and isinstance(parameters, dict) == False:
+            raise ValueError('parameters must be a JSON object')
+
+        parts = request_dict.get('parts')
+        if isinstance(parts, str):
+            parts = [part.strip() for part in parts.split(',') if part.strip() != '']
+        if parts is not None and isinstance(parts, list) == False:
+            raise ValueError('parts must be a list of part names')
+
+        name = str(request_dict.get('name', 'layout'))
+        if re.fullmatch('[A-Za-z0-9_.-]+', name) is None:
+            raise ValueError('name may only contain letters, numbers, _, . and -')
+
+        return {
+            'name': name,
+            'layout': layout,
+            'parameters': parameters,
+            'section': int(request_dict.get('section', -1)),
+            'all_sections': bool(request_dict.get('all_sections', False)),
+            'exploded': bool(request_dict.get('exploded', False)),
+            'parts': parts,
+            'fragments': int(request_dict.get('fragments', 8)),
+            'render': bool(request_dict.get('render', False))
+        }
+
+
+    def submit(self, request_dict):
+        request_dict = self.normalize_request(request_dict)
+
+        if request_dict['render'] == True and self.render_queue is None:
+            raise ValueError('This server does not render STL files')
+
+        job_id = self.get_hash(request_dict)[:16]
+
+        # Identical requests share the queued, running or finished job. Failed jobs are run again
+        job = self.job_dict.get(job_id)
+        if job is not None and job.status != GenerationJob.STATUS_FAILED:
+            job.submit_count += 1
+            self.logger.info('Coalesced submission into job %s', job_id)
+            return (job, True)
+
+        job = GenerationJob(job_id, request_dict, self.output_folder / job_id)
+        job.done_event = asyncio.Event()
+        self.job_dict[job_id] = job
+
+        self.remove_old_jobs()
+
+        self.loop.create_task(self.run_job(job))
+
+        self.logger.info('Submitted job %s', job_id)
+        return (job, False)
+
+
+    def remove_old_jobs(self):
+        # A resident server gets a new job for every unique request. Running jobs are never removed
+        now = time.time()
+        finished_job_list = sorted([job for job in self.job_dict.values() if job.is_finished()], key = lambda job: job.finished)
+
+        remove_count = max(0, len(self.job_dict) - self.max_jobs)
+        for (index, job) in enumerate(finished_job_list):
+            if index < remove_count or (self.job_ttl is not None and now - job.finished > self.job_ttl):
+                self.remove_job(job)
+
+
+    def remove_job(self, job: GenerationJob):
+        del self.job_dict[job.job_id]
+
+        if self.render_queue is not None:
+            self.render_queue.remove_completed_jobs(job.render_job_list)
+
+        shutil.rmtree(job.output_folder, ignore_errors = True)
+        self.logger.info('Removed job %s', job.job_id)
+
+
+    async def remove_old_jobs_loop(self):
+        while True:
+            await asyncio.sleep(self.REMOVE_INTERVAL)
+            self.remove_old_jobs()
+
+
+    async def run_job(self, job: GenerationJob):
+        try:
+            await self.loop.run_in_executor(self.generation_executor, self.generate, job)
+
+            if len(job.render_job_list) > 0:
+                job.status = GenerationJob.STATUS_RENDERING
+                await self.loop.run_in_executor(None, self.wait_for_renders, job)
+
+            job.status = GenerationJob.STATUS_DONE
+        except Exception as e:
+            self.logger.exception('Job %s failed', job.job_id)
+            job.error = str(e)
+            job.status = GenerationJob.STATUS_FAILED
+
+        job.finished = time.time()
+        job.done_event.set()
+
+
+    def get_keyboard(self, layout, parameter_dict):
+        keyboard_key = self.get_hash([layout, parameter_dict])
+
+        if keyboard_key in self.keyboard_cache:
+            self.keyboard_cache.move_to_end(keyboard_key)
+            self.logger.debug('Keyboard cache hit %s', keyboard_key)
+            return (keyboard_key, self.keyboard_cache[keyboard_key])
+
+        (parameters, keyboard) = build_keyboard(layout, parameter_dict)
+
+        self.keyboard_cache[keyboard_key] = keyboard
+        while len(self.keyboard_cache) > self.keyboard_cache_size:
+            self.keyboard_cache.popitem(last = False)
+
+        return (keyboard_key, keyboard)
+
+
+    def get_scad_writer(self, fragments):
+        if fragments not in self.scad_writer_dict:
+            self.scad_writer_dict[fragments] = ScadWriter(fragments)
+
+        return self.scad_writer_dict[fragments]
+
+
+    def get_scad_text(self, keyboard_key, keyboard: Keyboard, section, part_name, fragments):
+        scad_key = (keyboard_key, section, part_name, fragments)
+
+        if scad_key in self.scad_cache:
+            self.scad_cache.move_to_end(scad_key)
+            return self.scad_cache[scad_key]
+
+        scad_text = self.get_scad_writer(fragments).render(keyboard.get_part(section, part_name))
+
+        self.scad_cache[scad_key] = scad_text
+        while len(self.scad_cache) > self.scad_cache_size:
+            self.scad_cache.popitem(last = False)
+
+        return scad_text
+
+
+    def generate(self, job: GenerationJob):
+        # Runs in the generation thread
+        job.status = GenerationJob.STATUS_GENERATING
+        request_dict = job.request_dict
+
+        (keyboard_key, keyboard) = self.get_keyboard(request_dict['layout'], request_dict['parameters'])
+
+        part_name_list = None
+        if request_dict['parts'] is not None:
+            part_name_list = keyboard.get_part_names(request_dict['parts'])
+
+        part_list = keyboard.get_part_list(all_sections = request_dict['all_sections'], exploded = request_dict['exploded'], section = request_dict['section'], part_name_list = part_name_list)
+
+        scad_folder_path = job.output_folder / 'scad'
+        stl_folder_path = job.output_folder / 'stl'
+        scad_folder_path.mkdir(parents = True, exist_ok = True)
+        stl_folder_path.mkdir(parents = True, exist_ok = True)
+
+        scad_writer = self.get_scad_writer(request_dict['fragments'])
+
+        for (section, part_name) in part_list:
+            part_file_stem = keyboard.get_part_file_stem(request_dict['name'], section, part_name, exploded = request_dict['exploded'])
+            scad_file_name = scad_folder_path / (part_file_stem + '.scad')
+            stl_file_name = stl_folder_path / (part_file_stem + '.stl')
+
+            scad_text = self.get_scad_text(keyboard_key, keyboard, section, part_name, request_dict['fragments'])
+            scad_writer.write_text(scad_text, scad_file_name)
+            job.artifact_list.append(str(scad_file_name.relative_to(job.output_folder)))
+
+            if request_dict['render'] == True:
+                key_count = 0
+                if isinstance(section, int) and section > -1:
+                    key_count = keyboard.get_key_count(section)
+                elif section != 'global':
+                    key_count = keyboard.get_key_count(-1)
+
+                render_job = self.render_queue.add(scad_file_name, stl_file_name, request_dict['fragments'], part_name, key_count)
+                job.render_job_list.append(render_job)
+
+
+    def wait_for_renders(self, job: GenerationJob):
+        # Runs in a worker thread. STL files are added to the artifacts as each render completes
+        pending_list = list(job.render_job_list)
+
+        while len(pending_list) > 0:
+            for render_job in list(pending_list):
+                if render_job.completed_event.wait(0.1) == False:
+                    continue
+
+                pending_list.remove(render_job)
+                stl_file_name = str(Path(render_job.stl_file_name).relative_to(job.output_folder))
+                if render_job.status == RenderJob.STATUS_OK:
+                    job.artifact_list.append(stl_file_name)
+                else:
+                    job.failed_artifact_list.append(stl_file_name)
+
+        if len(job.failed_artifact_list) > 0:
+            raise RuntimeError('%d renders failed' % (len(job.failed_artifact_list)))
+
+
+    async def read_request(self, reader: asyncio.StreamReader):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        if request_line == '':
+            return None
+
+        (method, target, version) = request_line.split(' ', 2)
+
+        header_dict = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if line == '':
+                break
+
+            (name, value) = line.split(':', 1)
+            header_dict[name.strip().lower()] = value.strip()
+
+        content_length = int(header_dict.get('content-length', 0))
+        if content_length > self.MAX_BODY_SIZE:
+            raise ValueError('Request body too large')
+
+        body = b''
+        if content_length > 0:
+            body = await reader.readexactly(content_length)
+
+        return (method.upper(), target, header_dict, body)
+
+
+    async def write_response(self, writer: asyncio.StreamWriter, status_code, reason, body = b'', content_type = 'application/json', content_length = None):
+        if content_length is None:
+            content_length = len(body)
+
+        header_list = [
+            'HTTP/1.1 %d %s' % (status_code, reason),
+            'Content-Type: %s' % (content_type),
+            'Content-Length: %d' % (content_length),
+            'Connection: close'
+        ]
+        writer.write(('\r\n'.join(header_list) + '\r\n\r\n').encode('latin-1'))
+        writer.write(body)
+        await writer.drain()
+
+
+    async def write_json(self, writer: asyncio.StreamWriter, value, status_code = 200, reason = 'OK'):
+        await self.write_response(writer, status_code, reason, json.dumps(value).encode('utf-8'))
+
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await self.read_request(reader)
+            if request is not None:
+                await self.route(writer, *request)
+        except (ValueError, json.JSONDecodeError) as e:
+            await self.write_json(writer, {'error': str(e)}, 400, 'Bad Request')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            self.logger.exception('Request failed')
+            await self.write_json(writer, {'error': str(e)}, 500, 'Internal Server Error')
+        finally:
+            writer.close()
+
+
+    async def route(self, writer: asyncio.StreamWriter, method, target, header_dict, body):
+        url = urlsplit(target)
+        query_dict = parse_qs(url.query)
+        path_list = [path for path in url.path.split('/') if path != '']
+
+        self.logger.debug('%s %s', method, target)
+
+        if path_list == ['jobs'] and method == 'POST':
+            (job, coalesced) = self.submit(json.loads(body.decode('utf-8')))
+            response_dict = job.to_dict()
+            response_dict['coalesced'] = coalesced
+            await self.write_json(writer, response_dict, 202, 'Accepted')
+            return
+
+        if path_list == ['jobs'] and method == 'GET':
+            await self.write_json(writer, [job.to_dict() for job in self.job_dict.values()])
+            return
+
+        if len(path_list) < 2 or path_list[0] != 'jobs' or method != 'GET' or path_list[1] not in self.job_dict:
+            await self.write_json(writer, {'error': 'Not found'}, 404, 'Not Found')
+            return
+
+        job: GenerationJob = self.job_dict[path_list[1]]
+
+        if len(path_list) == 2:
+            if 'wait' in query_dict:
+                try:
+                    await asyncio.wait_for(job.done_event.wait(), float(query_dict['wait'][0]))
+                except asyncio.TimeoutError:
+                    pass
+
+            await self.write_json(writer, job.to_dict())
+
+        elif len(path_list) == 3 and path_list[2] == 'stream':
+            await self.stream_job(writer, job)
+
+        elif len(path_list) >= 4 and path_list[2] == 'artifacts' and '/'.join(path_list[3:]) in job.artifact_list:
+            await self.send_artifact(writer, job, '/'.join(path_list[3:]))
+
+        else:
+            await self.write_json(writer, {'error': 'Not found'}, 404, 'Not Found')
+
+
+    async def stream_job(self, writer: asyncio.StreamWriter, job: GenerationJob):
+        # Newline delimited JSON. The body ends when the connection closes
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n')
+
+        sent_count = 0
+        while True:
+            finished = job.is_finished()
+
+            while sent_count < len(job.artifact_list):
+                artifact_name = job.artifact_list[sent_count]
+                line = {'artifact': artifact_name, 'url': '/jobs/%s/artifacts/%s' % (job.job_id, artifact_name)}
+                writer.write((json.dumps(line) + '\n').encode('utf-8'))
+                sent_count += 1
+
+            await writer.drain()
+
+            if finished == True:
+                break
+
+            try:
+                await asyncio.wait_for(job.done_event.wait(), 0.25)
+            except asyncio.TimeoutError:
+                pass
+
+        writer.write((json.dumps(job.to_dict()) + '\n').encode('utf-8'))
+        await writer.drain()
+
+
+    async def send_artifact(self, writer: asyncio.StreamWriter, job: GenerationJob, artifact_name):
+        artifact_path = job.output_folder / artifact_name
+
+        content_type = 'text/plain; charset=utf-8'
+        if artifact_path.suffix == '.stl':
+            content_type = 'model/stl'
+
+        await self.write_response(writer, 200, 'OK', content_type = content_type, content_length = artifact_path.stat().st_size)
+
+        # Send the file in chunks so large STL files are not read into memory
+        with open(artifact_path, 'rb') as f:
+            while True:
+                chunk = await self.loop.run_in_executor(None, f.read, self.CHUNK_SIZE)
+                if len(chunk) == 0:
+                    break
+
+                writer.write(chunk)
+                await writer.drain()
+
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+
+        if self.render_queue is not None:
+            self.render_queue.start()
+
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+
+        if self.job_ttl is not None:
+            self.loop.create_task(self.remove_old_jobs_loop())
+
+        self.logger.info('Generation server listening on %s:%d', self.host, self.port)
+        print('Generation server listening on http://%s:%d' % (self.host, self.port))
+
+        async with server:
+            await server.serve_forever()
+
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.generation_executor.shutdown(wait = False)
@@ -11,6 +11,7 @@ from switch import Switch
 from support import Support
 from support_cutout import SupportCutout
 from cell import Cell
+from neighbor_index import NeighborIndex
 
 
 class ItemCollection:
@@ -25,6 +26,9 @@ class ItemCollection:
         self.get_collection_bounds_call_count = 0
         self.get_moved_union_call_count = 0
 
+        # Spatial index used to find neighbors. Built when neighbors are set and dropped once they are all set
+        self.neighbor_index = None
+
         # self.dot_recurse = graphviz.Digraph()
         # self.dot = graphviz.Digraph()
 
@@ -47,10 +51,31 @@ class ItemCollection:
 
         self.collection[rx][ry][x_offset][y_offset] = cell
 
+        # The neighbor index no longer matches the collection
+        self.neighbor_index = None
+
 
     def get_item(self, x_offset, y_offset, rx = 0.0, ry = 0.0) -> Cell:
         return self.collection[rx][ry][x_offset][y_offset]
 
+    def get_item_list(self):
+        # All items in collection order
+        item_list = []
+
+        for rx in self.get_rx_list():
+            for ry in self.get_ry_list_in_rx(rx):
+                for x in self.get_x_list_in_rx_ry(rx, ry):
+                    for y in self.get_y_list_in_rx_ry_x(x, rx, ry):
+                        item_list.append(self.get_item(x, y, rx, ry))
+
+        return item_list
+
+    def get_neighbor_index(self):
+        if self.neighbor_index is None:
+            self.neighbor_index = NeighborIndex(self.get_item_list())
+
+        return self.neighbor_index
+
     def get_item_with_value(self, value):
         for rx in self.get_rx_list():
             for ry in self.get_ry_list_in_rx(rx):
@@ -80,6 +105,16 @@ class ItemCollection:
         
         return True
 
+    def get_item_count(self):
+        item_count = 0
+
+        for rx in self.get_rx_list():
+            for ry in self.get_ry_list_in_rx(rx):
+                for x in self.get_x_list_in_rx_ry(rx, ry):
+                    item_count += len(self.get_y_list_in_rx_ry_x(x, rx, ry))
+
+        return item_count
+
     def get_rx_list(self):
         return self.collection.keys()
 
@@ -172,10 +207,18 @@ class ItemCollection:
         return solid
 
     
-    def set_collection_neighbors(self, neighbor_group = 'local'):
-        
+    def set_collection_neighbors(self, neighbor_group = 'local', neighbor_index: NeighborIndex = None):
+        # neighbor_index is the index of a collection this collection is part of, such as the whole keyboard for a
+        # section. It is limited to the items of this collection instead of building an index for this collection
 
         self.logger.debug('Set %s neighbors', neighbor_group)
+
+        # The index is built once for the whole collection instead of scanning every item for every item
+        if neighbor_index is None:
+            self.neighbor_index = NeighborIndex(self.get_item_list())
+        else:
+            self.neighbor_index = neighbor_index.get_section_index(self.get_item_list())
+
         for rx in self.get_rx_list():
             for ry in self.get_ry_list_in_rx(rx):
                 for x in self.get_x_list_in_rx_ry(rx, ry):
@@ -187,81 +230,75 @@ class ItemCollection:
                             # self.logger.debug('set_collection_neighbors call set_item_neighbor for switch %s', str(current_switch))
                             self.set_item_neighbor(current_switch, neighbor_group = neighbor_group)
 
+        # The index holds a reference to every item and is not needed once the neighbors are set
+        self.neighbor_index = None
+
     
     
-    def set_item_neighbor(self, item: Switch, neighbor_group = 'local', tabs = ''):
-        # self.logger.debug('%sSet neighbors for switch %s', tabs, str(item))
+    def set_item_neighbor(self, item: Switch, neighbor_group = 'local'):
+        # Set the neighbors of item, then of each neighbor that does not have all its neighbors set, and so on
+        #
+        # The neighbors are visited depth first in the same order as a recursive call for each neighbor would, so
+        # the results match, but with a list of open items instead of a Python stack frame per item. A long chain of
+        # keys can not hit the recursion limit. Each entry is [item, index of the next direction to visit]
+        direction_list = ['right', 'left', 'top', 'bottom']
+
+        open_item_list = []
+
+        self.find_item_neighbors(item, neighbor_group = neighbor_group)
+        if item.get_all_neighbors_set(neighbor_group = neighbor_group) == True:
+            open_item_list.append([item, 0])
+
+        while len(open_item_list) > 0:
+            open_item = open_item_list[-1]
+            current_item: Switch = open_item[0]
+
+            if open_item[1] >= len(direction_list):
+                open_item_list.pop()
+                continue
+
+            direction = direction_list[open_item[1]]
+            open_item[1] += 1
+
+            # Read when the direction is visited since setting the neighbors of an earlier neighbor can change it
+            neighbor: Switch = current_item.get_neighbor(direction, neighbor_group = neighbor_group)
+
+            if neighbor is not None and neighbor.get_all_neighbors_set(neighbor_group = neighbor_group) == False:
+                # self.logger.debug('\t\tset neighbors for neighbor switch %s', str(neighbor))
+                self.find_item_neighbors(neighbor, neighbor_group = neighbor_group)
+                if neighbor.get_all_neighbors_set(neighbor_group = neighbor_group) == True:
+                    open_item_list.append([neighbor, 0])
+
+
+    def find_item_neighbors(self, item: Switch, neighbor_group = 'local'):
+        # Set the closest neighbor of item in each direction, and item as the opposite neighbor of each of them
+        # self.logger.debug('Set neighbors for switch %s', str(item))
         
         x_min = item.x
         x_max = item.x + item.w
         y_min = item.y - item.h
         y_max = item.y
 
-        neighbor_list_dict = {
-            'right': [],
-            'left': [],
-            'top': [],
-            'bottom': []
-        }
-
-        neighbor_oposite_dict = {
-            'right': 'left',
-            'left': 'right',
-            'top': 'bottom',
-            'bottom': 'top'
-        }
-
-
-        for sib_rx in self.get_rx_list():
-            for sib_ry in self.get_ry_list_in_rx(sib_rx):
-                for sib_x in self.get_x_list_in_rx_ry(sib_rx, sib_ry):
-                    for sib_y in self.get_y_list_in_rx_ry_x(sib_x, sib_rx, sib_ry):
-                        sibling_switch = self.get_item(sib_x, sib_y, sib_rx, sib_ry)
-
-                        sib_x_min = sibling_switch.x
-                        sib_x_max = sibling_switch.x + sibling_switch.w
-                        sib_y_min = sibling_switch.y - sibling_switch.h
-                        sib_y_max = sibling_switch.y
-
-                        # check right neighbor
-                        if sib_y_max > y_min and sib_y_min < y_max and sib_x_min >= x_max:
-                            neighbor_list_dict['right'].append(sibling_switch)
-                            # right_neighbor_offset = sib_x_min - x_max
-                        # check left neighbor
-                        if sib_y_max > y_min and sib_y_min < y_max and sib_x_max <= x_min:
-                            neighbor_list_dict['left'].append(sibling_switch)
-                            # left_neighbor_offset = x_min - sib_x_max
-                        # check top neighbor
-                        if sib_x_max > x_min and sib_x_min < x_max and sib_y_min >= y_max:
-                            neighbor_list_dict['top'].append(sibling_switch)
-                            # top_neighbor_offset = sib_y_min - y_max
-                        # check bottom neighbor
-                        if sib_x_max > x_min and sib_x_min < x_max and sib_y_max <= y_min:
-                            neighbor_list_dict['bottom'].append(sibling_switch)
-                            # bottom_neighbor_offset = y_min - sib_y_max
-        
+        # The closest item in each direction that overlaps this item in the other axis
+        neighbor_index = self.get_neighbor_index()
+        closest_neighbor_dict = {direction: neighbor_index.get_neighbor(item, direction) for direction in ['right', 'left', 'top', 'bottom']}
 
-        for direction in neighbor_list_dict.keys():
+        for direction in closest_neighbor_dict.keys():
             # self.logger.debug('direction: %s', direction)
             offset = 0.0
             
-            if len(neighbor_list_dict[direction]) > 0: 
-                closest_neighbor: Switch = None
-
+            closest_neighbor: Switch = closest_neighbor_dict[direction]
+            if closest_neighbor is not None: 
                 if direction == 'right':
-                    closest_neighbor = min(neighbor_list_dict[direction], key=lambda item: item.x)
                     offset = closest_neighbor.x_min - x_max
                     perp_offset = closest_neighbor.y - item.y
                 elif direction == 'left':
-                    closest_neighbor = max(neighbor_list_dict[direction], key=lambda item: item.x)
                     offset = x_min - closest_neighbor.x_max
                     perp_offset = closest_neighbor.y - item.y
                 elif direction == 'top':
-                    closest_neighbor = min(neighbor_list_dict[direction], key=lambda item: item.y)
                     offset = closest_neighbor.y_min - y_max
                     perp_offset = closest_neighbor.x - item.x
                 elif direction == 'bottom':
-                    closest_neighbor = max(neighbor_list_dict[direction], key=lambda item: item.y)
                     offset = y_min - closest_neighbor.y_max
                     perp_offset = closest_neighbor.x - item.x
 
@@ -270,32 +307,10 @@ class ItemCollection:
                 closest_neighbor.update_all_neighbors_set(neighbor_group = neighbor_group)
             else:
                 # self.logger.debug('set switch %s no neighbor %s', str(item), direction)
-                closest_neighbor = None
                 item.set_neighbor(neighbor_name = direction, has_neighbor = False, neighbor_group = neighbor_group)
 
         item.update_all_neighbors_set(neighbor_group = neighbor_group)
 
-        all_neighbors_set = item.get_all_neighbors_set(neighbor_group = neighbor_group)
-
-        # pos = '%f,%f!' % (item.center_x, item.center_y)
-        # self.dot_recurse.node(item.cell_value, pos = pos)
-
-        if all_neighbors_set == True:
-            for direction in neighbor_list_dict.keys():
-                neighbor: Switch
-                neighbor = item.get_neighbor(direction, neighbor_group = neighbor_group)
-
-                if neighbor is not None:
-                    neighbor_all_neighbors_set = neighbor.get_all_neighbors_set(neighbor_group = neighbor_group)
-
-                    if neighbor_all_neighbors_set == False:
-                        # self.logger.debug('\t\tset neighbors for neighbor switch %s', str(neighbor))
-                        # pos = '%f,%f!' % (neighbor.center_x, neighbor.center_y)
-                        # self.dot_recurse.node(neighbor.cell_value, pos = pos)
-                        # self.dot_recurse.edge(item.cell_value, neighbor.cell_value)
-
-                        self.set_item_neighbor(neighbor, neighbor_group = neighbor_group, tabs = tabs + ' ')
-
 
 
     def draw_rotated_items(self, rx = 0.0, ry = 0.0):
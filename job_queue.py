@@ -0,0 +1,583 @@
+import functools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from atomic_file import write_bytes_atomic
+from render_queue import RenderJob, RenderQueue
+from render_cache import RenderCache
+from render_history import RenderHistory
+from openscad_output import get_output_tail
+
+
+
+class SharedJobQueue():
+    """
+    SQLite backed queue of render jobs shared between the generator and any number of render workers
+
+    Workers claim a job with a lease that they renew while the job is rendering. If a worker dies its lease
+    expires and the job is given to another worker until the job has been attempted max_attempts times
+
+    The default WAL journal needs shared memory, so the generator and every worker must run on the host that has
+    the queue file on a local filesystem. WAL does not work on NFS or SMB shares. Workers on other machines share
+    the queue file on a network share with the 'delete' rollback journal, which relies on the file locking of the
+    share. All processes using a queue file must use the same journal mode
+
+    ...
+
+    Attributes
+    ----------
+    db_file : str
+        The SQLite database file. It is created if it does not exist
+
+    journal_mode : str, default 'wal'
+        The SQLite journal mode, 'wal' or 'delete'
+
+    Methods
+    -------
+    submit(scad_text, stl_file_name, fragments = None, priority = 0.0, max_attempts = 3)
+        Add a job to the queue and return its job id
+    claim(worker_id, lease_seconds)
+        Claim the highest priority job that is queued or whose lease has expired. Returns None if there is none
+    renew_lease(job_id, worker_id, lease_seconds)
+        Extend the lease of a claimed job
+    finish(job_id, worker_id, return_code, stl_data, render_time, output = '', requeue = True)
+        Store the result of a job. output holds the RenderJob status. Failed jobs are queued again until they reach their max_attempts unless requeue is False
+    get_finished(job_id_list)
+        Get the done and failed jobs in job_id_list
+    get_progress(job_id_list)
+        Get the status, lease expiry time and attempts of the jobs in job_id_list by job id
+    remove(job_id)
+        Delete a job from the queue
+    purge(max_age_seconds)
+        Delete finished jobs and abandoned jobs older than max_age_seconds. Returns the number of jobs deleted
+    """
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    JOURNAL_MODE_LIST = ['wal', 'delete']
+
+    def __init__(self, db_file, journal_mode = 'wal'):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.db_file = str(db_file)
+        self.journal_mode = journal_mode
+
+        # sqlite3 connections can only be used by the thread that created them
+        self.thread_local = threading.local()
+
+        connection = self.get_connection()
+        # The journal mode is stored in the database file. It can not be changed while another process has it open
+        active_journal_mode = connection.execute('PRAGMA journal_mode=%s' % (self.journal_mode)).fetchone()[0]
+        if active_journal_mode.lower() != self.journal_mode:
+            self.logger.warning('%s uses journal mode %s instead of %s while other processes have it open', self.db_file, active_journal_mode, self.journal_mode)
+        connection.execute(
+            '''CREATE TABLE IF NOT EXISTS render_job (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT NOT NULL,
+                priority REAL NOT NULL DEFAULT 0,
+                scad_text TEXT NOT NULL,
+                stl_file_name TEXT NOT NULL,
+                fragments INTEGER,
+                worker_id TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                return_code INTEGER,
+                stl_data BLOB,
+                render_time REAL,
+                output TEXT,
+                created REAL,
+                finished REAL
+            )'''
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS render_job_status ON render_job (status, priority)')
+
+
+    def get_connection(self):
+        connection = getattr(self.thread_local, 'connection', None)
+
+        if connection is None:
+            # Transactions are started explicitly so a claim can lock the queue while it picks a job
+            connection = sqlite3.connect(self.db_file, timeout = 60, isolation_level = None)
+            connection.row_factory = sqlite3.Row
+            self.thread_local.connection = connection
+
+        return connection
+
+
+    def submit(self, scad_text, stl_file_name, fragments = None, priority = 0.0, max_attempts = 3):
+        cursor = self.get_connection().execute(
+            'INSERT INTO render_job (status, priority, scad_text, stl_file_name, fragments, max_attempts, created) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self.STATUS_QUEUED, priority, scad_text, str(stl_file_name), fragments, max_attempts, time.time())
+        )
+
+        return cursor.lastrowid
+
+
+    def claim(self, worker_id, lease_seconds):
+        connection = self.get_connection()
+        now = time.time()
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs whose worker stopped renewing the lease and have no attempts left are failed
+            connection.execute(
+                'UPDATE render_job SET status = ?, finished = ?, output = ? WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts',
+                (self.STATUS_FAILED, now, RenderJob.STATUS_KILLED, self.STATUS_RUNNING, now)
+            )
+
+            row = connection.execute(
+                'SELECT job_id, scad_text, stl_file_name, fragments, attempts FROM render_job '
+                'WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY priority DESC, job_id LIMIT 1',
+                (self.STATUS_QUEUED, self.STATUS_RUNNING, now)
+            ).fetchone()
+
+            if row is not None:
+                connection.execute(
+                    'UPDATE render_job SET status = ?, worker_id = ?, lease_expires = ?, attempts = attempts + 1 WHERE job_id = ?',
+                    (self.STATUS_RUNNING, worker_id, now + lease_seconds, row['job_id'])
+                )
+
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
+
+        if row is None:
+            return None
+
+        return dict(row)
+
+
+    def renew_lease(self, job_id, worker_id, lease_seconds):
+        cursor = self.get_connection().execute(
+            'UPDATE render_job SET lease_expires = ? WHERE job_id = ? AND worker_id = ? AND status = ?',
+            (time.time() + lease_seconds, job_id, worker_id, self.STATUS_RUNNING)
+        )
+
+        # False if the job was given to another worker
+        return cursor.rowcount > 0
+
+
+    def finish(self, job_id, worker_id, return_code, stl_data, render_time, output = '', requeue = True):
+        connection = self.get_connection()
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT attempts, max_attempts, worker_id FROM render_job WHERE job_id = ?', (job_id,)).fetchone()
+
+            # Ignore results from a worker that lost its lease
+            if row is None or row['worker_id'] != worker_id:
+                connection.execute('COMMIT')
+                return
+
+            if return_code == 0:
+                status = self.STATUS_DONE
+            elif requeue == True and row['attempts'] < row['max_attempts']:
+                status = self.STATUS_QUEUED
+            else:
+                status = self.STATUS_FAILED
+
+            connection.execute(
+                'UPDATE render_job SET status = ?, return_code = ?, stl_data = ?, render_time = ?, output = ?, finished = ?, lease_expires = NULL WHERE job_id = ?',
+                (status, return_code, stl_data, render_time, output, time.time(), job_id)
+            )
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
+
+
+    def get_finished(self, job_id_list):
+        if len(job_id_list) == 0:
+            return []
+
+        placeholders = ','.join('?' * len(job_id_list))
+        row_list = self.get_connection().execute(
+            'SELECT job_id, status, return_code, stl_data, render_time, attempts, output FROM render_job WHERE status IN (?, ?) AND job_id IN (%s)' % (placeholders),
+            [self.STATUS_DONE, self.STATUS_FAILED] + list(job_id_list)
+        ).fetchall()
+
+        return [dict(row) for row in row_list]
+
+
+    def get_progress(self, job_id_list):
+        # The status, lease and attempts of each job. A worker claiming, renewing or finishing a job changes them
+        if len(job_id_list) == 0:
+            return {}
+
+        placeholders = ','.join('?' * len(job_id_list))
+        row_list = self.get_connection().execute(
+            'SELECT job_id, status, lease_expires, attempts FROM render_job WHERE job_id IN (%s)' % (placeholders),
+            list(job_id_list)
+        ).fetchall()
+
+        return {row['job_id']: (row['status'], row['lease_expires'], row['attempts']) for row in row_list}
+
+
+    def get_queued_count(self):
+        row = self.get_connection().execute('SELECT COUNT(*) FROM render_job WHERE status IN (?, ?)', (self.STATUS_QUEUED, self.STATUS_RUNNING)).fetchone()
+
+        return row[0]
+
+
+    def remove(self, job_id):
+        self.get_connection().execute('DELETE FROM render_job WHERE job_id = ?', (job_id,))
+
+
+    def purge(self, max_age_seconds):
+        # The generator removes the jobs it collects, so old rows are left by generators that were interrupted.
+        # Running jobs whose lease is still being renewed are kept however old they are
+        now = time.time()
+        cutoff = now - max_age_seconds
+
+        cursor = self.get_connection().execute(
+            'DELETE FROM render_job WHERE (status IN (?, ?) AND finished < ?) '
+            'OR (status IN (?, ?) AND created < ? AND (lease_expires IS NULL OR lease_expires < ?))',
+            (self.STATUS_DONE, self.STATUS_FAILED, cutoff, self.STATUS_QUEUED, self.STATUS_RUNNING, cutoff, now)
+        )
+
+        if cursor.rowcount > 0:
+            self.logger.info('Purged %d render jobs older than %.0fs from %s', cursor.rowcount, max_age_seconds, self.db_file)
+
+        return cursor.rowcount
+
+
+
+class DistributedRenderQueue(RenderQueue):
+    """
+    RenderQueue that sends renders to render workers through a SharedJobQueue instead of running OpenSCAD locally
+
+    ...
+
+    Attributes
+    ----------
+    db_file : str
+        The SQLite database file shared with the render workers
+
+    journal_mode : str, default 'wal'
+        The SQLite journal mode of the queue file, see SharedJobQueue
+
+    render_cache : RenderCache, default None
+        Cache of previously rendered STL files. Cache hits are never sent to the workers
+
+    render_history : RenderHistory, default None
+        Previous render times. Workers claim the longest predicted renders first
+
+    poll_interval : float, default 0.5
+        Seconds between checks for finished jobs
+
+    max_attempts : int, default 3
+        The number of times a job is attempted before it is marked as failed
+
+    max_job_age : float, default 86400
+        Jobs left in the queue for longer than this many seconds by an earlier run are deleted when the queue starts
+
+    stall_timeout : float, default 300
+        join fails the jobs still pending when no worker claimed, renewed the lease of or finished any of them for this
+        many seconds. Workers renew their leases every third of the lease time, so it has to be longer than that.
+        None waits forever
+    """
+
+    def __init__(self, db_file, render_cache: RenderCache = None, render_history: RenderHistory = None, poll_interval = 0.5, max_attempts = 3, max_job_age = 86400, stall_timeout = 300, journal_mode = 'wal'):
+        super().__init__(jobs = 1, render_cache = render_cache, render_history = render_history)
+
+        self.shared_job_queue = SharedJobQueue(db_file, journal_mode)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_job_age = max_job_age
+        self.stall_timeout = stall_timeout
+
+        self.pending_job_dict = {}
+
+
+    def start(self):
+        # Jobs are rendered by the render workers. Jobs an interrupted run left behind are removed
+        if self.max_job_age is not None:
+            self.shared_job_queue.purge(self.max_job_age)
+
+
+    def enqueue(self, job: RenderJob):
+        with open(job.scad_file_name, encoding = 'utf-8') as f:
+            scad_text = f.read()
+
+        job_id = self.shared_job_queue.submit(scad_text, job.stl_file_name, job.fragments, job.predicted_time, self.max_attempts)
+        self.pending_job_dict[job_id] = job
+
+        self.logger.info('Submitted render of %s as job %d, predicted time: %.2fs', job.stl_file_name, job_id, job.predicted_time)
+
+
+    def get_pending_jobs(self):
+        # Jobs submitted to the shared queue that have not finished
+        return list(self.pending_job_dict.values())
+
+
+    def join(self):
+        self.logger.info('Waiting for %d render jobs in %s', len(self.pending_job_dict), self.shared_job_queue.db_file)
+
+        # Without a worker the jobs are never claimed. The wait ends when the pending jobs stop changing
+        last_progress = None
+        last_progress_time = time.monotonic()
+
+        while len(self.pending_job_dict) > 0:
+            for row in self.shared_job_queue.get_finished(list(self.pending_job_dict.keys())):
+                job: RenderJob = self.pending_job_dict.pop(row['job_id'])
+
+                job.return_code = row['return_code']
+                if job.return_code is None:
+                    job.return_code = -1
+
+                # Jobs whose lease expired only have a status
+                try:
+                    output_dict = json.loads(row['output'])
+                except (TypeError, ValueError):
+                    output_dict = {'status': row['output']}
+
+                if isinstance(output_dict, dict) == False:
+                    output_dict = {'status': row['output']}
+
+                job.status = output_dict.get('status') or RenderJob.STATUS_FAILED
+                job.stats = output_dict.get('stats') or {}
+                job.output = output_dict.get('output') or ''
+                job.fallback_fragments = output_dict.get('fallback_fragments')
+                job.attempt_list = output_dict.get('attempt_list') or []
+                if row['status'] == SharedJobQueue.STATUS_DONE:
+                    job.status = RenderJob.STATUS_OK
+
+                render_time = row['render_time'] or 0.0
+                job.end_time = time.monotonic()
+                job.start_time = job.end_time - render_time
+
+                if row['status'] == SharedJobQueue.STATUS_DONE:
+                    write_bytes_atomic(job.stl_file_name, row['stl_data'])
+                else:
+                    self.logger.error('Render job %d failed after %d attempts: %s', row['job_id'], row['attempts'], job.status)
+
+                self.shared_job_queue.remove(row['job_id'])
+                self.complete(job)
+
+            if len(self.pending_job_dict) > 0 and self.stall_timeout is not None:
+                progress = self.shared_job_queue.get_progress(list(self.pending_job_dict.keys()))
+                if progress != last_progress:
+                    last_progress = progress
+                    last_progress_time = time.monotonic()
+                elif time.monotonic() - last_progress_time >= self.stall_timeout:
+                    self.fail_stalled_jobs(progress)
+
+            if len(self.pending_job_dict) > 0:
+                time.sleep(self.poll_interval)
+
+        if self.render_history is not None:
+            self.render_history.save()
+
+        return self.completed_job_list
+
+
+    def fail_stalled_jobs(self, progress):
+        # No worker made progress on the pending jobs. They are removed from the shared queue so a worker started
+        # later does not render them for a generator that is no longer waiting
+        self.logger.error('No render worker made progress for %.0fs. %d render jobs still pending in %s', self.stall_timeout, len(self.pending_job_dict), self.shared_job_queue.db_file)
+        self.print_status('No render worker made progress for %.0fs. Is a worker running on %s?' % (self.stall_timeout, self.shared_job_queue.db_file))
+
+        for (job_id, job) in list(self.pending_job_dict.items()):
+            (status, unused_lease_expires, attempts) = progress.get(job_id, (None, None, 0))
+            self.logger.error('Render job %d still %s after %d attempts: %s', job_id, status, attempts, job.stl_file_name)
+
+            del self.pending_job_dict[job_id]
+            self.shared_job_queue.remove(job_id)
+
+            job.return_code = -1
+            job.status = RenderJob.STATUS_TIMEOUT
+            job.end_time = time.monotonic()
+            if job.start_time is None:
+                job.start_time = job.end_time
+
+            self.complete(job)
+
+
+
+class RenderWorker():
+    """
+    Claim render jobs from a SharedJobQueue, render them with OpenSCAD and store the STL in the queue
+
+    ...
+
+    Attributes
+    ----------
+    db_file : str
+        The SQLite database file shared with the generator
+
+    journal_mode : str, default 'wal'
+        The SQLite journal mode of the queue file, see SharedJobQueue
+
+    jobs : int, default os.cpu_count()
+        The number of jobs rendered at the same time
+
+    lease_seconds : float, default 60
+        How long a claim lasts without being renewed. Leases are renewed while a job renders
+
+    poll_interval : float, default 1.0
+        Seconds to wait before checking for jobs again when the queue is empty
+
+    idle_exit : float, default None
+        Exit after the queue has been empty for this many seconds. None runs until interrupted
+
+    timeout : float, default None
+        Seconds a render may run before it is killed. None waits forever
+
+    memory_limit_mb : float, default None
+        Address space limit applied to each OpenSCAD process in megabytes
+
+    retries : int, default 1
+        The number of times a failed, timed out or killed render is retried with half the $fn, the same as RenderQueue.
+        A job whose OpenSCAD process could not be started is given back to the queue for another worker instead
+
+    max_job_age : float, default 86400
+        Jobs older than this many seconds that no generator collected are deleted when the worker starts and
+        then every purge_interval seconds. None keeps them
+
+    Methods
+    -------
+    run()
+        Render jobs until idle_exit is reached or the worker is interrupted
+    """
+
+    # Seconds between purges of old jobs while the worker runs
+    PURGE_INTERVAL = 3600
+
+    def __init__(self, db_file, jobs = None, lease_seconds = 60, poll_interval = 1.0, idle_exit = None, timeout = None, memory_limit_mb = None, retries = 1, max_job_age = 86400, journal_mode = 'wal'):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        if jobs is None or jobs < 1:
+            jobs = os.cpu_count() or 1
+
+        self.shared_job_queue = SharedJobQueue(db_file, journal_mode)
+        self.jobs = jobs
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.idle_exit = idle_exit
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.retries = retries
+        self.max_job_age = max_job_age
+
+        # Only one claim thread purges the queue at a time
+        self.purge_lock = threading.Lock()
+        self.last_purge_time = None
+
+        self.worker_name = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.rendered_count = 0
+
+
+    def run(self):
+        print('Render worker %s started on %s, concurrent renders: %d' % (self.worker_name, self.shared_job_queue.db_file, self.jobs))
+
+        self.purge()
+
+        thread_list = []
+        for thread_number in range(self.jobs):
+            thread = threading.Thread(target = self.claim_loop, args = ('%s:%d' % (self.worker_name, thread_number),), daemon = True)
+            thread.start()
+            thread_list.append(thread)
+
+        for thread in thread_list:
+            thread.join()
+
+        print('Render worker %s stopped, jobs rendered: %d' % (self.worker_name, self.rendered_count))
+
+
+    def purge(self):
+        if self.max_job_age is None:
+            return
+
+        with self.purge_lock:
+            if self.last_purge_time is not None and time.monotonic() - self.last_purge_time < self.PURGE_INTERVAL:
+                return
+
+            self.last_purge_time = time.monotonic()
+            self.shared_job_queue.purge(self.max_job_age)
+
+
+    def claim_loop(self, worker_id):
+        idle_start = time.monotonic()
+
+        while True:
+            claimed_job = self.shared_job_queue.claim(worker_id, self.lease_seconds)
+
+            if claimed_job is None:
+                if self.idle_exit is not None and time.monotonic() - idle_start > self.idle_exit:
+                    break
+
+                self.purge()
+                time.sleep(self.poll_interval)
+                continue
+
+            self.render(worker_id, claimed_job)
+            idle_start = time.monotonic()
+
+
+    def render(self, worker_id, claimed_job):
+        job_id = claimed_job['job_id']
+        print('Render Start: job %d: %s (attempt %d)' % (job_id, claimed_job['stl_file_name'], claimed_job['attempts'] + 1))
+
+        with tempfile.TemporaryDirectory(prefix = 'keyboard_render_') as temp_folder:
+            scad_file_path = Path(temp_folder) / 'part.scad'
+            stl_file_path = Path(temp_folder) / 'part.stl'
+            scad_file_path.write_text(claimed_job['scad_text'], encoding = 'utf-8')
+
+            job = RenderJob(scad_file_path, stl_file_path, claimed_job['fragments'])
+
+            # Keep the lease while OpenSCAD runs
+            render_done = threading.Event()
+            heartbeat = threading.Thread(target = self.heartbeat, args = (job_id, worker_id, render_done), daemon = True)
+            heartbeat.start()
+
+            try:
+                job.run_with_retries(self.timeout, self.memory_limit_mb, self.retries, functools.partial(self.print_retry, job_id, claimed_job['stl_file_name']))
+            finally:
+                render_done.set()
+                heartbeat.join()
+
+            stl_data = None
+            if job.return_code == 0 and stl_file_path.is_file():
+                stl_data = stl_file_path.read_bytes()
+            elif job.return_code == 0:
+                job.return_code = -1
+
+        # The status, the OpenSCAD statistics and the end of the OpenSCAD output are sent back to the generator
+        output = json.dumps({
+            'status': job.status,
+            'stats': job.stats,
+            'output': get_output_tail(job.output),
+            'fallback_fragments': job.fallback_fragments,
+            'attempt_list': job.attempt_list
+        })
+
+        # Lower $fn retries were already made. Only a worker that could not start OpenSCAD gives the job to another worker
+        self.shared_job_queue.finish(job_id, worker_id, job.return_code, stl_data, job.get_wall_time(), output, requeue = job.status == RenderJob.STATUS_ERROR)
+        self.rendered_count += 1
+
+        print('Render %s: job %d: %s (%.2fs)' % ('Complete' if job.return_code == 0 else 'Failed', job_id, claimed_job['stl_file_name'], job.get_wall_time()))
+
+
+    def print_retry(self, job_id, stl_file_name, job: RenderJob, retry_number, fragments):
+        print('Render %s: job %d: %s (retry %d with $fn = %s)' % (job.status.capitalize(), job_id, stl_file_name, retry_number, str(fragments)))
+
+
+    def heartbeat(self, job_id, worker_id, render_done: threading.Event):
+        while render_done.wait(self.lease_seconds / 3) == False:
+            if self.shared_job_queue.renew_lease(job_id, worker_id, self.lease_seconds) == False:
+                self.logger.warning('Lost lease on job %d', job_id)
+                break
@@ -1,5 +1,6 @@
 
 
+import contextlib
 import math
 import logging
 import sys
@@ -12,6 +13,7 @@ from support import Support
 from support_cutout import SupportCutout
 from cell import Cell
 from item_collection import ItemCollection
+from neighbor_index import NeighborIndex
 from rotation_collection import RotationCollection
 from body import Body
 from pcb import PCB
@@ -24,6 +26,50 @@ from shape_cutout import ShapeCutout
 
 class Keyboard():
 
+    # get_assembly arguments used to build each part
+    PART_ASSEMBLY_ARGUMENT_DICT = {
+        'top': {'top': True},
+        'bottom': {'bottom': True},
+        'all': {'all': True},
+        'plate': {'plate_only': True}
+    }
+
+    # The parts and assembly subtrees each target depends on. get_assembly only builds the subtrees
+    # the requested part needs and --parts only builds the selected targets
+    PART_DEPENDENCY_DICT = {
+        'top': ['top_assembly'],
+        'plate': ['top_assembly'],
+        'bottom': ['bottom_assembly'],
+        'all': ['top_assembly', 'bottom_assembly'],
+        'top_assembly': ['case', 'switch_cutouts', 'pcb', 'screw_holes', 'cable_hole'],
+        'bottom_assembly': ['bottom_cover', 'screw_holes'],
+        'cable_holder_main': [],
+        'cable_holder_clamp': [],
+        'cable_holder_all': ['cable_holder_main', 'cable_holder_clamp'],
+        'cable_holder': ['cable_holder_main', 'cable_holder_clamp', 'cable_holder_all']
+    }
+
+    # Parts that do not depend on the sections
+    GLOBAL_PART_LIST = ['cable_holder_main', 'cable_holder_clamp', 'cable_holder_all']
+
+    # The subtrees from PART_DEPENDENCY_DICT each parameter changes. 'sections' stands for every part that is
+    # split into sections. Parameters that are not listed are assumed to change every part
+    PARAMETER_DEPENDENCY_DICT = {
+        'switch_type': ['switch_cutouts'],
+        'stabilizer_type': ['switch_cutouts'],
+        'kerf': ['switch_cutouts'],
+        'custom_shape': ['switch_cutouts'],
+        'custom_shape_points': ['switch_cutouts'],
+        'custom_shape_path': ['switch_cutouts'],
+        'x_build_size': ['sections'],
+        'y_build_size': ['sections'],
+        'cable_diameter': ['cable_hole', 'cable_holder_main', 'cable_holder_clamp'],
+        'cable_hole_width': ['cable_hole', 'cable_holder_main', 'cable_holder_clamp'],
+        'cable_hole_height': ['cable_hole', 'cable_holder_main', 'cable_holder_clamp'],
+        'cable_hole_up_offset': ['cable_hole', 'cable_holder_main', 'cable_holder_clamp'],
+        'cable_hole_down_offset': ['cable_hole', 'cable_holder_main', 'cable_holder_clamp']
+    }
+
     def __init__(self, parameters: Parameters = Parameters()):
 
         self.parameters = parameters
@@ -75,9 +121,34 @@ class Keyboard():
 
         self.cable = Cable(parameters)
 
+        # Set to a RunReport to record the time taken by each phase
+        self.run_report = None
+
+        # Cache of processed layouts. None processes the layout on every run
+        self.layout_cache = None
+
+        # (key, switch, support, support_cutout) for each key in layout order. key is
+        # [x_offset, y_offset, w, h, rotation, rx, ry, cell_value]
+        self.key_list = []
+
+        # Spatial index of every switch, shared by the global and the local neighbor search of the sections
+        self.neighbor_index = None
+
 
 
     def process_keyboard_layout(self, keyboard_layout_dict):
+        # A layout processed by an earlier run with the same placement parameters is restored from the layout cache
+        layout_cache_key = None
+        if self.layout_cache is not None:
+            layout_cache_key = self.layout_cache.get_key(keyboard_layout_dict, self.parameters)
+            processed_layout_dict = self.layout_cache.load(layout_cache_key)
+
+            if processed_layout_dict is not None:
+                self.logger.info('Processed layout loaded from the layout cache')
+                with self.time_phase('layout_cache_restore'):
+                    self.restore_processed_layout(processed_layout_dict)
+                return
+
         y = 0.0
         rotation = 0.0
         rx = 0.0
@@ -132,22 +203,7 @@ class Keyboard():
                         x_offset = x
                         y_offset = -(y)
 
-                        switch = Switch(x_offset, y_offset, w, h, rotation = rotation, cell_value = col_escaped, switch_config = self.switch_config, parameters = self.parameters)
-                        support = Support(x_offset, y_offset, w, h, self.parameters.plate_thickness, self.parameters.support_bar_height, self.parameters.support_bar_width, rotation = rotation, parameters = self.parameters)
-                        support_cutout = SupportCutout(x_offset, y_offset, w, h, self.parameters.plate_thickness, self.parameters.support_bar_height, self.parameters.support_bar_width, rotation = rotation, parameters = self.parameters)
-
-                        # Create switch cutout and support object without rotation
-                        if rotation == 0.0:
-                            self.switch_collection.add_item(x_offset, y_offset, switch)    
-                            self.support_collection.add_item(x_offset, y_offset, support)
-                            self.support_cutout_collection.add_item(x_offset, y_offset, support_cutout)
-                            
-                            
-                        # Create switch cutout and support object without rotation
-                        elif rotation != 0.0:
-                            self.switch_rotation_collection.add_item(rotation, x_offset, y_offset, switch, rx, ry)
-                            self.support_rotation_collection.add_item(rotation, x_offset, y_offset, support, rx, ry)
-                            self.support_cutout_rotation_collection.add_item(rotation, x_offset, y_offset, support_cutout, rx, ry)
+                        self.add_key(x_offset, y_offset, w, h, rotation, rx, ry, col_escaped)
 
                         x += w    
                         w = 1.0
@@ -158,10 +214,135 @@ class Keyboard():
 
                 y += 1
 
-        self.switch_collection.set_collection_neighbors('global')
+        with self.time_phase('global_neighbors'):
+            self.neighbor_index = NeighborIndex(self.switch_collection.get_item_list())
+            self.switch_collection.set_collection_neighbors('global', neighbor_index = self.neighbor_index)
 
         # create sections of the keyboard for usin in splitting for printing
-        self.split_keyboard()
+        with self.time_phase('split_keyboard'):
+            self.split_keyboard()
+
+        if self.layout_cache is not None:
+            self.layout_cache.save(layout_cache_key, self.get_processed_layout())
+
+
+    def add_key(self, x_offset, y_offset, w, h, rotation, rx, ry, cell_value):
+        switch = Switch(x_offset, y_offset, w, h, rotation = rotation, cell_value = cell_value, switch_config = self.switch_config, parameters = self.parameters)
+        support = Support(x_offset, y_offset, w, h, self.parameters.plate_thickness, self.parameters.support_bar_height, self.parameters.support_bar_width, rotation = rotation, parameters = self.parameters)
+        support_cutout = SupportCutout(x_offset, y_offset, w, h, self.parameters.plate_thickness, self.parameters.support_bar_height, self.parameters.support_bar_width, rotation = rotation, parameters = self.parameters)
+
+        # Create switch cutout and support object without rotation
+        if rotation == 0.0:
+            self.switch_collection.add_item(x_offset, y_offset, switch)    
+            self.support_collection.add_item(x_offset, y_offset, support)
+            self.support_cutout_collection.add_item(x_offset, y_offset, support_cutout)
+            
+            
+        # Create switch cutout and support object without rotation
+        elif rotation != 0.0:
+            self.switch_rotation_collection.add_item(rotation, x_offset, y_offset, switch, rx, ry)
+            self.support_rotation_collection.add_item(rotation, x_offset, y_offset, support, rx, ry)
+            self.support_cutout_rotation_collection.add_item(rotation, x_offset, y_offset, support_cutout, rx, ry)
+
+        self.key_list.append(([x_offset, y_offset, w, h, rotation, rx, ry, cell_value], switch, support, support_cutout))
+
+
+    def get_processed_layout(self):
+        # The keys, the neighbor graph and the sections as a JSON serializable dict for the layout cache
+        # Switches are referred to by their index in the key list
+        switch_index_dict = {id(switch): index for (index, (key, switch, support, support_cutout)) in enumerate(self.key_list)}
+
+        neighbor_list = []
+        for (key, switch, support, support_cutout) in self.key_list:
+            # Only switches without rotation have neighbors
+            if key[4] != 0.0:
+                neighbor_list.append(None)
+                continue
+
+            neighbor_list.append({
+                neighbor_group: self.get_neighbor_record(switch, neighbor_group, switch_index_dict) for neighbor_group in ['global', 'local']
+            })
+
+        section_list = []
+        for section in self.switch_section_list:
+            section_index_list = []
+            for rx in section.get_rx_list():
+                for ry in section.get_ry_list_in_rx(rx):
+                    for x in section.get_x_list_in_rx_ry(rx, ry):
+                        for y in section.get_y_list_in_rx_ry_x(x, rx, ry):
+                            section_index_list.append(switch_index_dict[id(section.get_item(x, y, rx, ry))])
+            section_list.append(section_index_list)
+
+        return {
+            'keys': [key for (key, switch, support, support_cutout) in self.key_list],
+            'neighbors': neighbor_list,
+            'sections': section_list
+        }
+
+
+    def get_neighbor_record(self, switch: Switch, neighbor_group, switch_index_dict):
+        neighbor_dict = switch.global_neighbors if neighbor_group == 'global' else switch.local_neighbors
+
+        neighbor_record = {'neighbor_check_complete': neighbor_dict['neighbor_check_complete']}
+        for direction in switch.get_neighbor_direction_list():
+            # Directions that were never checked stay empty
+            if len(neighbor_dict[direction].keys()) == 0:
+                continue
+
+            neighbor = neighbor_dict[direction]['neighbor']
+            neighbor_record[direction] = [
+                neighbor_dict[direction]['has_neighbor'],
+                None if neighbor is None else switch_index_dict[id(neighbor)],
+                neighbor_dict[direction]['offset'],
+                neighbor_dict[direction]['perp_offset']
+            ]
+
+        return neighbor_record
+
+
+    def restore_processed_layout(self, processed_layout_dict):
+        # Rebuild the keys from a processed layout from get_processed_layout instead of processing the layout
+        # The switch, support and support cutout objects are created with the current parameters
+        for (x_offset, y_offset, w, h, rotation, rx, ry, cell_value) in processed_layout_dict['keys']:
+            self.add_key(x_offset, y_offset, w, h, rotation, rx, ry, cell_value)
+
+        for ((key, switch, support, support_cutout), neighbor_group_dict) in zip(self.key_list, processed_layout_dict['neighbors']):
+            if neighbor_group_dict is None:
+                continue
+
+            for (neighbor_group, neighbor_record) in neighbor_group_dict.items():
+                for direction in switch.get_neighbor_direction_list():
+                    if direction not in neighbor_record.keys():
+                        continue
+
+                    (has_neighbor, neighbor_index, offset, perp_offset) = neighbor_record[direction]
+                    neighbor = None if neighbor_index is None else self.key_list[neighbor_index][1]
+                    switch.set_neighbor(neighbor = neighbor, neighbor_name = direction, offset = offset, has_neighbor = has_neighbor, neighbor_group = neighbor_group, perp_offset = perp_offset)
+
+                neighbor_dict = switch.global_neighbors if neighbor_group == 'global' else switch.local_neighbors
+                neighbor_dict['neighbor_check_complete'] = neighbor_record['neighbor_check_complete']
+
+        self.switch_section_list = []
+        self.support_section_list = []
+        self.support_cutout_section_list = []
+        for section_index_list in processed_layout_dict['sections']:
+            self.switch_section_list.append(ItemCollection())
+            self.support_section_list.append(ItemCollection())
+            self.support_cutout_section_list.append(ItemCollection())
+
+            for index in section_index_list:
+                (key, switch, support, support_cutout) = self.key_list[index]
+                self.switch_section_list[-1].add_item(key[0], key[1], switch)
+                self.support_section_list[-1].add_item(key[0], key[1], support)
+                self.support_cutout_section_list[-1].add_item(key[0], key[1], support_cutout)
+
+
+    def time_phase(self, name, **info):
+        # Time a phase in the run report. Does nothing when there is no run report
+        if self.run_report is None:
+            return contextlib.nullcontext()
+
+        return self.run_report.time_phase(name, **info)
 
     def process_custom_shapes(self):
         
@@ -179,6 +360,28 @@ class Keyboard():
                     self.custom_polygon_collection.add_item(x, y, custom_shape)
 
 
+    def set_case_dimensions(self):
+        # Get the x and y bounds of the switches
+        (min_x, max_x, max_y, min_y) = self.switch_collection.get_collection_bounds()
+
+        (rotated_min_x, rotated_max_x, rotated_max_y, rotated_min_y) = self.switch_rotation_collection.get_real_collection_bounds()
+
+        self.logger.debug('rotation_bounds: rotated_min_x: %f, rotated_max_x: %f, rotated_max_y: %f, rotated_min_y: %f', 
+            rotated_min_x, rotated_max_x, rotated_max_y, rotated_min_y)
+
+        if rotated_min_x < min_x:
+            min_x = rotated_min_x
+        if rotated_max_x > max_x:
+            max_x = rotated_max_x
+        if rotated_min_y < min_y:
+            min_y = rotated_min_y
+        if rotated_max_y > max_y:
+            max_y = rotated_max_y
+
+        # Set body dimensions
+        self.parameters.set_dimensions(max_x, min_y, min_x, max_y)
+
+
     def get_assembly(self, top = False, bottom = False, all = True, plate_only = False):
         
         
@@ -186,8 +389,20 @@ class Keyboard():
         top_assembly = union()
         bottom_assembly = union()
 
-        # Get the x and y bounds of the switches
-        (min_x, max_x, max_y, min_y) = self.switch_collection.get_collection_bounds()
+        # Only build the subtrees the requested part depends on
+        if top == True or plate_only == True:
+            dependency_set = self.get_part_dependency_set('top')
+        elif bottom == True:
+            dependency_set = self.get_part_dependency_set('bottom')
+        else:
+            dependency_set = self.get_part_dependency_set('all')
+
+        # Start from empty cutout and support unions so an assembly only contains its own items
+        # and does not depend on the assemblies that were built before it
+        self.switch_cutouts = union()
+        self.switch_supports = union()
+        self.switch_support_cutouts = union()
+        self.custom_polygon_cutout_collection = union()
 
         # Add all switch and support collection objects to switch and support attributes
         support_collection = self.support_collection
@@ -199,35 +414,22 @@ class Keyboard():
             switch_collection = self.switch_section_list[self.desired_section_number]
             support_cutout_collection = self.support_cutout_section_list[self.desired_section_number]
 
-        self.switch_supports += support_collection.get_moved_union()
-        self.switch_cutouts += switch_collection.get_moved_union()
-        self.switch_support_cutouts += support_cutout_collection.get_moved_union()
-
-        if self.parameters.custom_polygons is not None:
-            self.custom_polygon_cutout_collection = self.custom_polygon_collection.get_moved_union()
-
-        (rotated_min_x, rotated_max_x, rotated_max_y, rotated_min_y) = self.switch_rotation_collection.get_real_collection_bounds()
-
-        self.logger.debug('rotation_bounds: rotated_min_x: %f, rotated_max_x: %f, rotated_max_y: %f, rotated_min_y: %f', 
-            rotated_min_x, rotated_max_x, rotated_max_y, rotated_min_y)
+        if 'switch_cutouts' in dependency_set:
+            self.switch_supports += support_collection.get_moved_union()
+            self.switch_cutouts += switch_collection.get_moved_union()
+            self.switch_support_cutouts += support_cutout_collection.get_moved_union()
 
-        if rotated_min_x < min_x:
-            min_x = rotated_min_x
-        if rotated_max_x > max_x:
-            max_x = rotated_max_x
-        if rotated_min_y < min_y:
-            min_y = rotated_min_y
-        if rotated_max_y > max_y:
-            max_y = rotated_max_y
+            if self.parameters.custom_polygons is not None:
+                self.custom_polygon_cutout_collection = self.custom_polygon_collection.get_moved_union()
 
-        # Union together all rotated switch cutouts 
-        for rotation in self.switch_rotation_collection.get_rotation_list():
-            self.switch_cutouts += self.switch_rotation_collection.get_rotated_moved_union(rotation)
-            self.switch_supports += self.support_rotation_collection.get_rotated_moved_union(rotation)
-            self.switch_support_cutouts += self.support_cutout_rotation_collection.get_rotated_moved_union(rotation)
+            # Union together all rotated switch cutouts 
+            for rotation in self.switch_rotation_collection.get_rotation_list():
+                self.switch_cutouts += self.switch_rotation_collection.get_rotated_moved_union(rotation)
+                self.switch_supports += self.support_rotation_collection.get_rotated_moved_union(rotation)
+                self.switch_support_cutouts += self.support_cutout_rotation_collection.get_rotated_moved_union(rotation)
 
         # Set body dimensions
-        self.parameters.set_dimensions(max_x, min_y, min_x, max_y)
+        self.set_case_dimensions()
 
         # Init body object
         self.body = Body(self.parameters)
@@ -238,9 +440,10 @@ class Keyboard():
         pcb_model = self.pcb.get_model()
 
         # Add case to top_assembly
-        top_assembly += self.body.case(plate_only = plate_only)
+        if 'case' in dependency_set:
+            top_assembly += self.body.case(plate_only = plate_only)
 
-        if self.parameters.simple_test == False:
+        if self.parameters.simple_test == False and 'switch_cutouts' in dependency_set:
             # Remove switch suport cutouts
             top_assembly -= self.switch_support_cutouts
 
@@ -265,7 +468,8 @@ class Keyboard():
         
         # Remove items marked as not part of desired section
         if self.desired_section_number > -1:
-            top_assembly -= self.get_top_section_remove_block(self.desired_section_number)
+            if 'top_assembly' in dependency_set:
+                top_assembly -= self.get_top_section_remove_block(self.desired_section_number)
             # TODO
             bottom_section_inclusion = self.get_bottom_section_remove_block(self.desired_section_number)
             # bottom_assembly -= self.get_bottom_section_remove_block(self.desired_section_number)
@@ -397,7 +601,8 @@ class Keyboard():
 
         # bottom_assembly += self.body.bottom_cover()
         # bottom_assembly += body_block
-        bottom_assembly += self.body.bottom_cover() * body_block
+        if 'bottom_cover' in dependency_set:
+            bottom_assembly += self.body.bottom_cover() * body_block
         if self.desired_section_number > -1:
             bottom_assembly *= bottom_section_inclusion
 
@@ -441,6 +646,169 @@ class Keyboard():
             return top_assembly
         
     
+    def get_part_dependency_set(self, target):
+        # Get every part and subtree that target depends on, including target
+        dependency_set = set()
+        target_stack = [target]
+
+        while len(target_stack) > 0:
+            current_target = target_stack.pop()
+
+            if current_target in dependency_set:
+                continue
+
+            dependency_set.add(current_target)
+            target_stack += self.PART_DEPENDENCY_DICT.get(current_target, [])
+
+        return dependency_set
+
+
+    def get_part_parameter_list(self, section, part_name, parameter_list):
+        # Get the parameters from parameter_list that change the part built for (section, part_name)
+        dependency_set = self.get_part_dependency_set(part_name)
+        if section != 'global':
+            dependency_set.add('sections')
+
+        return [parameter for parameter in parameter_list if parameter not in self.PARAMETER_DEPENDENCY_DICT.keys() or len(dependency_set.intersection(self.PARAMETER_DEPENDENCY_DICT[parameter])) > 0]
+
+
+    def get_part_names(self, target_list):
+        # Expand a list of targets from --parts into part names. Raises ValueError for an unknown target
+        part_name_list = []
+
+        for target in target_list:
+            if target in self.PART_ASSEMBLY_ARGUMENT_DICT.keys() or target in self.GLOBAL_PART_LIST:
+                expanded_target_list = [target]
+            elif target in self.PART_DEPENDENCY_DICT.keys():
+                # A group of parts such as cable_holder
+                expanded_target_list = [dependency for dependency in self.PART_DEPENDENCY_DICT[target] if dependency in self.GLOBAL_PART_LIST or dependency in self.PART_ASSEMBLY_ARGUMENT_DICT.keys()]
+            else:
+                raise ValueError('Unknown part %s' % (target))
+
+            if len(expanded_target_list) == 0:
+                raise ValueError('%s is not a part' % (target))
+
+            for part_name in expanded_target_list:
+                if part_name not in part_name_list:
+                    part_name_list.append(part_name)
+
+        return part_name_list
+
+
+    def get_part_file_stem(self, layout_name, section, part_name, switch_type_in_filename = False, exploded = False):
+        # Get the file name without extension used for the scad and STL files of a part
+        switch_type_for_filename = ''
+        stab_type_for_filename = ''
+
+        # Creating global items that have no relaton to switch type
+        if switch_type_in_filename == True and section != 'global':
+            switch_type_for_filename = '_' + self.parameters.switch_type
+            stab_type_for_filename = '_' + self.parameters.stabilizer_type
+
+        section_postfix = ''
+        
+        # If the current section is an int greater than -1 add the section number to the filename
+        if isinstance(section, int) and section > -1:
+            section_postfix = '_section_%d' % (section)
+        
+        if exploded == True:
+            section_postfix = '_exploded'
+
+        part_name_formatted = '_' + part_name
+
+        return layout_name + section_postfix + part_name_formatted + switch_type_for_filename + stab_type_for_filename
+
+
+    def get_part_list(self, all_sections = False, exploded = False, section = -1, part_name_list = None):
+        # Get the list of (section, part_name) pairs to build
+        # section is the section number, -1 for an exploded view, 'all' for the whole case, and 'global' for parts
+        # that do not depend on the sections
+        # part_name_list limits the list to the named parts. None includes every part
+        
+        # The bottom section count is set along with the case dimensions
+        self.set_case_dimensions()
+
+        part_list = []
+
+        # Create objects for each of the generated sections
+        if all_sections == True:
+            for current_section in range(self.get_top_section_count()):
+                part_list += self.get_section_part_list(current_section)
+
+        # Create exploded object
+        elif exploded == True:
+            part_list += [(-1, 'top'), (-1, 'plate'), (-1, 'bottom')]
+
+        # Create objects for a specified section
+        elif section > -1:
+            part_list += self.get_section_part_list(section)
+
+        # Create an objects that are not split into sections. No other options were specified
+        else:
+            part_list += [('all', 'top'), ('all', 'bottom'), ('all', 'all'), ('all', 'plate')]
+
+        # Generate a strain relief piece for the cable hole
+        if self.parameters.cable_hole == True:
+            part_list += [('global', part_name) for part_name in self.GLOBAL_PART_LIST]
+
+        if part_name_list is not None:
+            part_list = [(part_section, part_name) for (part_section, part_name) in part_list if part_name in part_name_list]
+
+        return part_list
+
+
+    def get_section_part_list(self, section):
+        part_list = [(section, 'top'), (section, 'all'), (section, 'plate')]
+
+        # If there is a bottom section for the section add it
+        if section < self.get_bottom_section_count():
+            part_list.append((section, 'bottom'))
+
+        return part_list
+
+
+    def get_part(self, section, part_name):
+        # Build the solid for a single (section, part_name) pair from get_part_list
+
+        if section == 'global':
+            if part_name == 'cable_holder_main':
+                return self.cable.holder_main()
+            elif part_name == 'cable_holder_clamp':
+                return self.cable.holder_clamp()
+            elif part_name == 'cable_holder_all':
+                return self.cable.holder_all()
+
+        elif section == -1:
+            # Exploded view. Each section is moved up and right so they can be seen more easily
+            exploded_part = union()
+            for current_section in range(self.get_top_section_count()):
+                if part_name == 'bottom' and current_section >= self.get_bottom_section_count():
+                    continue
+
+                self.set_section(current_section)
+                with self.time_phase('get_assembly', section = current_section, part_name = part_name, exploded = True):
+                    exploded_part += up(5 * current_section) ( right(10 * current_section) ( self.get_assembly(**self.PART_ASSEMBLY_ARGUMENT_DICT[part_name]) ) )
+
+            return exploded_part
+
+        elif part_name in self.PART_ASSEMBLY_ARGUMENT_DICT.keys():
+            if section == 'all':
+                self.set_section(-1)
+            else:
+                self.set_section(section)
+
+            with self.time_phase('get_assembly', section = section, part_name = part_name):
+                return self.get_assembly(**self.PART_ASSEMBLY_ARGUMENT_DICT[part_name])
+
+        raise ValueError('Unknown part %s for section %s' % (part_name, str(section)))
+
+
+    def generate_parts(self, all_sections = False, exploded = False, section = -1):
+        # Yield (section, part_name, solid) for each part as soon as it has been built
+        for (part_section, part_name) in self.get_part_list(all_sections, exploded, section):
+            yield (part_section, part_name, self.get_part(part_section, part_name))
+
+
     # def get_cable_hole(self):
 
     #     if self.cable_hole == True:
@@ -527,9 +895,14 @@ class Keyboard():
                 # self.logger.debug('current_x_start: %f', current_x_start)
                 current_x_section = next_x_section
 
-        for idx, section in enumerate(self.switch_section_list):
-            # self.logger.debug('Set Item neighbors for section %d', idx)
-            section.set_collection_neighbors()
+        # The sections reuse the index of the whole keyboard limited to their switches instead of each building
+        # their own, so the cost of finding the local neighbors does not grow with the number of sections
+        with self.time_phase('local_neighbors'):
+            for idx, section in enumerate(self.switch_section_list):
+                # self.logger.debug('Set Item neighbors for section %d', idx)
+                section.set_collection_neighbors(neighbor_index = self.neighbor_index)
+
+        self.neighbor_index = None
 
     def get_top_section_remove_block(self, section_number):
         this_function_name = sys._getframe(  ).f_code.co_name
@@ -795,6 +1168,18 @@ class Keyboard():
     def set_section(self, section_number):
         self.desired_section_number = section_number
 
+    def get_key_count(self, section_number = None):
+        if section_number is None:
+            section_number = self.desired_section_number
+
+        switch_collection = self.switch_collection
+
+        if section_number > -1:
+            switch_collection = self.switch_section_list[section_number]
+
+        # Rotated switches are included in every section
+        return switch_collection.get_item_count() + self.switch_rotation_collection.get_item_count()
+
     def get_top_section_count(self):
         return len(self.switch_section_list)
 
@@ -0,0 +1,202 @@
+import logging
+import tempfile
+from pathlib import Path
+
+from parameters import Parameters
+from keyboard import Keyboard
+from layout_file import parse_layout_text
+from render_queue import RenderJob, RenderQueue
+from scad_writer import ScadWriter
+
+
+logger = logging.getLogger().getChild(__name__)
+
+
+
+class GeneratedPart():
+    """
+    A keyboard part generated in memory by generate
+
+    ...
+
+    Attributes
+    ----------
+    name : str
+        The file name the part would have without extension, for example layout_section_0_top
+
+    section : int or str
+        The section number, -1 for an exploded view, 'all' for the whole case or 'global' for parts that do not depend on the sections
+
+    part_name : str
+        The part, for example top, bottom, all, plate or cable_holder_main
+
+    scad_text : str
+        The SCAD file text of the part
+
+    stl_data : bytes, default None
+        The rendered binary or ASCII STL file. None when the part was not rendered or the render failed
+
+    render_status : str, default None
+        The RenderJob status of the render. None when the part was not rendered
+
+    return_code : int, default None
+        The OpenSCAD return code. None when the part was not rendered
+
+    stats : dict
+        The statistics OpenSCAD printed for the render
+
+    Methods
+    -------
+    to_dict()
+        Get the part as a dict without the SCAD text and STL data
+    """
+
+    def __init__(self, name, section, part_name, scad_text):
+
+        self.name = name
+        self.section = section
+        self.part_name = part_name
+        self.scad_text = scad_text
+
+        self.stl_data = None
+        self.render_status = None
+        self.return_code = None
+        self.stats = {}
+
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'section': self.section,
+            'part_name': self.part_name,
+            'scad_bytes': len(self.scad_text.encode('utf-8')),
+            'stl_bytes': None if self.stl_data is None else len(self.stl_data),
+            'render_status': self.render_status,
+            'return_code': self.return_code,
+            'stats': self.stats
+        }
+
+
+    def __repr__(self):
+        return 'GeneratedPart(%s)' % (self.name)
+
+
+
+def build_keyboard(keyboard_layout_dict, parameter_dict, run_report = None, layout_cache = None, processed_layout_dict = None):
+    # Create and process a Keyboard. Returns (parameters, keyboard)
+    # processed_layout_dict is Keyboard.get_processed_layout of a keyboard built from the same layout with the same
+    # LayoutCache.PARAMETER_NAME_LIST parameters. It is restored instead of processing the layout again
+    # Set parameters from imput file
+    parameters = Parameters(parameter_dict)
+
+    # Create Keyboard instance
+    keyboard = Keyboard(parameters)
+    keyboard.run_report = run_report
+    keyboard.layout_cache = layout_cache
+
+    # Process the keyboard layout object
+    if processed_layout_dict is not None:
+        with keyboard.time_phase('restore_processed_layout'):
+            keyboard.restore_processed_layout(processed_layout_dict)
+    else:
+        with keyboard.time_phase('process_keyboard_layout'):
+            keyboard.process_keyboard_layout(keyboard_layout_dict)
+
+    with keyboard.time_phase('process_custom_shapes'):
+        keyboard.process_custom_shapes()
+
+    logger.debug('kerf: %f', keyboard.kerf)
+
+    return (parameters, keyboard)
+
+
+def generate(layout, parameters = None, parts = None, sections = None, fragments = 8, name = 'layout', render = False, jobs = None, render_timeout = None, render_memory_limit_mb = None, render_retries = 1):
+    # Generate keyboard parts in memory without the command line and without writing output files
+    #
+    # layout is keyboard layout editor JSON text, raw keyboard-layout-editor output or the parsed list
+    # parameters is a parameter dict like the parameter files. None uses the default parameters
+    # parts is a list of part names or groups such as ['top', 'cable_holder']. None builds every part
+    # sections is None for the whole case, 'all' for every section, 'exploded' for an exploded view or a section number
+    # With render True each part is rendered with OpenSCAD and the STL file is returned in stl_data. OpenSCAD
+    # only reads and writes files, so the renders use a temporary folder that is removed before returning
+    #
+    # Returns a list of GeneratedPart. Raises ValueError for an invalid layout, part or section
+    if isinstance(layout, str):
+        layout = parse_layout_text(layout)
+
+    if isinstance(layout, list) == False:
+        raise ValueError('layout must be keyboard layout editor JSON')
+
+    all_sections = False
+    exploded = False
+    section = -1
+    if sections == 'all':
+        all_sections = True
+    elif sections == 'exploded':
+        exploded = True
+    elif isinstance(sections, int) and isinstance(sections, bool) == False and sections > -1:
+        section = sections
+    elif sections is not None:
+        raise ValueError('sections must be None, "all", "exploded" or a section number')
+
+    (keyboard_parameters, keyboard) = build_keyboard(layout, parameters)
+
+    part_name_list = None
+    if parts is not None:
+        part_name_list = keyboard.get_part_names(parts)
+
+    if section >= keyboard.get_top_section_count():
+        raise ValueError('Section %d does not exist. The layout has %d sections' % (section, keyboard.get_top_section_count()))
+
+    part_list = keyboard.get_part_list(all_sections = all_sections, exploded = exploded, section = section, part_name_list = part_name_list)
+
+    scad_writer = ScadWriter(fragments)
+
+    generated_part_list = []
+    for (part_section, part_name) in part_list:
+        part_file_stem = keyboard.get_part_file_stem(name, part_section, part_name, exploded = exploded)
+        scad_text = scad_writer.render(keyboard.get_part(part_section, part_name))
+        generated_part_list.append(GeneratedPart(part_file_stem, part_section, part_name, scad_text))
+
+    if render == True:
+        render_parts(keyboard, generated_part_list, fragments, jobs, render_timeout, render_memory_limit_mb, render_retries)
+
+    return generated_part_list
+
+
+def render_parts(keyboard: Keyboard, generated_part_list, fragments = 8, jobs = None, render_timeout = None, render_memory_limit_mb = None, render_retries = 1):
+    # Render generated parts with OpenSCAD in a temporary folder and store the STL data on each part
+    with tempfile.TemporaryDirectory(prefix = 'keyboard_api_') as temp_folder:
+        render_queue = RenderQueue(jobs = jobs, timeout = render_timeout, memory_limit_mb = render_memory_limit_mb, retries = render_retries, quiet = True)
+        render_queue.start()
+
+        job_list = []
+        for (index, generated_part) in enumerate(generated_part_list):
+            # Numbered names so parts with the same name can not overwrite each other
+            scad_file_path = Path(temp_folder) / ('part_%d.scad' % (index))
+            stl_file_path = Path(temp_folder) / ('part_%d.stl' % (index))
+            scad_file_path.write_text(generated_part.scad_text, encoding = 'utf-8')
+
+            key_count = 0
+            if isinstance(generated_part.section, int) and generated_part.section > -1:
+                key_count = keyboard.get_key_count(generated_part.section)
+            elif generated_part.section != 'global':
+                key_count = keyboard.get_key_count(-1)
+
+            job_list.append(render_queue.add(scad_file_path, stl_file_path, fragments, generated_part.part_name, key_count))
+
+        render_queue.join()
+
+        for (generated_part, job) in zip(generated_part_list, job_list):
+            generated_part.render_status = job.status
+            generated_part.return_code = job.return_code
+            generated_part.stats = job.stats
+
+            if job.return_code == 0 and Path(job.stl_file_name).is_file():
+                generated_part.stl_data = Path(job.stl_file_name).read_bytes()
+            elif job.return_code == 0:
+                generated_part.render_status = RenderJob.STATUS_FAILED
+                generated_part.return_code = -1
+
+            if generated_part.stl_data is None:
+                logger.error('Render of %s failed: %s', generated_part.name, generated_part.render_status)
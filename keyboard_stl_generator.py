@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 
 import argparse
-from asyncio import subprocess
+import contextlib
+import glob
+import hashlib
+import itertools
 import json
 # import math
 import re
 import logging
 import os
 # import os.path
-import subprocess
-# import time
+import sys
+import time
 
 from solid import *
 from solid.utils import *
@@ -17,6 +20,21 @@ from solid.utils import *
 from parameters import Parameters
 from keyboard import Keyboard
 from cable import Cable
+from render_queue import RenderJob, RenderQueue
+from render_cache import RenderCache
+from layout_cache import LayoutCache
+from scad_writer import ScadWriter
+from render_history import RenderHistory
+from parallel_generation import ParallelGenerator
+from job_queue import DistributedRenderQueue, RenderWorker, SharedJobQueue
+from part_dedup import PartDeduplicator
+from run_checkpoint import RunCheckpoint
+from run_report import RunReport
+from progress_display import ProgressDisplay
+from keyboard_api import build_keyboard
+from file_watcher import FileWatcher
+from layout_file import read_layout_file, read_parameter_file
+from generation_server import GenerationServer
 
 # Set logger level variables
 console_logging_level = logging.WARN
@@ -73,316 +91,951 @@ def CheckExt(choices):
 
 
 
-def main():
+def worker_main(argv):
 
-    parser = argparse.ArgumentParser(description='Build custom keyboard SCAD file using keyboard layout editor format')
-    parser.add_argument('-i', '--input-file', metavar = 'layout_json_file_name.json', help = 'A path to a keyboard layout editor json file', required = True, action=CheckExt({'json'}))
-    # parser.add_argument('-o', '--output-folder', metavar = 'scad', help = 'A path to a folder to store the generated open scad file')
-    parser.add_argument('-p', '--parameter-file', metavar = 'parameters.json', help = 'A JSON file containing paramters for the object buing made', default = None, action=CheckExt({'json'}))
+    parser = argparse.ArgumentParser(prog = 'keyboard_stl_generator.py worker', description = 'Render STL files for jobs submitted to a shared render queue with --render-queue-db')
+    parser.add_argument('-d', '--db', metavar = 'render_queue.sqlite', help = 'The SQLite render queue file shared with the generator. With the default wal journal mode it must be on a local filesystem of the host all workers and the generator run on', required = True)
+    parser.add_argument('--journal-mode', help = 'The SQLite journal mode of the render queue file. wal needs a local filesystem. Use delete on every worker and the generator when the queue file is on a network share. Default: wal', choices = SharedJobQueue.JOURNAL_MODE_LIST, default = 'wal')
+    parser.add_argument('-j', '--jobs', metavar = 'num_jobs', help = 'The number of renders to run at the same time. Default: number of CPU cores', type = int, default = None)
+    parser.add_argument('--lease', metavar = 'seconds', help = 'How long a claimed job is reserved for this worker without a lease renewal', type = float, default = 60)
+    parser.add_argument('--render-timeout', metavar = 'seconds', help = 'Kill a render that runs longer than this many seconds', type = float, default = None)
+    parser.add_argument('--render-memory-limit', metavar = 'size_mb', help = 'Address space limit for each OpenSCAD process in megabytes', type = float, default = None)
+    parser.add_argument('--idle-exit', metavar = 'seconds', help = 'Exit once the queue has been empty for this many seconds. Default: run until interrupted', type = float, default = None)
+    parser.add_argument('--render-retries', metavar = 'num_retries', help = 'The number of times a failed or timed out render is retried. Each retry halves the number of fragments', type = int, default = 1)
+    parser.add_argument('--max-job-age', metavar = 'seconds', help = 'Delete jobs left in the queue by interrupted runs once they are this many seconds old. 0 keeps them. Default: 86400', type = float, default = 86400)
+
+    args = parser.parse_args(argv)
+    logger.debug(vars(args))
+
+    render_worker = RenderWorker(args.db, jobs = args.jobs, lease_seconds = args.lease, idle_exit = args.idle_exit, timeout = args.render_timeout, memory_limit_mb = args.render_memory_limit, retries = args.render_retries, max_job_age = args.max_job_age if args.max_job_age > 0 else None, journal_mode = args.journal_mode)
+    try:
+        render_worker.run()
+    except KeyboardInterrupt:
+        logger.info('Render worker interrupted')
+
+
+
+def server_main(argv):
+
+    parser = argparse.ArgumentParser(prog = 'keyboard_stl_generator.py server', description = 'Run a local HTTP server that builds keyboard parts for submitted layouts and keeps its caches between requests')
+    parser.add_argument('--host', metavar = 'address', help = 'The address to listen on', default = '127.0.0.1')
+    parser.add_argument('--port', metavar = 'port', help = 'The port to listen on', type = int, default = 8765)
+    parser.add_argument('-o', '--output-folder', metavar = 'folder', help = 'Folder the jobs are written to', default = 'server_output')
+    parser.add_argument('-j', '--jobs', metavar = 'num_jobs', help = 'The maximum number of STL renders to run at the same time. Default: number of CPU cores', type = int, default = None)
+    parser.add_argument('--max-jobs', metavar = 'num_jobs', help = 'The number of jobs kept. The oldest finished jobs and their output folders are removed beyond it. Default: 100', type = int, default = 100)
+    parser.add_argument('--job-ttl', metavar = 'seconds', help = 'Remove finished jobs and their output folders this many seconds after they finished. 0 keeps them. Default: 86400', type = float, default = 86400)
+    parser.add_argument('--no-render', help = 'Only generate scad files. Jobs that ask for STL files fail', default = False, action = 'store_true')
+    parser.add_argument('--render-timeout', metavar = 'seconds', help = 'Kill a render that runs longer than this many seconds', type = float, default = None)
+    parser.add_argument('--render-memory-limit', metavar = 'size_mb', help = 'Address space limit for each OpenSCAD process in megabytes', type = float, default = None)
+    parser.add_argument('--render-cache', metavar = 'cache_folder', help = 'Folder used to cache rendered STL files. Default: ~/.cache/keyboard_stl_generator/stl', default = None)
+    parser.add_argument('--render-cache-size', metavar = 'size_mb', help = 'The maximum size of the render cache in megabytes', type = float, default = 1024)
+    parser.add_argument('--no-render-cache', help = 'Always render STL files with OpenSCAD instead of using cached renders', default = False, action = 'store_true')
+    parser.add_argument('--render-history', metavar = 'history_file.json', help = 'File used to store render times. Default: ~/.cache/keyboard_stl_generator/render_history.json', default = None)
+
+    args = parser.parse_args(argv)
+    logger.debug(vars(args))
+
+    render_queue = None
+    if args.no_render == False:
+        render_cache = None
+        if args.no_render_cache == False:
+            render_cache = RenderCache(args.render_cache, args.render_cache_size)
+
+        render_queue = RenderQueue(jobs = args.jobs, render_cache = render_cache, render_history = RenderHistory(args.render_history), timeout = args.render_timeout, memory_limit_mb = args.render_memory_limit)
+
+    generation_server = GenerationServer(args.output_folder, host = args.host, port = args.port, render_queue = render_queue, max_jobs = args.max_jobs, job_ttl = args.job_ttl if args.job_ttl > 0 else None)
+    try:
+        generation_server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Generation server interrupted')
+    finally:
+        if render_queue is not None and render_queue.render_history is not None:
+            render_queue.render_history.save()
+
+
+
+def add_build_arguments(parser):
+    # Arguments shared by the single layout and batch entry points
     parser.add_argument('-s', '--section', metavar = 'section_num', help = 'The number of the section that should be built', type = int, default = -1)
     parser.add_argument('-a', '--all-sections', help = 'Output all the parts for all possible sections in separate files', default = False, action = 'store_true')
     parser.add_argument('-e', '--exploded', help = 'Create test file with each section shown as an exploded view', default = False, action = 'store_true')
     parser.add_argument('-f', '--fragments', metavar = 'num_fragments', help = 'The number of fragments to be used when creating curves', type = int, default = 8)
     parser.add_argument('-r', '--render', help = 'Render an STL from the generated scad file', default = False, action = 'store_true')
+    parser.add_argument('-j', '--jobs', metavar = 'num_jobs', help = 'The maximum number of STL renders to run at the same time. Default: number of CPU cores', type = int, default = None)
+    parser.add_argument('-g', '--generation-jobs', metavar = 'num_jobs', help = 'The number of processes used to generate scad files. 0 uses the number of CPU cores. Default: 1', type = int, default = 1)
+    parser.add_argument('--render-timeout', metavar = 'seconds', help = 'Kill a render that runs longer than this many seconds. Default: no timeout', type = float, default = None)
+    parser.add_argument('--render-memory-limit', metavar = 'size_mb', help = 'Address space limit for each OpenSCAD process in megabytes. Default: no limit', type = float, default = None)
+    parser.add_argument('--render-retries', metavar = 'num_retries', help = 'The number of times a failed or timed out render is retried. Each retry halves the number of fragments', type = int, default = 1)
+    parser.add_argument('--render-queue-db', metavar = 'render_queue.sqlite', help = 'Send renders to a shared SQLite render queue processed by "keyboard_stl_generator.py worker" instead of running OpenSCAD locally. With the default wal journal mode the file must be on a local filesystem of the host all workers run on', default = None)
+    parser.add_argument('--render-queue-journal-mode', help = 'The SQLite journal mode of the --render-queue-db file. wal needs a local filesystem. Use delete on the generator and every worker when the queue file is on a network share. Default: wal', choices = SharedJobQueue.JOURNAL_MODE_LIST, default = 'wal')
+    parser.add_argument('--render-queue-timeout', metavar = 'seconds', help = 'Fail the renders still in the --render-queue-db queue when no render worker claims, renews or finishes any of them for this many seconds. 0 waits forever. Default: 300', type = float, default = 300)
+    parser.add_argument('--render-cache', metavar = 'cache_folder', help = 'Folder used to cache rendered STL files. Default: ~/.cache/keyboard_stl_generator/stl', default = None)
+    parser.add_argument('--render-cache-size', metavar = 'size_mb', help = 'The maximum size of the render cache in megabytes', type = float, default = 1024)
+    parser.add_argument('--no-render-cache', help = 'Always render STL files with OpenSCAD instead of using cached renders', default = False, action = 'store_true')
+    parser.add_argument('--render-history', metavar = 'history_file.json', help = 'File used to store render times that are used to start the longest renders first. Default: ~/.cache/keyboard_stl_generator/render_history.json', default = None)
+    parser.add_argument('--layout-cache', metavar = 'cache_folder', help = 'Folder used to cache processed layouts so an unchanged layout skips key placement, neighbor discovery and splitting. Default: ~/.cache/keyboard_stl_generator/layouts', default = None)
+    parser.add_argument('--no-layout-cache', help = 'Always process the layout instead of using a cached processed layout', default = False, action = 'store_true')
+    parser.add_argument('--no-dedup', help = 'Render every part even if its geometry is identical to another part', default = False, action = 'store_true')
+    parser.add_argument('--incremental', help = 'Only write scad files whose content changed and only render STL files whose scad file changed or whose STL file is missing', default = False, action = 'store_true')
+    parser.add_argument('--parts', metavar = 'top,plate', help = 'Comma separated list of the parts to build. Parts: top, bottom, all, plate, cable_holder, cable_holder_main, cable_holder_clamp, cable_holder_all. Default: all parts', default = None)
     parser.add_argument('--switch-type-in-filename', help = 'Add the switch type name and stabilizer type name to the filname', default = False, action = 'store_true')
+    parser.add_argument('--no-progress', help = 'Do not show the progress of generation and rendering. On a terminal the progress is shown as a live view, otherwise as a progress line every 15 seconds', default = False, action = 'store_true')
+    parser.add_argument('--parameter-folder', help = 'Write the output to layout/<parameter file name>_<parameter hash> so runs of the same layout with different parameter files do not overwrite each other', default = False, action = 'store_true')
+    parser.add_argument('--report', metavar = 'run.json', help = 'Write a JSON report with the wall and CPU time of each generation phase, the size of each scad file and the render time and exit code of each STL file', default = None)
 
-    # Parse command line arguments
-    args = parser.parse_args()
-    logger.debug(vars(args))
 
-    # Create Path object from input file argument
-    input_file_path = Path(args.input_file)
+def get_parameter_folder_name(parameter_file, parameter_dict):
+    # Name of the output folder for a parameter file, the file name followed by a hash of the parameters, for example mx_1a2b3c4d
+    # Runs of the same layout with different parameters get different folders and can run at the same time
+    parameter_name = 'default'
+    if parameter_file is not None:
+        parameter_name = Path(parameter_file).stem
+
+    parameter_hash = hashlib.sha256(json.dumps(parameter_dict, sort_keys = True).encode('utf-8')).hexdigest()
+
+    return '%s_%s' % (parameter_name, parameter_hash[:8])
+
+
+def get_output_folders(input_file_path, create = True, parameter_folder_name = None):
+    # Get the layout name and the output folders for a layout file. The folders are created unless create is False
+    # With a parameter_folder_name the output is written to layout/parameter_folder_name instead of layout
+    input_file_path = Path(input_file_path)
 
     # Get base folder path
     base_path = input_file_path.parent
 
-    # Get input file name onle
-    file_name_only = input_file_path.name
-    
     # Get layout name from file name
     layout_name = input_file_path.stem
 
     # Generate output scad and stl output folder paths
     output_base_folder = base_path / layout_name
+    if parameter_folder_name is not None:
+        output_base_folder = output_base_folder / parameter_folder_name
     scad_folder_path = output_base_folder / 'scad'
     stl_folder_path = output_base_folder / 'stl'
 
-    # Ensure all outpur folders exists
-    if output_base_folder.is_dir() == False:
-        output_base_folder.mkdir()
-
-    if scad_folder_path.is_dir() == False:
-        scad_folder_path.mkdir()
-
-    if stl_folder_path.is_dir() == False:
-        stl_folder_path.mkdir()
+    # Ensure all outpur folders exists. Another run may create them at the same time
+    if create == True:
+        scad_folder_path.mkdir(parents = True, exist_ok = True)
+        stl_folder_path.mkdir(parents = True, exist_ok = True)
 
     logger.debug('layout_name: %s', str(layout_name))
     logger.debug('base_path: %s', str(base_path))
-    logger.debug('file_name_only: %s', str(file_name_only))
-    
+    logger.debug('file_name_only: %s', str(input_file_path.name))
+
+    return (layout_name, output_base_folder, scad_folder_path, stl_folder_path)
+
+
+def create_render_queue(args):
+    render_cache = None
+    if args.no_render_cache == False:
+        render_cache = RenderCache(args.render_cache, args.render_cache_size)
+
+    render_history = RenderHistory(args.render_history)
+
+    if args.render_queue_db is not None:
+        return DistributedRenderQueue(args.render_queue_db, render_cache = render_cache, render_history = render_history, stall_timeout = args.render_queue_timeout if args.render_queue_timeout > 0 else None, journal_mode = args.render_queue_journal_mode)
+
+    return RenderQueue(jobs = args.jobs, render_cache = render_cache, render_history = render_history, timeout = args.render_timeout, memory_limit_mb = args.render_memory_limit, retries = args.render_retries)
+
+
+def create_layout_cache(args):
+    if args.no_layout_cache == True:
+        return None
+
+    return LayoutCache(args.layout_cache)
+
+
+def get_batch_layout_list(layout_argument_list, default_parameter_file = None):
+    # Expand layout arguments into (layout_file, parameter_file) pairs
+    # An argument is a layout file, a glob such as layout_files/*.json or layout.json:parameters.json
+    # A layout given more than once is built once with the parameter file from its last argument
+    layout_dict = {}
+
+    for layout_argument in layout_argument_list:
+        parameter_file = default_parameter_file
+
+        (layout_pattern, separator, layout_parameter_file) = layout_argument.rpartition(':')
+        if separator == '' or layout_parameter_file.endswith('.json') == False or layout_pattern.endswith('.json') == False:
+            layout_pattern = layout_argument
+        else:
+            parameter_file = layout_parameter_file
+
+        # Expand globs here so they also work in shells that do not expand them
+        if glob.has_magic(layout_pattern):
+            layout_file_list = sorted(glob.glob(layout_pattern))
+        else:
+            layout_file_list = [layout_pattern]
+
+        for layout_file in layout_file_list:
+            if Path(layout_file).suffix != '.json':
+                logger.warning('Skip %s. Layout files must be json files', layout_file)
+                continue
+
+            layout_dict[os.path.realpath(layout_file)] = (layout_file, parameter_file)
+
+    return list(layout_dict.values())
+
+
+def batch_main(argv):
+
+    parser = argparse.ArgumentParser(prog = 'keyboard_stl_generator.py batch', description = 'Build several keyboard layouts in one process with one render queue')
+    parser.add_argument('layout_files', metavar = 'layout.json', nargs = '+', help = 'Layout files or globs such as "layout_files/*.json". Use layout.json:parameters.json to give a layout its own parameter file')
+    parser.add_argument('-p', '--parameter-file', metavar = 'parameters.json', help = 'The parameter file used for layouts that do not have their own', default = None, action=CheckExt({'json'}))
+    add_build_arguments(parser)
+
+    args = parser.parse_args(argv)
+    logger.debug(vars(args))
+
+    # The options that only apply to a single layout run
+    args.watch = False
+    args.resume = False
+
+    run_report = None
+    if args.report is not None:
+        run_report = RunReport(args.report)
+
+    layout_list = get_batch_layout_list(args.layout_files, args.parameter_file)
+    if len(layout_list) == 0:
+        parser.error('No layout files found')
+
+    layout_cache = create_layout_cache(args)
+
+    batch_start_time = time.monotonic()
+
+    # One render queue, render cache and render history for every layout
+    render_queue = None
+    if args.render:
+        render_queue = create_render_queue(args)
+        render_queue.start()
+
+    source_file = Path(os.path.realpath(__file__))
+    scad_writer = ScadWriter(args.fragments, incremental = args.incremental, source_file = source_file)
+
+    # Identical parts, such as cable holders built with the same parameters, are only rendered once across all layouts
+    part_deduplicator = None
+    if args.no_dedup == False:
+        part_deduplicator = PartDeduplicator()
+
+    progress_display = None
+    if args.no_progress == False:
+        progress_display = ProgressDisplay(render_queue, scad_writer)
+        progress_display.start()
+
+    summary_list = []
+    for (layout_file, parameter_file) in layout_list:
+        print('\nLayout: %s, parameters: %s' % (layout_file, str(parameter_file)))
+
+        summary = {
+            'layout': layout_file,
+            'parameter_file': parameter_file,
+            'error': None,
+            'part_count': 0,
+            'load_time': 0.0,
+            'generate_time': 0.0
+        }
+        summary_list.append(summary)
+
+        (layout_name, output_base_folder, scad_folder_path, stl_folder_path) = get_output_folders(layout_file)
+        summary['layout_name'] = layout_name
+        summary['output_base_folder'] = output_base_folder
+        summary['stl_folder_path'] = stl_folder_path
+
+        # A layout that fails does not stop the batch
+        try:
+            load_start_time = time.monotonic()
+            if run_report is not None:
+                run_report.set_context(layout = layout_name)
+
+            with (run_report.time_phase('layout_parse') if run_report is not None else contextlib.nullcontext()):
+                keyboard_layout_dict = read_layout_file(layout_file)
+                parameter_dict = read_parameter_file(parameter_file)
+
+            if args.parameter_folder == True:
+                (layout_name, output_base_folder, scad_folder_path, stl_folder_path) = get_output_folders(layout_file, parameter_folder_name = get_parameter_folder_name(parameter_file, parameter_dict))
+                summary['output_base_folder'] = output_base_folder
+                summary['stl_folder_path'] = stl_folder_path
+
+            (parameters, keyboard) = build_keyboard(keyboard_layout_dict, parameter_dict, run_report, layout_cache)
+
+            part_name_list = None
+            if args.parts is not None:
+                part_name_list = keyboard.get_part_names([part.strip() for part in args.parts.split(',') if part.strip() != ''])
+
+            part_list = keyboard.get_part_list(all_sections = args.all_sections, exploded = args.exploded, section = args.section, part_name_list = part_name_list)
+            summary['load_time'] = time.monotonic() - load_start_time
+
+            if run_report is not None:
+                run_report.record_sections(keyboard.get_top_section_count(), keyboard.get_bottom_section_count())
+
+            generate_start_time = time.monotonic()
+            write_parts(args, keyboard, parameters, part_list, layout_name, scad_folder_path, stl_folder_path, scad_writer, render_queue, part_deduplicator)
+            summary['generate_time'] = time.monotonic() - generate_start_time
+            summary['part_count'] = len(part_list)
+        except Exception as e:
+            logger.exception('Failed to build %s', layout_file)
+            summary['error'] = str(e)
+
+    completed_job_list = []
+    if args.render:
+        completed_job_list = render_queue.join()
+
+    if progress_display is not None:
+        progress_display.stop()
+
+    if args.render:
+        if part_deduplicator is not None:
+            failed_stl_file_name_set = set(job.stl_file_name for job in completed_job_list if job.return_code != 0)
+            alias_list = part_deduplicator.fan_out(failed_stl_file_name_set)
+            print('Copied %d identical parts' % (len(alias_list)))
+
+            if run_report is not None:
+                record_copies(run_report, part_deduplicator, alias_list)
+
+            for summary in summary_list:
+                part_deduplicator.write_manifest(summary['output_base_folder'] / (summary['layout_name'] + '_parts.json'), folder = summary['stl_folder_path'])
+
+    ################################################################
+    #  Per layout summary
+    ################################################################
+    print('\nBatch summary: %d layouts in %.2fs' % (len(summary_list), time.monotonic() - batch_start_time))
+    print('  %-30s %6s %8s %8s %8s %8s %8s %6s' % ('layout', 'parts', 'load', 'generate', 'renders', 'render', 'finished', 'failed'))
+    for summary in summary_list:
+        layout_job_list = [job for job in completed_job_list if Path(job.stl_file_name).parent == summary['stl_folder_path']]
+        failed_count = len([job for job in layout_job_list if job.return_code != 0])
+        render_time = sum(job.get_wall_time() or 0.0 for job in layout_job_list)
+
+        # Seconds from the start of the batch until the last render of the layout finished
+        finished_time = 0.0
+        if len(layout_job_list) > 0:
+            finished_time = max(job.end_time for job in layout_job_list) - batch_start_time
+
+        logger.info('Batch layout %s: parts: %d, load: %.2fs, generate: %.2fs, renders: %d, render time: %.2fs, finished: %.2fs, failed: %d, error: %s',
+            summary['layout'], summary['part_count'], summary['load_time'], summary['generate_time'], len(layout_job_list), render_time, finished_time, failed_count, str(summary['error']))
+
+        if summary['error'] is not None:
+            print('  %-30s failed: %s' % (summary['layout_name'], summary['error']))
+            continue
+
+        print('  %-30s %6d %7.2fs %7.2fs %8d %7.2fs %7.2fs %6d' % (summary['layout_name'], summary['part_count'], summary['load_time'], summary['generate_time'], len(layout_job_list), render_time, finished_time, failed_count))
+
+    if run_report is not None:
+        for job in completed_job_list:
+            run_report.record_render(job)
+
+        run_report.write(
+            command = 'batch',
+            layouts = [{'layout': summary['layout'], 'parameter_file': summary['parameter_file'], 'part_count': summary['part_count'], 'error': summary['error']} for summary in summary_list],
+            render_count = len(completed_job_list),
+            failed_count = len([job for job in completed_job_list if job.return_code != 0])
+        )
+
+    if len([job for job in completed_job_list if job.return_code != 0]) > 0:
+        return 1
+
+    return 0
+
+
+
+def record_copies(run_report: RunReport, part_deduplicator: PartDeduplicator, alias_list):
+    # Record the STL files fan_out copied from an identical part
+    for (primary_stl_file_name, primary_alias_list) in part_deduplicator.alias_dict.items():
+        for alias_stl_file_name in primary_alias_list:
+            if alias_stl_file_name in alias_list:
+                run_report.record_copy(alias_stl_file_name, primary_stl_file_name)
+
+
+def write_parts(args, keyboard: Keyboard, parameters: Parameters, part_list, layout_name, scad_folder_path, stl_folder_path, scad_writer: ScadWriter, render_queue: RenderQueue = None, part_deduplicator: PartDeduplicator = None, scad_text_dict = None, checkpoint: RunCheckpoint = None):
+    # Generate, write and queue the render of each part in part_list. Returns the list of STL files whose render was skipped
+    # scad_text_dict maps (section, part_name) to scad text. Parts found in it are not generated again and every generated part is added to it
+    # Written scad files and renders are recorded in checkpoint. With --resume the work checkpoint verifies as complete is skipped
+    source_file = scad_writer.source_file
+
     # define output file extensions
     scad_postfix = '.scad'
     stl_postfix  = '.stl'
 
-    # Set fragments per circle
-    FRAGMENTS = args.fragments
-    logger.debug('\tFragments: %d', FRAGMENTS)
+    resume = checkpoint is not None and args.resume == True
 
-    # Pattern and Replacement strings to be used when trying to turn keyboard-layout-editor raw output into valid JSON
-    json_key_pattern = '([{,])([xywha1]+):'
-    json_key_replace = '\\1"\\2":'
+    reused_scad_text_dict = {}
+    for (section, part_name) in part_list:
+        if scad_text_dict is not None and (section, part_name) in scad_text_dict.keys():
+            reused_scad_text_dict[(section, part_name)] = scad_text_dict[(section, part_name)]
 
-    # Open JSON layout file
-    logger.debug('Open layout file %s', input_file_path)
-    try:
-        # Try with utf-8 encoding specified
-        f = open(input_file_path, encoding="utf-8")
-    except:
-        # Failed to open
-        logger.info('Failed to open layout file with utf-8 encoding specified. Try opening without specifying an encoding')
-        try:
-            # Try opening with no encoding spcificed
-            f = open(input_file_path)
-        except:
-            logger.error('Failed to open layout file both spefifying utf-8 andcoding and not specifying any encodeing. Exiting')
-            exit(1)
+        elif resume == True:
+            # A completed scad file is read back instead of generated again
+            scad_file_name = scad_folder_path / (keyboard.get_part_file_stem(layout_name, section, part_name, args.switch_type_in_filename, args.exploded) + scad_postfix)
+            if checkpoint.is_scad_complete(scad_file_name):
+                logger.info('Resume: scad file %s is complete', scad_file_name)
+                reused_scad_text_dict[(section, part_name)] = scad_file_name.read_text(encoding = 'utf-8')
 
-    logger.debug('Read layout JSON string from file %s', input_file_path)
-    try:
-        keyboard_layout = f.read()
-    except UnicodeDecodeError:
-        logger.error('Unable to decode layout file. Please provide utf-8 encoded files')
-        exit(-1)
+    reused_part_list = [part for part in part_list if part in reused_scad_text_dict.keys()]
+    part_list = [part for part in part_list if part not in reused_scad_text_dict.keys()]
 
-    keyboard_layout_dict = None
+    if len(part_list) == 0:
+        scad_text_generator = iter([])
+    elif args.generation_jobs == 1:
+        # Generate each part in this process
+        def generate_scad_text():
+            for (section, part_name) in part_list:
+                solid_object = keyboard.get_part(section, part_name)
 
-    # Load keyboard layout dictionary
-    logger.debug('Parse layout file JSON string')
-    try:
-        # Attempt to parse to provided JSON string
-        keyboard_layout_dict = json.loads(keyboard_layout)
-        logger.debug('Valid Json Parsed')
-    except:
-        # Failed to parse the JSON test.
-        # This most likely means that the keybaord-layout-editor raw output was provided
-        # Attempt to modify that string to make it valid JSON
-        keyboard_layout = '[%s]' % (keyboard_layout)
-        keyboard_layout = re.sub(json_key_pattern, json_key_replace, keyboard_layout)
+                with keyboard.time_phase('scad_render', section = section, part_name = part_name):
+                    scad_text = scad_writer.render(solid_object)
+
+                yield (section, part_name, scad_text)
+
+        scad_text_generator = generate_scad_text()
+    else:
+        # Generate parts in worker processes that each get a copy of the processed keyboard
+        parallel_generator = ParallelGenerator(keyboard, scad_writer.fragments, source_file = source_file, jobs = args.generation_jobs)
+        scad_text_generator = parallel_generator.generate(part_list)
+
+    # Reused parts are written first since they are ready
+    scad_text_generator = itertools.chain(((section, part_name, reused_scad_text_dict[(section, part_name)]) for (section, part_name) in reused_part_list), scad_text_generator)
+
+    # Parts whose scad file and STL file were both up to date
+    skipped_render_list = []
+
+    # Each part is written and queued for rendering as soon as it has been generated
+    for (section, part_name, scad_text) in scad_text_generator:
+        # Number of keys in the section. Used to predict render times
+        key_count = 0
+        if isinstance(section, int) and section > -1:
+            key_count = keyboard.get_key_count(section)
+        elif section != 'global':
+            key_count = keyboard.get_key_count(-1)
+
+        part_file_stem = keyboard.get_part_file_stem(layout_name, section, part_name, args.switch_type_in_filename, args.exploded)
+
+        scad_file_name = scad_folder_path / (part_file_stem + scad_postfix)
+        stl_file_name = stl_folder_path / (part_file_stem + stl_postfix)
+
+        if scad_text is not None and scad_text_dict is not None:
+            scad_text_dict[(section, part_name)] = scad_text
+
+        if scad_text is not None:
+            logger.info('Generate scad file with name %s', scad_file_name)
+            # Generate SCAD file from assembly
+            scad_changed = scad_writer.write_text(scad_text, scad_file_name)
+            if scad_changed == True:
+                print('Generated scad file with name', scad_file_name)
+            else:
+                print('Unchanged scad file with name', scad_file_name)
+
+            if checkpoint is not None:
+                checkpoint.record_scad(scad_file_name, scad_text)
+
+            if keyboard.run_report is not None:
+                keyboard.run_report.record_scad(section, part_name, scad_file_name, stl_file_name, scad_text)
+
+            primary_stl_file_name = None
+            if args.render and part_deduplicator is not None:
+                primary_stl_file_name = part_deduplicator.add(scad_text, stl_file_name)
+
+            # Render STL if option is chosen
+            if primary_stl_file_name is not None:
+                print('Identical part: %s will be copied from %s' % (stl_file_name, primary_stl_file_name))
+            elif args.render and resume == True and checkpoint.is_render_complete(stl_file_name, scad_text):
+                logger.info('Resume: skip render of %s. STL file is complete', stl_file_name)
+                print('Completed render: file: %s' % (stl_file_name))
+                skipped_render_list.append(stl_file_name)
+            elif args.render and resume == True:
+                # Only the checkpoint shows that an existing STL file was fully rendered
+                logger.info('Resume: render %s', stl_file_name)
+                render_queue.add(scad_file_name, stl_file_name, scad_writer.fragments, part_name, key_count)
+            elif args.render and scad_changed == False and stl_file_name.is_file():
+                logger.info('Skip render of %s. scad file unchanged and STL exists', stl_file_name)
+                skipped_render_list.append(stl_file_name)
+
+                # The existing STL file is the render of this scad file, so a later --resume can skip it too
+                if checkpoint is not None:
+                    checkpoint.record_stl(stl_file_name, checkpoint.get_scad_hash(scad_text), 0, RenderJob.STATUS_OK)
+            elif args.render and scad_changed == False and render_queue.is_active(stl_file_name):
+                # Watch mode. The render of the unchanged scad file is still queued or running
+                logger.info('Skip render of %s. scad file unchanged and already queued', stl_file_name)
+            elif args.render:
+                logger.debug('Render STL from SCAD')
+                logger.info('Generate stl file with name %s from %s', stl_file_name, scad_file_name)
+
+                render_queue.add(scad_file_name, stl_file_name, scad_writer.fragments, part_name, key_count)
+
+    return skipped_render_list
+
+
+def parse_sweep_arguments(sweep_argument_list):
+    # Parse --sweep name=value1,value2 arguments into a list of (name, value_list) pairs. Raises ValueError for an invalid argument
+    # Each value is parsed as JSON when possible and is otherwise a string. name=[...] gives the values as a JSON list
+    default_parameters = Parameters()
+    sweep_parameter_list = []
+
+    for sweep_argument in sweep_argument_list:
+        (name, separator, value_text) = sweep_argument.partition('=')
+        name = name.strip()
+
+        if separator == '' or name == '' or value_text.strip() == '':
+            raise ValueError('Invalid sweep %s. Use name=value1,value2' % (sweep_argument))
+
+        if hasattr(default_parameters, name) == False and name not in default_parameters.paramater_alternate_dict.keys():
+            raise ValueError('Unknown sweep parameter %s' % (name))
+
+        if name in [sweep_name for (sweep_name, value_list) in sweep_parameter_list]:
+            raise ValueError('Parameter %s is swept more than once' % (name))
+
+        if value_text.strip().startswith('['):
+            value_list = json.loads(value_text)
+        else:
+            value_list = []
+            for value in value_text.split(','):
+                try:
+                    value_list.append(json.loads(value))
+                except ValueError:
+                    value_list.append(value.strip())
+
+        sweep_parameter_list.append((name, value_list))
+
+    return sweep_parameter_list
+
+
+def get_sweep_variant_name(variant_dict):
+    # Folder name for a sweep variant, for example switch_type-alps_kerf-0.1
+    variant_name = '_'.join('%s-%s' % (name, str(value)) for (name, value) in variant_dict.items())
+
+    return re.sub('[^A-Za-z0-9._-]+', '-', variant_name)
+
+
+def sweep(args, keyboard_layout_dict, parameter_dict, sweep_parameter_list, part_name_list, layout_name, output_base_folder, scad_writer: ScadWriter, render_queue: RenderQueue = None, part_deduplicator: PartDeduplicator = None, checkpoint: RunCheckpoint = None, run_report: RunReport = None, layout_cache: LayoutCache = None):
+    # Build every combination of the swept parameter values from the layout parsed once
+    # A part is only generated again when a swept parameter it depends on changed. Returns a summary for each variant
+    sweep_name_list = [name for (name, value_list) in sweep_parameter_list]
+    variant_list = [dict(zip(sweep_name_list, value_tuple)) for value_tuple in itertools.product(*[value_list for (name, value_list) in sweep_parameter_list])]
+
+    # Scad text of parts that do not depend on every swept parameter, keyed by the part and the values of the swept parameters it depends on
+    shared_scad_text_dict = {}
+
+    summary_list = []
+    for (variant_number, variant_dict) in enumerate(variant_list):
+        variant_name = get_sweep_variant_name(variant_dict)
+        print('\nVariant %d of %d: %s' % (variant_number + 1, len(variant_list), ', '.join('%s=%s' % (name, str(value)) for (name, value) in variant_dict.items())))
+
+        variant_folder_path = output_base_folder / 'sweep' / variant_name
+        scad_folder_path = variant_folder_path / 'scad'
+        stl_folder_path = variant_folder_path / 'stl'
+        scad_folder_path.mkdir(parents = True, exist_ok = True)
+        stl_folder_path.mkdir(parents = True, exist_ok = True)
+
+        summary = {
+            'variant_name': variant_name,
+            'variant_folder_path': variant_folder_path,
+            'stl_folder_path': stl_folder_path,
+            'error': None,
+            'part_count': 0,
+            'reused_count': 0,
+            'generate_time': 0.0,
+            'skipped_render_list': []
+        }
+        summary_list.append(summary)
+
+        variant_parameter_dict = {}
+        if parameter_dict is not None:
+            variant_parameter_dict.update(parameter_dict)
+        variant_parameter_dict.update(variant_dict)
+
+        if run_report is not None:
+            run_report.set_context(variant = variant_name)
+
+        # A variant that fails does not stop the sweep
         try:
-            keyboard_layout_dict = json.loads(keyboard_layout)
-            logger.info('Initial layout Json Invalid. Json modified and parsed')
-        except:
-            logger.error('Failed to parse layout json after attempt at correction.')
-            raise
+            generate_start_time = time.monotonic()
+            (parameters, keyboard) = build_keyboard(keyboard_layout_dict, variant_parameter_dict, run_report, layout_cache)
+            part_list = keyboard.get_part_list(all_sections = args.all_sections, exploded = args.exploded, section = args.section, part_name_list = part_name_list)
+
+            if run_report is not None:
+                run_report.record_sections(keyboard.get_top_section_count(), keyboard.get_bottom_section_count())
+
+            part_key_dict = {}
+            scad_text_dict = {}
+            for part in part_list:
+                part_parameter_list = keyboard.get_part_parameter_list(part[0], part[1], sweep_name_list)
+
+                # Parts that change with every swept parameter are never shared
+                if len(part_parameter_list) == len(sweep_name_list):
+                    continue
+
+                part_key = part + tuple((name, json.dumps(variant_dict[name])) for name in part_parameter_list)
+                part_key_dict[part] = part_key
+
+                if part_key in shared_scad_text_dict.keys():
+                    scad_text_dict[part] = shared_scad_text_dict[part_key]
+
+            summary['reused_count'] = len(scad_text_dict)
+
+            summary['skipped_render_list'] = write_parts(args, keyboard, parameters, part_list, layout_name, scad_folder_path, stl_folder_path, scad_writer, render_queue, part_deduplicator, scad_text_dict, checkpoint)
+
+            for (part, part_key) in part_key_dict.items():
+                if part in scad_text_dict.keys():
+                    shared_scad_text_dict[part_key] = scad_text_dict[part]
+
+            summary['part_count'] = len(part_list)
+            summary['generate_time'] = time.monotonic() - generate_start_time
+        except Exception as e:
+            logger.exception('Failed to build sweep variant %s', variant_name)
+            summary['error'] = str(e)
 
-    logger.debug('keyboard_layout_dict: %s', str(keyboard_layout_dict))
+    print('\nSweep: %d variants' % (len(summary_list)))
+    print('  %-50s %6s %9s %6s %8s' % ('variant', 'parts', 'generated', 'reused', 'generate'))
+    for summary in summary_list:
+        logger.info('Sweep variant %s: parts: %d, reused: %d, generate: %.2fs, error: %s', summary['variant_name'], summary['part_count'], summary['reused_count'], summary['generate_time'], str(summary['error']))
 
+        if summary['error'] is not None:
+            print('  %-50s failed: %s' % (summary['variant_name'], summary['error']))
+            continue
 
-    # Read parameter file
-    parameter_dict = None
+        print('  %-50s %6d %9d %6d %7.2fs' % (summary['variant_name'], summary['part_count'], summary['part_count'] - summary['reused_count'], summary['reused_count'], summary['generate_time']))
+
+    return summary_list
+
+
+def get_changed_parameter_list(old_parameter_dict, new_parameter_dict):
+    # The parameters added, removed or changed between two parameter dicts. None is no parameter file
+    old_parameter_dict = old_parameter_dict or {}
+    new_parameter_dict = new_parameter_dict or {}
+
+    parameter_name_set = set(old_parameter_dict.keys()).union(new_parameter_dict.keys())
+
+    return sorted(name for name in parameter_name_set if name not in old_parameter_dict.keys() or name not in new_parameter_dict.keys() or old_parameter_dict[name] != new_parameter_dict[name])
+
+
+def watch(args, keyboard: Keyboard, keyboard_layout_dict, parameter_dict, part_name_list, layout_name, scad_folder_path, stl_folder_path, scad_writer: ScadWriter, render_queue: RenderQueue = None, layout_cache: LayoutCache = None):
+    # Rebuild the changed parts each time the layout or parameter file changes until interrupted
+    # keyboard is the keyboard built from keyboard_layout_dict and parameter_dict before watching
+    input_file_path = Path(args.input_file)
+    parameter_file_path = None
     if args.parameter_file is not None:
-        # Open JSON parameter file
-        logger.debug('Open parameter file %s', args.parameter_file)
-        try:
-            # Try with utf-8 encoding specified
-            f = open(args.parameter_file, encoding="utf-8")
-        except:
-            # Failed to open
-            logger.info('Failed to open parameter file with utf-8 encoding specified. Try opening without specifying an encoding')
+        parameter_file_path = Path(args.parameter_file)
+
+    file_watcher = FileWatcher([input_file_path, parameter_file_path], debounce = args.watch_debounce)
+
+    # Only parts whose scad file changed are written and rendered again
+    scad_writer.incremental = True
+
+    print('\nWatching %s for changes. Press Ctrl+C to stop' % (', '.join(str(file_path) for file_path in file_watcher.file_list)))
+
+    try:
+        while True:
+            changed_list = file_watcher.wait_for_change()
+            print('\nChanged: %s' % (', '.join(str(file_path) for file_path in changed_list)))
+
+            # Only parse the files that changed. A file that fails to parse keeps its last good contents
             try:
-                # Try opening with no encoding spcificed
-                f = open(args.parameter_fil)
-            except:
-                logger.error('Failed to open parameter file both spefifying utf-8 andcoding and not specifying any encodeing. Exiting')
-                exit(1)
-        
-
-        logger.debug('Read JSON string from parameter file %s', args.parameter_file)
-        try:
-             parameter_file_text = f.read()
-        except UnicodeDecodeError:
-            logger.error('Unable to decode parameter file. Please provide utf-8 encoded files')
-            exit(-1)
-       
-        logger.debug('Parse parameter JSON string')
-        try:
-            parameter_dict = json.loads(parameter_file_text)
-            logger.debug('Valid Json Parsed')
-        except:
-            logger.error('Failed to parse parameter JSON file.')
-            raise
+                new_keyboard_layout_dict = keyboard_layout_dict
+                if input_file_path in changed_list:
+                    new_keyboard_layout_dict = read_layout_file(input_file_path)
 
-        logger.debug('parameter_dict: %s', str(parameter_dict))
+                new_parameter_dict = parameter_dict
+                if parameter_file_path is not None and parameter_file_path in changed_list:
+                    new_parameter_dict = read_parameter_file(parameter_file_path)
 
+                layout_changed = new_keyboard_layout_dict != keyboard_layout_dict
+                changed_parameter_list = get_changed_parameter_list(parameter_dict, new_parameter_dict)
 
-    # Set parameters from imput file
-    parameters = Parameters(parameter_dict)
-    
-    # Create Keyboard instance
-    keyboard = Keyboard(parameters)
-
-    # Process the keyboard layout object
-    keyboard.process_keyboard_layout(keyboard_layout_dict)
-    keyboard.process_custom_shapes()
-
-    logger.debug('kerf: %f', keyboard.kerf)
-
-    # Dictionary of SolidPython solid objects that need to be rendered to SCAD and to STL if desired
-    solid_object_dict = {}
-
-    # Create objects for each of the generated sections
-    if args.all_sections == True:
-        # Iterate over all sections generated and add all sections to solid_object_dict
-        for section in range(keyboard.get_top_section_count()):
-            # Set current section for generator
-            keyboard.set_section(section)
-
-            # Create dict for section
-            solid_object_dict[section] = {}
-
-            # Add top assembly, plate, and all assembly to section dict
-            solid_object_dict[section]['top'] = keyboard.get_assembly(top = True)
-            solid_object_dict[section]['all'] = keyboard.get_assembly(all = True)
-            solid_object_dict[section]['plate'] = keyboard.get_assembly(plate_only = True)
-
-            # If there is a bottom section for the current section add it to section dict
-            if section < keyboard.get_bottom_section_count():
-                solid_object_dict[section]['bottom'] = keyboard.get_assembly(bottom = True)
-            
-    # Create exploded object
-    elif args.exploded == True:
-        solid_object_dict[-1] = {}
-        solid_object_dict[-1]['top'] = union()
-        solid_object_dict[-1]['plate'] = union()
-        solid_object_dict[-1]['bottom'] = union()
-        for section in range(keyboard.get_top_section_count()):
-            keyboard.set_section(section)
-            solid_object_dict[-1]['top'] += up(5 * section) ( right(10 * section) ( keyboard.get_assembly(top = True) ) )
-            solid_object_dict[-1]['plate'] += up(5 * section) ( right(10 * section) ( keyboard.get_assembly(plate_only = True) ) )
-            if section < keyboard.get_bottom_section_count():
-                solid_object_dict[-1]['bottom'] += up(5 * section) ( right(10 * section) ( keyboard.get_assembly(bottom = True) ) )
-    
+                if layout_changed == False and len(changed_parameter_list) == 0:
+                    print('No layout or parameter changes')
+                    continue
 
-    # Create objects for a specified section
-    elif args.section > -1:
-        # Set desired section to create
-        keyboard.set_section(args.section)
+                # The processed layout of the last build is reused unless the layout or a parameter that places the keys changed
+                processed_layout_dict = None
+                if layout_changed == False and len(set(changed_parameter_list).intersection(LayoutCache.PARAMETER_NAME_LIST)) == 0:
+                    processed_layout_dict = keyboard.get_processed_layout()
 
-        # Create dict for section
-        solid_object_dict[args.section] = {}
+                (new_parameters, new_keyboard) = build_keyboard(new_keyboard_layout_dict, new_parameter_dict, layout_cache = layout_cache, processed_layout_dict = processed_layout_dict)
+                part_list = new_keyboard.get_part_list(all_sections = args.all_sections, exploded = args.exploded, section = args.section, part_name_list = part_name_list)
+            except Exception as e:
+                logger.error('Failed to process changed files: %s', str(e))
+                print('Failed to process changed files: %s. Waiting for the next change' % (str(e)))
+                continue
 
-        # Add top assembly, plate, and all assembly to section dict
-        solid_object_dict[args.section]['top'] = keyboard.get_assembly(top = True)
-        solid_object_dict[args.section]['all'] = keyboard.get_assembly(all = True)
-        solid_object_dict[args.section]['plate'] = keyboard.get_assembly(plate_only = True)
+            (keyboard_layout_dict, parameter_dict, keyboard) = (new_keyboard_layout_dict, new_parameter_dict, new_keyboard)
 
-        # If there is a bottom section for the current section add it to section dict
-        if args.section < keyboard.get_bottom_section_count():
-            solid_object_dict[args.section]['bottom'] = keyboard.get_assembly(bottom = True)
+            # A layout change can move every key. Otherwise only the parts that depend on a changed parameter are built
+            if layout_changed == False:
+                print('Changed parameters: %s' % (', '.join(changed_parameter_list)))
+                part_list = [(section, part_name) for (section, part_name) in part_list if len(keyboard.get_part_parameter_list(section, part_name, changed_parameter_list)) > 0]
 
-    # Create an objects that are not split into sections. No other options were specified
-    else:
-        logger.debug('Create whole object. No other options specified')
-        solid_object_dict['all'] = {}
-        solid_object_dict['all']['top'] = keyboard.get_assembly(top = True)
-        solid_object_dict['all']['bottom'] = keyboard.get_assembly(bottom = True)
-        solid_object_dict['all']['all'] = keyboard.get_assembly(all = True)
-        solid_object_dict['all']['plate'] = keyboard.get_assembly(plate_only = True)
-    
-    # Add global items that are not dependant on the sctions or parts of the item to build
-    solid_object_dict['global'] = {}
+            if render_queue is not None:
+                render_queue.trim_completed_jobs()
 
-    # Generate a strain relief piece for the cable hole
-    if parameters.cable_hole == True:
-        cable = Cable(parameters)
-        solid_object_dict['global']['cable_holder_main'] = cable.holder_main()
-        solid_object_dict['global']['cable_holder_clamp'] = cable.holder_clamp()
-        solid_object_dict['global']['cable_holder_all'] = cable.holder_all()
+            written_count = len(scad_writer.written_list)
 
-    print(parameters)
-    print('Case Height: %f, Case Width: %f\n' % (parameters.real_case_height, parameters.real_case_width))
-    
-    logger.info('Case Height: %f, Case Width: %f', parameters.real_case_height, parameters.real_case_width)
-    logger.info('Sections In Top: %d', keyboard.get_top_section_count())
-    logger.info('Sections In Bottom: %d', keyboard.get_bottom_section_count())
+            write_parts(args, keyboard, new_parameters, part_list, layout_name, scad_folder_path, stl_folder_path, scad_writer, render_queue)
 
+            print('Rebuilt %d of %d affected parts' % (len(scad_writer.written_list) - written_count, len(part_list)))
+    except KeyboardInterrupt:
+        logger.info('Watch stopped')
+        print('\nWatch stopped')
 
-    ############################################################
-    # Render SCAD and STL files
-    ############################################################
-    subprocess_dict = {}
 
-    switch_type_for_filename = ''
-    stab_type_for_filename = ''
+def main():
+
+    # Render worker entry point
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        worker_main(sys.argv[2:])
+        return 0
 
-    for section in solid_object_dict.keys():
+    # Batch entry point
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        return batch_main(sys.argv[2:])
 
-        if args.switch_type_in_filename == True:
-            switch_type_for_filename = '_' + parameters.switch_type
-            stab_type_for_filename = '_' + parameters.stabilizer_type
+    # Generation server entry point
+    if len(sys.argv) > 1 and sys.argv[1] == 'server':
+        server_main(sys.argv[2:])
+        return 0
 
-        section_postfix = ''
+    parser = argparse.ArgumentParser(description='Build custom keyboard SCAD file using keyboard layout editor format')
+    parser.add_argument('-i', '--input-file', metavar = 'layout_json_file_name.json', help = 'A path to a keyboard layout editor json file', required = True, action=CheckExt({'json'}))
+    # parser.add_argument('-o', '--output-folder', metavar = 'scad', help = 'A path to a folder to store the generated open scad file')
+    parser.add_argument('-p', '--parameter-file', metavar = 'parameters.json', help = 'A JSON file containing paramters for the object buing made', default = None, action=CheckExt({'json'}))
+    add_build_arguments(parser)
+    parser.add_argument('--plan', help = 'Print the parts that would be built and what each one depends on without building anything', default = False, action = 'store_true')
+    parser.add_argument('-w', '--watch', help = 'Keep running and rebuild the parts that changed each time the layout or parameter file is saved', default = False, action = 'store_true')
+    parser.add_argument('--watch-debounce', metavar = 'seconds', help = 'How long the watched files must be unchanged before a rebuild starts', type = float, default = 1.0)
+    parser.add_argument('--resume', help = 'Continue an interrupted run. Scad files and STL files the checkpoint of the last run shows as complete and unchanged are skipped. Missing and failed parts are built again', default = False, action = 'store_true')
+    parser.add_argument('--sweep', metavar = 'name=value1,value2', help = 'Build every combination of the given parameter values into layout/sweep/<variant>. Can be given more than once, for example --sweep switch_type=mx,alps --sweep kerf=0,0.1', default = None, action = 'append')
 
-        # Creating global items that have no relaton to switch type
-        if isinstance(section, str) and section == 'global':
-            switch_type_for_filename = ''
-            stab_type_for_filename = ''
-        
-        # If the current object dict section is an int greater than -1 add the section number to the filename
-        if isinstance(section, int) and section > -1:
-            section_postfix = '_section_%d' % (section)
-        
-        if args.exploded == True:
-            section_postfix = '_exploded'
+    # Parse command line arguments
+    args = parser.parse_args()
+    logger.debug(vars(args))
 
-        for part_name in solid_object_dict[section].keys():
-            part_name_formatted = '_' + part_name
+    if args.watch == True and args.render_queue_db is not None:
+        parser.error('--watch renders locally and can not be used with --render-queue-db')
 
-            scad_file_name = scad_folder_path / (layout_name + section_postfix + part_name_formatted + switch_type_for_filename + stab_type_for_filename + scad_postfix)
-            stl_file_name = stl_folder_path / (layout_name + section_postfix + part_name_formatted + switch_type_for_filename + stab_type_for_filename + stl_postfix)
+    if args.watch == True and args.resume == True:
+        parser.error('--resume can not be used with --watch')
 
-            if solid_object_dict[section][part_name] is not None:
-                logger.info('Generate scad file with name %s', scad_file_name)
-                # Generate SCAD file from assembly
-                scad_render_to_file(solid_object_dict[section][part_name], scad_file_name, file_header=f'$fn = {FRAGMENTS};')
-                print('Generated scad file with name', scad_file_name)
-                
-                # Render STL if option is chosen
-                if args.render:
-                    logger.debug('Render STL from SCAD')
-                    logger.info('Generate stl file with name %s from %s', stl_file_name, scad_file_name)
-
-                    openscad_command_list = ['openscad', '-o', '%s' % (stl_file_name), '%s' % (scad_file_name)]
-                    subprocess_dict[stl_file_name] = subprocess.Popen(openscad_command_list)
+    sweep_parameter_list = None
+    if args.sweep is not None:
+        if args.watch == True:
+            parser.error('--sweep can not be used with --watch')
+
+        try:
+            sweep_parameter_list = parse_sweep_arguments(args.sweep)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # Create Path object from input file argument
+    input_file_path = Path(args.input_file)
+
+    # Set fragments per circle
+    FRAGMENTS = args.fragments
+    logger.debug('\tFragments: %d', FRAGMENTS)
+
+    run_report = None
+    if args.report is not None and args.plan == False:
+        run_report = RunReport(args.report)
+
+    # Read the layout and parameter files
+    try:
+        with (run_report.time_phase('layout_parse') if run_report is not None else contextlib.nullcontext()):
+            keyboard_layout_dict = read_layout_file(input_file_path)
+            parameter_dict = read_parameter_file(args.parameter_file)
+    except (OSError, UnicodeDecodeError, ValueError):
+        logger.error('Unable to read the layout or parameter file. Exiting')
+        exit(1)
+
+    parameter_folder_name = None
+    if args.parameter_folder == True:
+        parameter_folder_name = get_parameter_folder_name(args.parameter_file, parameter_dict)
+
+    # A build plan does not write anything
+    (layout_name, output_base_folder, scad_folder_path, stl_folder_path) = get_output_folders(input_file_path, create = args.plan == False, parameter_folder_name = parameter_folder_name)
+
+    # The sweep variants are recorded in the report instead of the base keyboard
+    # A build plan does not write to the layout cache either
+    layout_cache = None
+    if args.plan == False:
+        layout_cache = create_layout_cache(args)
+
+    (parameters, keyboard) = build_keyboard(keyboard_layout_dict, parameter_dict, run_report if args.sweep is None else None, layout_cache)
+
+    # Resolve the parts to build
+    part_name_list = None
+    if args.parts is not None:
+        try:
+            part_name_list = keyboard.get_part_names([part.strip() for part in args.parts.split(',') if part.strip() != ''])
+        except ValueError as e:
+            parser.error(str(e))
+
+    part_list = keyboard.get_part_list(all_sections = args.all_sections, exploded = args.exploded, section = args.section, part_name_list = part_name_list)
+
+    if keyboard.run_report is not None:
+        keyboard.run_report.record_sections(keyboard.get_top_section_count(), keyboard.get_bottom_section_count())
+
+    if args.plan == True:
+        print('Build plan: %d parts' % (len(part_list)))
+        for (section, part_name) in part_list:
+            dependency_list = sorted(keyboard.get_part_dependency_set(part_name) - {part_name})
+            print('  %s (section: %s, part: %s, needs: %s)' % (
+                keyboard.get_part_file_stem(layout_name, section, part_name, args.switch_type_in_filename, args.exploded),
+                str(section), part_name, ', '.join(dependency_list) if len(dependency_list) > 0 else 'nothing'
+            ))
+
+        if sweep_parameter_list is not None:
+            sweep_name_list = [name for (name, value_list) in sweep_parameter_list]
+            print('Sweep: %d variants' % (len(list(itertools.product(*[value_list for (name, value_list) in sweep_parameter_list])))))
+            for (name, value_list) in sweep_parameter_list:
+                print('  %s: %s' % (name, ', '.join(str(value) for value in value_list)))
+            for (section, part_name) in part_list:
+                part_parameter_list = keyboard.get_part_parameter_list(section, part_name, sweep_name_list)
+                print('  section: %s, part: %s, varies with: %s' % (str(section), part_name, ', '.join(part_parameter_list) if len(part_parameter_list) > 0 else 'nothing. Shared by all variants'))
+        return 0
+
+    ############################################################
+    # Generate SCAD files and render STL files
+    ############################################################
+    render_queue = None
+    if args.render:
+        render_queue = create_render_queue(args)
+
+        # Workers are started before generation so renders run while the remaining parts are generated
+        render_queue.start()
+
+    source_file = Path(os.path.realpath(__file__))
+    scad_writer = ScadWriter(FRAGMENTS, incremental = args.incremental, source_file = source_file)
+
+    # Parts with identical geometry are only rendered once. Watch mode renders each part on its own
+    part_deduplicator = None
+    if args.no_dedup == False and args.watch == False:
+        part_deduplicator = PartDeduplicator()
+
+    # The checkpoint records completed scad writes and renders so an interrupted run can be continued with --resume
+    checkpoint = None
+    if args.watch == False:
+        input_hash = RunCheckpoint.get_input_hash(keyboard_layout_dict, parameter_dict, FRAGMENTS, source_file.parent, args.sweep)
+        checkpoint = RunCheckpoint(output_base_folder / (layout_name + '_checkpoint.json'), input_hash, resume = args.resume)
+
+        if args.render:
+            render_queue.completion_callback = checkpoint.record_job
+
+    # Watch mode runs until it is interrupted so it only prints its own lines
+    progress_display = None
+    if args.no_progress == False and args.watch == False:
+        part_total = None
+        if sweep_parameter_list is None:
+            part_total = len(part_list)
+
+        progress_display = ProgressDisplay(render_queue, scad_writer, part_total)
+        progress_display.start()
+
+    sweep_summary_list = None
+    if sweep_parameter_list is not None:
+        sweep_summary_list = sweep(args, keyboard_layout_dict, parameter_dict, sweep_parameter_list, part_name_list, layout_name, output_base_folder, scad_writer, render_queue, part_deduplicator, checkpoint, run_report, layout_cache)
+        skipped_render_list = [stl_file_name for summary in sweep_summary_list for stl_file_name in summary['skipped_render_list']]
+    else:
+        skipped_render_list = write_parts(args, keyboard, parameters, part_list, layout_name, scad_folder_path, stl_folder_path, scad_writer, render_queue, part_deduplicator, checkpoint = checkpoint)
+
+    if args.resume == True:
+        logger.info('Resume: %d renders complete', len(skipped_render_list))
+        print('Resume: %d renders were already complete' % (len(skipped_render_list)))
+
+    print(parameters)
+    print('Case Height: %f, Case Width: %f\n' % (parameters.real_case_height, parameters.real_case_width))
+    
+    logger.info('Case Height: %f, Case Width: %f', parameters.real_case_height, parameters.real_case_width)
+    logger.info('Sections In Top: %d', keyboard.get_top_section_count())
+    logger.info('Sections In Bottom: %d', keyboard.get_bottom_section_count())
+
+    if args.watch == True:
+        watch(args, keyboard, keyboard_layout_dict, parameter_dict, part_name_list, layout_name, scad_folder_path, stl_folder_path, scad_writer, render_queue, layout_cache)
     
     
     ################################################################
     #  Wait for render processes to complete
     ################################################################
     if args.render:
-        logger.debug(subprocess_dict)
-        running = True
-        while running == True:
-            running = False
-            for stl_file_name in subprocess_dict.keys():
-                p = subprocess_dict[stl_file_name]
-                if p is not None:
-                    # running = True
-                    rcode = None
-                    try:
-                        rcode = p.wait(.1)
-                    except subprocess.TimeoutExpired as err:
-                        running = True
-                    if rcode is not None:
-                        logger.info('Render Complete: file: %s', stl_file_name)
-                        print('Render Complete: file:', stl_file_name)
-                        subprocess_dict[stl_file_name] = None
-            # time.sleep(1)
+        completed_job_list = render_queue.join()
+
+        # Watch mode reports the latest render of each part
+        if args.watch == True:
+            render_queue.trim_completed_jobs()
+            completed_job_list = render_queue.completed_job_list
 
+    if progress_display is not None:
+        progress_display.stop()
 
+    if args.render:
+        # Renders replaced by a newer render in watch mode are not reported
+        completed_job_list = [job for job in completed_job_list if job.status != RenderJob.STATUS_CANCELLED]
+
+        failed_job_list = [job for job in completed_job_list if job.return_code != 0]
+
+        if run_report is not None:
+            for job in completed_job_list:
+                run_report.record_render(job)
+
+        cache_hit_list = [job for job in completed_job_list if job.cache_hit == True]
+        total_render_time = sum(job.get_wall_time() for job in completed_job_list)
+        logger.info('Rendered %d files with %d jobs, %d cached, %d failed, total render time: %.2fs', len(completed_job_list), render_queue.jobs, len(cache_hit_list), len(failed_job_list), total_render_time)
+        print('Rendered %d files, concurrent renders: %d, cached: %d, failed: %d' % (len(completed_job_list), render_queue.jobs, len(cache_hit_list), len(failed_job_list)))
+        for job in failed_job_list:
+            print('  Failed: %s (%s, return code %d)' % (job.stl_file_name, job.status, job.return_code))
+
+        if part_deduplicator is not None:
+            # Copy each rendered unique part to the file names of the parts identical to it
+            alias_list = part_deduplicator.fan_out(set(job.stl_file_name for job in failed_job_list))
+
+            if checkpoint is not None:
+                for (primary_stl_file_name, primary_alias_list) in part_deduplicator.alias_dict.items():
+                    for alias_stl_file_name in primary_alias_list:
+                        if alias_stl_file_name in alias_list:
+                            checkpoint.record_stl(alias_stl_file_name, part_deduplicator.key_dict[primary_stl_file_name], 0, RenderJob.STATUS_OK)
+            if sweep_summary_list is not None:
+                for summary in sweep_summary_list:
+                    part_deduplicator.write_manifest(summary['variant_folder_path'] / (layout_name + '_parts.json'), folder = summary['stl_folder_path'])
+            else:
+                part_deduplicator.write_manifest(output_base_folder / (layout_name + '_parts.json'))
+            logger.info('Copied %d identical parts of %d', len(alias_list), part_deduplicator.get_alias_count())
+
+            if run_report is not None:
+                record_copies(run_report, part_deduplicator, alias_list)
+            print('Copied %d identical parts' % (len(alias_list)))
+
+    # Records since the last periodic save of the checkpoint
+    if checkpoint is not None:
+        checkpoint.save()
+
+    if args.incremental == True:
+        logger.info('Incremental build: %d scad files written, %d unchanged, %d renders skipped', len(scad_writer.written_list), len(scad_writer.skipped_list), len(skipped_render_list))
+        print('\nIncremental build summary:')
+        print('  Rebuilt parts: %d' % (len(scad_writer.written_list)))
+        for scad_file_name in scad_writer.written_list:
+            print('    %s' % (scad_file_name.name))
+        print('  Skipped unchanged parts: %d' % (len(scad_writer.skipped_list)))
+        for scad_file_name in scad_writer.skipped_list:
+            print('    %s' % (scad_file_name.name))
+        if args.render:
+            print('  Skipped renders: %d' % (len(skipped_render_list)))
+
+    if run_report is not None:
+        run_report.write(
+            command = 'generate',
+            layout_file = args.input_file,
+            parameter_file = args.parameter_file,
+            fragments = FRAGMENTS,
+            generation_jobs = args.generation_jobs,
+            part_count = len(run_report.part_dict),
+            scad_bytes = sum(part.get('scad_bytes', 0) for part in run_report.part_dict.values()),
+            render_count = len([part for part in run_report.part_dict.values() if 'render' in part.keys()]),
+            failed_count = len([part for part in run_report.part_dict.values() if 'render' in part.keys() and part['render']['return_code'] != 0])
+        )
+        print('Wrote run report %s' % (args.report))
 
     logger.info('Generation Complete')
 
+    # A failed render exits with an error so scripts and CI notice missing STL files
+    if args.render and len(failed_job_list) > 0:
+        return 1
+
+    return 0
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
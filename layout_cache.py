@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from atomic_file import write_text_atomic
+from source_hash import get_source_hash
+
+
+
+class LayoutCache():
+    """
+    Disk cache of processed keyboard layouts
+
+    A processed layout is the list of keys with their rectangles and rotation data, the global and local
+    neighbor graph of the switches and the section each switch was split into. It only depends on the layout
+    and the parameters that place and split the keys, so it is keyed by a hash of the layout, those parameters
+    and the generator source. Cached layouts are stored as JSON files
+
+    ...
+
+    Attributes
+    ----------
+    cache_folder : str, default ~/.cache/keyboard_stl_generator/layouts
+        The folder the processed layouts are stored in
+
+    Methods
+    -------
+    get_key(keyboard_layout_dict, parameters)
+        Get the cache key for a layout and its parameters
+    load(key)
+        Get the processed layout dict stored under key. Returns None on a cache miss
+    save(key, processed_layout_dict)
+        Store a processed layout dict under key
+    """
+
+    DEFAULT_CACHE_FOLDER = Path('~/.cache/keyboard_stl_generator/layouts')
+
+    # Changed whenever the format of the processed layout dict changes
+    VERSION = 1
+
+    # The parameters the key positions, the neighbor graph and the section split depend on
+    PARAMETER_NAME_LIST = ['switch_spacing', 'x_build_size', 'y_build_size', 'left_margin']
+
+    def __init__(self, cache_folder = None):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        if cache_folder is None:
+            cache_folder = self.DEFAULT_CACHE_FOLDER
+
+        self.cache_folder = Path(cache_folder).expanduser()
+        self.cache_folder.mkdir(parents = True, exist_ok = True)
+
+        self.hit_count = 0
+        self.miss_count = 0
+
+
+    def get_source_hash(self):
+        # A change to the generator code can change how keys are placed, joined and split
+        return get_source_hash(Path(__file__).parent)
+
+
+    def get_key(self, keyboard_layout_dict, parameters):
+        parameter_dict = {name: getattr(parameters, name) for name in self.PARAMETER_NAME_LIST}
+
+        key_hash = hashlib.sha256()
+        key_hash.update(json.dumps([self.VERSION, keyboard_layout_dict, parameter_dict], sort_keys = True, default = str).encode('utf-8'))
+        key_hash.update(self.get_source_hash().encode('utf-8'))
+
+        return key_hash.hexdigest()
+
+
+    def get_entry_path(self, key):
+        return self.cache_folder / (key + '.json')
+
+
+    def load(self, key):
+        entry_path = self.get_entry_path(key)
+
+        try:
+            with open(entry_path, encoding = 'utf-8') as f:
+                processed_layout_dict = json.load(f)
+        except FileNotFoundError:
+            self.miss_count += 1
+            return None
+        except (OSError, ValueError) as err:
+            self.logger.warning('Failed to read layout cache entry %s: %s', entry_path, str(err))
+            self.miss_count += 1
+            return None
+
+        if processed_layout_dict.get('version') != self.VERSION:
+            self.miss_count += 1
+            return None
+
+        self.logger.debug('Layout cache hit %s', key)
+        self.hit_count += 1
+
+        return processed_layout_dict
+
+
+    def save(self, key, processed_layout_dict):
+        processed_layout_dict['version'] = self.VERSION
+
+        try:
+            write_text_atomic(self.get_entry_path(key), json.dumps(processed_layout_dict))
+        except OSError as err:
+            self.logger.warning('Failed to add layout to layout cache: %s', str(err))
@@ -0,0 +1,231 @@
+import json
+import logging
+import re
+
+
+logger = logging.getLogger().getChild(__name__)
+
+# Tokens of keyboard layout editor JSON and raw keyboard-layout-editor output, which leaves object keys unquoted
+# A token is a punctuation character, a complete string, a lone quote that starts an unterminated string, or a bare
+# word such as a number, true or an unquoted key. Whitespace between tokens is skipped
+TOKEN_PATTERN = re.compile(r'[\[\]{},:]|"(?:[^"\\\x00-\x1f]|\\.)*"|"|[^\s\[\]{},:"]+')
+NUMBER_PATTERN = re.compile(r'-?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?')
+INTEGER_PATTERN = re.compile(r'-?\d+')
+NAME_PATTERN = re.compile(r'[A-Za-z_$][A-Za-z0-9_$]*')
+
+# Bare words accepted as values
+NAME_VALUE_DICT = {
+    'true': True,
+    'false': False,
+    'null': None
+}
+
+# What the parser expects next
+EXPECT_VALUE = 0
+EXPECT_KEY = 1
+EXPECT_COLON = 2
+EXPECT_SEPARATOR = 3
+
+
+def get_layout_error(keyboard_layout, token_index, message):
+    # Build the error for the token at token_index. Only called on failure, so finding the position of the token
+    # by scanning the tokens again does not slow down parsing
+    position = len(keyboard_layout)
+    for (index, match) in enumerate(TOKEN_PATTERN.finditer(keyboard_layout)):
+        if index == token_index:
+            position = match.start()
+            break
+
+    return json.JSONDecodeError(message, keyboard_layout, position)
+
+
+def parse_layout_value(token):
+    # The value of a string or bare word token. Returns (True, value), or (False, None) if the token is not a value
+    if token[0] == '"':
+        if len(token) < 2:
+            return (False, None)
+
+        # Only strings with escapes need decoding
+        if '\\' in token:
+            return (True, json.loads(token))
+
+        return (True, token[1:-1])
+
+    if token in NAME_VALUE_DICT.keys():
+        return (True, NAME_VALUE_DICT[token])
+
+    if INTEGER_PATTERN.fullmatch(token) is not None:
+        return (True, int(token))
+
+    if NUMBER_PATTERN.fullmatch(token) is not None:
+        return (True, float(token))
+
+    return (False, None)
+
+
+def is_row_list(value):
+    # A list of rows. The first item can be the keyboard metadata object instead of a row
+    if isinstance(value, list) == False or len(value) == 0:
+        return False
+
+    row_list = value[1:] if isinstance(value[0], dict) else value
+
+    return len(row_list) > 0 and all(isinstance(row, list) for row in row_list)
+
+
+def parse_layout_text(keyboard_layout):
+    # Parse keyboard layout editor JSON. Raw keyboard-layout-editor output is also accepted
+    #
+    # The rows and keys are built in a single pass over the tokens of the text, so a raw layout is not parsed twice.
+    # Object keys may be quoted or bare words such as x, w, rx or sm, and the rows of raw output do not have to be
+    # wrapped in a list. Raises json.JSONDecodeError, a ValueError, for text that is not a layout
+    logger.debug('Parse layout text')
+
+    # Text decoded without removing the byte order mark still starts with it
+    if keyboard_layout.startswith('\ufeff'):
+        keyboard_layout = keyboard_layout[1:]
+
+    token_list = TOKEN_PATTERN.findall(keyboard_layout)
+
+    # The values at the top level, the rows of the layout
+    top_level_list = []
+
+    # The open list or object, and the lists and objects it is in with the key it is stored under
+    container = top_level_list
+    is_object = False
+    parent_list = []
+    key = None
+    expect = EXPECT_VALUE
+
+    for (token_index, token) in enumerate(token_list):
+        if expect == EXPECT_VALUE:
+            if token == '[' or token == '{':
+                child = [] if token == '[' else {}
+                if is_object:
+                    container[key] = child
+                else:
+                    container.append(child)
+
+                parent_list.append((container, is_object))
+                container = child
+                is_object = token == '{'
+                expect = EXPECT_KEY if is_object else EXPECT_VALUE
+                continue
+
+            if token == ']' and is_object == False and len(parent_list) > 0 and len(container) == 0:
+                (container, is_object) = parent_list.pop()
+                expect = EXPECT_SEPARATOR
+                continue
+
+            (is_value, value) = parse_layout_value(token)
+            if is_value == False:
+                raise get_layout_error(keyboard_layout, token_index, 'Expecting value')
+
+            if is_object:
+                container[key] = value
+            else:
+                container.append(value)
+            expect = EXPECT_SEPARATOR
+
+        elif expect == EXPECT_SEPARATOR:
+            if token == ',':
+                expect = EXPECT_KEY if is_object else EXPECT_VALUE
+            elif (token == ']' and is_object == False and len(parent_list) > 0) or (token == '}' and is_object):
+                (container, is_object) = parent_list.pop()
+            else:
+                raise get_layout_error(keyboard_layout, token_index, "Expecting ',' delimiter")
+
+        elif expect == EXPECT_KEY:
+            if token[0] == '"' and len(token) > 1:
+                key = parse_layout_value(token)[1]
+                expect = EXPECT_COLON
+            elif NAME_PATTERN.fullmatch(token) is not None:
+                key = token
+                expect = EXPECT_COLON
+            elif token == '}' and len(container) == 0:
+                (container, is_object) = parent_list.pop()
+                expect = EXPECT_SEPARATOR
+            else:
+                raise get_layout_error(keyboard_layout, token_index, 'Expecting property name')
+
+        else:
+            if token != ':':
+                raise get_layout_error(keyboard_layout, token_index, "Expecting ':' delimiter after %r" % (key))
+            expect = EXPECT_VALUE
+
+    if len(parent_list) > 0:
+        raise json.JSONDecodeError('Unterminated %s' % ('object' if is_object else 'list'), keyboard_layout, len(keyboard_layout))
+
+    if len(top_level_list) == 0 or expect != EXPECT_SEPARATOR:
+        raise json.JSONDecodeError('Expecting value', keyboard_layout, len(keyboard_layout))
+
+    # A JSON file is a single list of rows, optionally led by a metadata object. Raw keyboard-layout-editor
+    # output is the rows without the list, so a single raw row is a list of keys and key property objects
+    if len(top_level_list) == 1 and is_row_list(top_level_list[0]):
+        keyboard_layout_dict = top_level_list[0]
+    else:
+        logger.info('Layout is raw keyboard-layout-editor output. Rows wrapped in a list')
+        keyboard_layout_dict = top_level_list
+
+    logger.debug('keyboard_layout_dict: %s', str(keyboard_layout_dict))
+
+    return keyboard_layout_dict
+
+
+def read_text_file(file_name):
+    # Read a text file in one read. The encoding is detected from the byte order mark or, without one, from the
+    # position of the zero bytes in the first characters, so UTF-8, UTF-16 and UTF-32 files are all read
+    with open(file_name, 'rb') as f:
+        file_bytes = f.read()
+
+    encoding = json.detect_encoding(file_bytes)
+    logger.debug('Detected encoding %s for %s', encoding, file_name)
+
+    return file_bytes.decode(encoding)
+
+
+def read_layout_file(input_file_path):
+    # Read and parse a keyboard layout editor JSON file
+    logger.debug('Read layout file %s', input_file_path)
+    try:
+        keyboard_layout = read_text_file(input_file_path)
+    except OSError:
+        logger.error('Failed to open layout file %s', input_file_path)
+        raise
+    except UnicodeDecodeError:
+        logger.error('Unable to decode layout file. Please provide UTF-8 or UTF-16 encoded files')
+        raise
+
+    try:
+        return parse_layout_text(keyboard_layout)
+    except ValueError as err:
+        logger.error('Failed to parse layout file %s: %s', input_file_path, str(err))
+        raise
+
+
+def read_parameter_file(parameter_file):
+    # Read a JSON parameter file. Returns None if no parameter file was given
+    if parameter_file is None:
+        return None
+
+    logger.debug('Read parameter file %s', parameter_file)
+    try:
+        parameter_file_text = read_text_file(parameter_file)
+    except OSError:
+        logger.error('Failed to open parameter file %s', parameter_file)
+        raise
+    except UnicodeDecodeError:
+        logger.error('Unable to decode parameter file. Please provide UTF-8 or UTF-16 encoded files')
+        raise
+
+    logger.debug('Parse parameter JSON string')
+    try:
+        parameter_dict = json.loads(parameter_file_text)
+        logger.debug('Valid Json Parsed')
+    except:
+        logger.error('Failed to parse parameter JSON file.')
+        raise
+
+    logger.debug('parameter_dict: %s', str(parameter_dict))
+
+    return parameter_dict
@@ -0,0 +1,157 @@
+import bisect
+import copy
+import math
+
+
+
+class NeighborIndex():
+    """
+    Spatial index of the items of an ItemCollection used to find the closest neighbor of an item in each direction
+
+    Items are put in horizontal bands by their y interval and vertical bands by their x interval. Each band is
+    sorted by position, so the closest neighbor is found by a binary search in the bands the item covers instead
+    of a scan of the whole collection. The result is the same item the scan in set_item_neighbor found: the
+    closest item that overlaps the item in the other axis and, when several are equally close, the first one
+    in collection order
+
+    ...
+
+    Attributes
+    ----------
+    item_list : list
+        The items of the collection in collection order
+
+    band_size : float, default 1.0
+        The height of the horizontal bands and the width of the vertical bands in keyboard layout U units
+
+    Methods
+    -------
+    get_neighbor(item, direction)
+        Get the closest item in direction, right, left, top or bottom, or None if there is none
+    get_section_index(section_item_list)
+        Get an index that only finds items in section_item_list without building the bands again
+    """
+
+    def __init__(self, item_list, band_size = 1.0):
+
+        self.item_list = list(item_list)
+        self.band_size = band_size
+
+        # The section rank of each item for an index from get_section_index, None for an item outside the section
+        self.section_rank_list = None
+
+        # Band number: ([position, ...], [rank, ...]) sorted by (position, rank). The rank is the index in item_list
+        self.row_band_dict = {}
+        self.column_band_dict = {}
+
+        row_entry_dict = {}
+        column_entry_dict = {}
+        for (rank, item) in enumerate(self.item_list):
+            for band in self.get_band_range(item.y - item.h, item.y):
+                row_entry_dict.setdefault(band, []).append((item.x, rank))
+
+            for band in self.get_band_range(item.x, item.x + item.w):
+                column_entry_dict.setdefault(band, []).append((item.y, rank))
+
+        for (band_dict, entry_dict) in [(self.row_band_dict, row_entry_dict), (self.column_band_dict, column_entry_dict)]:
+            for (band, entry_list) in entry_dict.items():
+                entry_list.sort()
+                band_dict[band] = ([position for (position, rank) in entry_list], [rank for (position, rank) in entry_list])
+
+
+    def get_band_range(self, start, end):
+        # The bands an interval covers. Two intervals that overlap share at least one band
+        first_band = math.floor(start / self.band_size)
+
+        return range(first_band, max(math.ceil(end / self.band_size), first_band + 1))
+
+
+    def get_section_index(self, section_item_list):
+        # An index limited to section_item_list, items of this index such as the switches of one section. The bands
+        # are shared with this index, so nothing is sorted again. Ties are broken by the order of section_item_list
+        section_index = copy.copy(self)
+
+        section_rank_dict = {id(section_item): section_rank for (section_rank, section_item) in enumerate(section_item_list)}
+        section_index.section_rank_list = [section_rank_dict.get(id(item)) for item in self.item_list]
+
+        return section_index
+
+
+    def get_rank(self, rank):
+        # The rank ties are broken by, or None for an item outside the section the index is limited to
+        if self.section_rank_list is None:
+            return rank
+
+        return self.section_rank_list[rank]
+
+
+    def get_neighbor(self, item, direction):
+        x_min = item.x
+        x_max = item.x + item.w
+        y_min = item.y - item.h
+        y_max = item.y
+
+        # (position, rank, item) of the best neighbor found so far
+        best = None
+
+        if direction == 'right' or direction == 'left':
+            band_range = self.get_band_range(y_min, y_max)
+            band_dict = self.row_band_dict
+        else:
+            band_range = self.get_band_range(x_min, x_max)
+            band_dict = self.column_band_dict
+
+        for band in band_range:
+            if band not in band_dict.keys():
+                continue
+
+            (position_list, rank_list) = band_dict[band]
+
+            if direction == 'right' or direction == 'top':
+                # Closest is the smallest position. Every item from the start on is at or past the end of the item
+                sign = -1
+                index_range = range(bisect.bisect_left(position_list, x_max if direction == 'right' else y_max), len(position_list))
+            else:
+                # Closest is the largest position. Items are scanned from the largest down
+                sign = 1
+                index_range = range(bisect.bisect_right(position_list, x_min if direction == 'left' else y_min) - 1, -1, -1)
+
+            # The scan continues through the items at the same position as the first neighbor found for the lowest rank
+            found_position = None
+            for index in index_range:
+                if found_position is not None and position_list[index] != found_position:
+                    break
+
+                rank = self.get_rank(rank_list[index])
+                if rank is None:
+                    continue
+
+                sibling = self.item_list[rank_list[index]]
+                if direction == 'right':
+                    is_neighbor = sibling.y > y_min and sibling.y - sibling.h < y_max
+                elif direction == 'top':
+                    is_neighbor = sibling.y - sibling.h >= y_max and sibling.x + sibling.w > x_min and sibling.x < x_max
+                elif direction == 'left':
+                    is_neighbor = sibling.x + sibling.w <= x_min and sibling.y > y_min and sibling.y - sibling.h < y_max
+                else:
+                    is_neighbor = sibling.x + sibling.w > x_min and sibling.x < x_max and sibling.y <= y_min
+
+                if is_neighbor:
+                    found_position = position_list[index]
+                    best = self.get_closer(best, (position_list[index], rank, sibling), sign)
+
+        if best is None:
+            return None
+
+        return best[2]
+
+
+    def get_closer(self, best, candidate, sign):
+        # sign is -1 when the smallest position is closest and 1 when the largest is. Equal positions go to the lowest rank
+        if best is None:
+            return candidate
+
+        if candidate[0] * sign > best[0] * sign or (candidate[0] == best[0] and candidate[1] < best[1]):
+            return candidate
+
+        return best
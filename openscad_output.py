@@ -0,0 +1,77 @@
+import re
+
+
+# Statistic lines OpenSCAD prints after a render, by the key used for them in the parsed statistics
+STAT_PATTERN_DICT = {
+    'vertices': re.compile(r'^\s*Vertices:\s*(\d+)', re.MULTILINE),
+    'halfedges': re.compile(r'^\s*Halfedges:\s*(\d+)', re.MULTILINE),
+    'edges': re.compile(r'^\s*Edges:\s*(\d+)', re.MULTILINE),
+    'halffacets': re.compile(r'^\s*Halffacets:\s*(\d+)', re.MULTILINE),
+    'facets': re.compile(r'^\s*Facets:\s*(\d+)', re.MULTILINE),
+    'volumes': re.compile(r'^\s*Volumes:\s*(\d+)', re.MULTILINE),
+    'genus': re.compile(r'^\s*Genus:\s*(\d+)', re.MULTILINE),
+    'geometry_cache_count': re.compile(r'^Geometries in cache:\s*(\d+)', re.MULTILINE),
+    'geometry_cache_bytes': re.compile(r'^Geometry cache size in bytes:\s*(\d+)', re.MULTILINE),
+    'cgal_cache_count': re.compile(r'^CGAL Polyhedrons in cache:\s*(\d+)', re.MULTILINE),
+    'cgal_cache_bytes': re.compile(r'^CGAL cache size in bytes:\s*(\d+)', re.MULTILINE),
+    'csg_elements': re.compile(r'^Normalized (?:CSG )?tree has (\d+) elements', re.MULTILINE)
+}
+
+# Total rendering time: 0:01:02.345
+RENDER_TIME_PATTERN = re.compile(r'^Total rendering time:\s*(\d+):(\d+):(\d+(?:\.\d+)?)', re.MULTILINE)
+SIMPLE_PATTERN = re.compile(r'^\s*Simple:\s*(yes|no)', re.MULTILINE)
+CACHE_HIT_PATTERN = re.compile(r'Cache hit', re.IGNORECASE)
+WARNING_PATTERN = re.compile(r'^WARNING:', re.MULTILINE)
+ERROR_PATTERN = re.compile(r'^ERROR:', re.MULTILINE)
+
+
+def parse_openscad_output(output):
+    # Parse the statistics OpenSCAD prints on stderr during a render into a dict
+    # Only the statistics found in the output are included. The last value is used if a statistic is printed more than once
+    stats = {}
+
+    if output is None:
+        return stats
+
+    render_time_match_list = RENDER_TIME_PATTERN.findall(output)
+    if len(render_time_match_list) > 0:
+        (hours, minutes, seconds) = render_time_match_list[-1]
+        stats['render_time'] = (int(hours) * 3600) + (int(minutes) * 60) + float(seconds)
+
+    for (key, pattern) in STAT_PATTERN_DICT.items():
+        match_list = pattern.findall(output)
+        if len(match_list) > 0:
+            stats[key] = int(match_list[-1])
+
+    simple_match_list = SIMPLE_PATTERN.findall(output)
+    if len(simple_match_list) > 0:
+        stats['simple'] = simple_match_list[-1] == 'yes'
+
+    # Cache hits are only printed by some OpenSCAD versions and debug builds
+    cache_hit_count = len(CACHE_HIT_PATTERN.findall(output))
+    if cache_hit_count > 0:
+        stats['cache_hits'] = cache_hit_count
+
+    stats['warnings'] = len(WARNING_PATTERN.findall(output))
+    stats['errors'] = len(ERROR_PATTERN.findall(output))
+
+    return stats
+
+
+def get_output_tail(output, line_count = 10):
+    # The last lines of the output. Used to show why a render failed
+    if output is None:
+        return ''
+
+    return '\n'.join(output.strip().splitlines()[-line_count:])
+
+
+def get_stats_text(stats):
+    # Short description of the size of a rendered part, for example ", 1234 vertices, 1500 facets, 2 volumes"
+    stats_text = ''
+
+    for key in ['vertices', 'facets', 'volumes']:
+        if key in stats.keys():
+            stats_text += ', %d %s' % (stats[key], key)
+
+    return stats_text
@@ -0,0 +1,98 @@
+import concurrent.futures
+import logging
+import os
+
+from keyboard import Keyboard
+from scad_writer import ScadWriter
+
+
+# Per process state set by init_worker
+worker_keyboard: Keyboard = None
+worker_scad_writer: ScadWriter = None
+
+
+def init_worker(keyboard: Keyboard, fragments, source_file):
+    global worker_keyboard
+    global worker_scad_writer
+
+    # The keyboard is a snapshot of the processed layout and parameters sent from the main process
+    worker_keyboard = keyboard
+
+    # The run report of the snapshot times the parts built in this worker. Phases the main process recorded
+    # before the snapshot are already in its own run report
+    if worker_keyboard.run_report is not None:
+        worker_keyboard.run_report.take_phases()
+
+    worker_scad_writer = ScadWriter(fragments, source_file = source_file)
+
+
+def generate_part(section, part_name):
+    solid_object = worker_keyboard.get_part(section, part_name)
+
+    with worker_keyboard.time_phase('scad_render', section = section, part_name = part_name):
+        scad_text = worker_scad_writer.render(solid_object)
+
+    # The get_assembly and scad_render phases of this part are merged into the run report of the main process
+    phase_list = []
+    if worker_keyboard.run_report is not None:
+        phase_list = worker_keyboard.run_report.take_phases()
+
+    return (section, part_name, scad_text, phase_list)
+
+
+
+class ParallelGenerator():
+    """
+    Generate the SCAD text of keyboard parts in a pool of worker processes
+
+    Each worker receives a copy of the processed Keyboard, builds the (section, part_name) pairs it is
+    given and returns the SCAD text. The phases each worker times are added to the run report of keyboard
+
+    ...
+
+    Attributes
+    ----------
+    keyboard : Keyboard
+        A keyboard that has already processed its layout
+
+    fragments : int, default 8
+        The number of fragments written to the $fn header of each file
+
+    source_file : str, default None
+        The generator source file to embed in a comment at the end of each SCAD file
+
+    jobs : int, default os.cpu_count()
+        The number of worker processes
+
+    Methods
+    -------
+    generate(part_list)
+        Yield (section, part_name, scad_text) for each part in part_list in the order the parts are completed
+    """
+
+    def __init__(self, keyboard: Keyboard, fragments = 8, source_file = None, jobs = None):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        if jobs is None or jobs < 1:
+            jobs = os.cpu_count() or 1
+
+        self.keyboard = keyboard
+        self.fragments = fragments
+        self.source_file = source_file
+        self.jobs = jobs
+
+
+    def generate(self, part_list):
+        self.logger.debug('Generate %d parts with %d processes', len(part_list), self.jobs)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = self.jobs, initializer = init_worker, initargs = (self.keyboard, self.fragments, self.source_file)) as executor:
+            future_list = [executor.submit(generate_part, section, part_name) for (section, part_name) in part_list]
+
+            for future in concurrent.futures.as_completed(future_list):
+                (section, part_name, scad_text, phase_list) = future.result()
+
+                if self.keyboard.run_report is not None:
+                    self.keyboard.run_report.add_phases(phase_list)
+
+                yield (section, part_name, scad_text)
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from atomic_file import link_or_copy_atomic, write_text_atomic
+from render_cache import RenderCache
+
+
+
+class PartDeduplicator():
+    """
+    Find parts that have identical geometry so each unique part is only rendered once
+
+    Parts are grouped by a hash of their normalized SCAD text. The first STL file name seen for a
+    hash is the primary and is rendered. Every later STL file name with the same hash is an alias
+    that receives a copy of the primary STL file once it has been rendered
+
+    ...
+
+    Attributes
+    ----------
+    primary_dict : dict
+        Maps a SCAD hash to the STL file name of the primary part
+
+    alias_dict : dict
+        Maps the STL file name of a primary part to the list of STL file names of its aliases
+
+    Methods
+    -------
+    get_key(scad_text)
+        Get the hash of the normalized SCAD text
+    add(scad_text, stl_file_name)
+        Register a part. Returns None if the part must be rendered or the STL file name of the primary part it duplicates
+    get_alias_count()
+        Get the number of parts that do not need to be rendered
+    fan_out(failed_stl_file_name_set = set())
+        Copy each rendered primary STL file to its aliases. Returns the list of alias STL file names written
+    write_manifest(manifest_file_name, folder = None)
+        Write a JSON file listing the primary STL file of each unique part and its aliases. folder limits the
+        list to the parts that have a primary or alias STL file in that folder
+    """
+
+    def __init__(self):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.primary_dict = {}
+        self.key_dict = {}
+        self.alias_dict = {}
+
+
+    def get_key(self, scad_text):
+        return hashlib.sha256(RenderCache.normalize_scad_text(scad_text).encode('utf-8')).hexdigest()
+
+
+    def add(self, scad_text, stl_file_name):
+        key = self.get_key(scad_text)
+
+        if key not in self.primary_dict:
+            self.primary_dict[key] = stl_file_name
+            self.key_dict[stl_file_name] = key
+            self.alias_dict[stl_file_name] = []
+            return None
+
+        primary_stl_file_name = self.primary_dict[key]
+        self.logger.info('%s is identical to %s', stl_file_name, primary_stl_file_name)
+        self.alias_dict[primary_stl_file_name].append(stl_file_name)
+
+        return primary_stl_file_name
+
+
+    def get_alias_count(self):
+        return sum(len(alias_list) for alias_list in self.alias_dict.values())
+
+
+    def fan_out(self, failed_stl_file_name_set = set()):
+        written_list = []
+
+        for (primary_stl_file_name, alias_list) in self.alias_dict.items():
+            if len(alias_list) == 0:
+                continue
+
+            if primary_stl_file_name in failed_stl_file_name_set or Path(primary_stl_file_name).is_file() == False:
+                self.logger.error('Primary part %s was not rendered. Aliases not written: %s', primary_stl_file_name, ', '.join(str(alias) for alias in alias_list))
+                continue
+
+            for alias_stl_file_name in alias_list:
+                # Hardlink the primary when possible so identical parts share disk space
+                link_or_copy_atomic(primary_stl_file_name, alias_stl_file_name)
+
+                written_list.append(alias_stl_file_name)
+
+        return written_list
+
+
+    def get_manifest_name(self, stl_file_name, folder = None):
+        if folder is None or Path(stl_file_name).parent == Path(folder):
+            return Path(stl_file_name).name
+
+        return str(stl_file_name)
+
+
+    def write_manifest(self, manifest_file_name, folder = None):
+        part_list = []
+
+        for (primary_stl_file_name, alias_list) in self.alias_dict.items():
+            if folder is not None and all(Path(stl_file_name).parent != Path(folder) for stl_file_name in [primary_stl_file_name] + alias_list):
+                continue
+
+            # Files outside the manifest's folder keep their relative path so they can be found
+            part_list.append({
+                'hash': self.key_dict[primary_stl_file_name],
+                'primary': self.get_manifest_name(primary_stl_file_name, folder),
+                'aliases': [self.get_manifest_name(alias_stl_file_name, folder) for alias_stl_file_name in alias_list]
+            })
+
+        manifest_dict = {
+            'parts': part_list
+        }
+
+        write_text_atomic(manifest_file_name, json.dumps(manifest_dict, indent = 4))
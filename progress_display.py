@@ -0,0 +1,333 @@
+import logging
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+
+
+def format_duration(seconds):
+    # Short human readable duration, for example 2.5s, 12s, 3m20s or 1h02m
+    if seconds is None:
+        return '?'
+
+    if seconds < 10:
+        return '%.1fs' % (seconds)
+
+    seconds = int(round(seconds))
+
+    if seconds < 60:
+        return '%ds' % (seconds)
+
+    if seconds < 3600:
+        return '%dm%02ds' % (seconds // 60, seconds % 60)
+
+    return '%dh%02dm' % (seconds // 3600, (seconds % 3600) // 60)
+
+
+
+class ProgressStream():
+    """
+    Stream that keeps the live progress view below the lines written to it
+
+    ...
+
+    Attributes
+    ----------
+    progress_display : ProgressDisplay
+        The progress view that is cleared before and drawn again after each complete line
+
+    stream : file
+        The stream the lines are written to
+    """
+
+    def __init__(self, progress_display, stream):
+
+        self.progress_display = progress_display
+        self.stream = stream
+
+        self.buffer = ''
+
+
+    def write(self, text):
+        # print writes the text and the line end separately so text is only passed on once a line is complete
+        with self.progress_display.lock:
+            self.buffer += text
+
+            if '\n' not in self.buffer:
+                return len(text)
+
+            (line_text, separator, self.buffer) = self.buffer.rpartition('\n')
+
+            self.progress_display.clear()
+            self.stream.write(line_text + separator)
+            self.progress_display.draw()
+
+        return len(text)
+
+
+    def flush(self):
+        self.stream.flush()
+
+
+    def isatty(self):
+        return self.stream.isatty()
+
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+
+class ProgressDisplay():
+    """
+    Show how many parts have been generated and rendered, how long each running render has taken and
+    an estimate of the time left
+
+    On a terminal a live view is drawn below the normal output and redrawn every interval seconds.
+    When stdout is not a terminal a plain progress line is printed every plain_interval seconds instead
+
+    ...
+
+    Attributes
+    ----------
+    render_queue : RenderQueue, default None
+        The render queue to report on. None when nothing is rendered
+
+    scad_writer : ScadWriter, default None
+        The writer of the scad files. Its written and unchanged files are the generated parts
+
+    part_total : int, default None
+        The number of parts that will be generated. None when it is not known in advance
+
+    interval : float, default 0.5
+        Seconds between redraws of the live view
+
+    plain_interval : float, default 15.0
+        Seconds between progress lines when stdout is not a terminal
+
+    Methods
+    -------
+    start()
+        Start showing progress
+    stop()
+        Stop showing progress and print a final progress line
+    get_progress()
+        Get the counts, the running renders and the estimated time left
+    get_lines()
+        Get the lines of the live view
+    """
+
+    # Running renders are shown as slow once they have taken this many times their predicted time
+    SLOW_FACTOR = 2.0
+
+    # The maximum number of running renders listed in the live view
+    MAX_RUNNING_LINES = 8
+
+    def __init__(self, render_queue = None, scad_writer = None, part_total = None, interval = 0.5, plain_interval = 15.0):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.render_queue = render_queue
+        self.scad_writer = scad_writer
+        self.part_total = part_total
+        self.interval = interval
+        self.plain_interval = plain_interval
+
+        self.is_tty = sys.stdout.isatty()
+
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.drawn_line_count = 0
+        self.last_plain_line = None
+
+        self.stdout = None
+        self.stderr = None
+        self.console_handler_list = []
+
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        if self.is_tty == True:
+            # Lines printed while the live view is shown are written above it
+            self.stdout = sys.stdout
+            self.stderr = sys.stderr
+            sys.stdout = ProgressStream(self, self.stdout)
+            sys.stderr = ProgressStream(self, self.stderr)
+
+            # The console log handler keeps its own reference to stderr
+            for handler in logging.getLogger().handlers:
+                if type(handler) == logging.StreamHandler and handler.stream in [self.stdout, self.stderr]:
+                    self.console_handler_list.append((handler, handler.setStream(sys.stderr if handler.stream == self.stderr else sys.stdout)))
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target = self.run, name = 'progress_display', daemon = True)
+        self.thread.start()
+
+
+    def stop(self):
+        if self.thread is None:
+            return
+
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+        if self.is_tty == True:
+            with self.lock:
+                self.clear()
+
+            for (handler, stream) in self.console_handler_list:
+                handler.setStream(stream)
+            self.console_handler_list = []
+
+            sys.stdout = self.stdout
+            sys.stderr = self.stderr
+
+        print(self.get_summary_line())
+
+
+    def run(self):
+        last_plain_time = time.monotonic()
+
+        while self.stop_event.wait(self.interval) == False:
+            try:
+                if self.is_tty == True:
+                    with self.lock:
+                        self.clear()
+                        self.draw()
+
+                elif time.monotonic() - last_plain_time >= self.plain_interval:
+                    last_plain_time = time.monotonic()
+                    self.print_plain()
+            except Exception:
+                # The progress view must never stop a run
+                self.logger.exception('Failed to show progress')
+
+
+    def get_progress(self):
+        progress = {
+            'generated': 0,
+            'part_total': self.part_total,
+            'rendered': 0,
+            'failed': 0,
+            'render_total': 0,
+            'running_list': [],
+            'queued_count': 0,
+            'eta': None
+        }
+
+        if self.scad_writer is not None:
+            progress['generated'] = len(self.scad_writer.written_list) + len(self.scad_writer.skipped_list)
+
+        if self.render_queue is None:
+            return progress
+
+        with self.render_queue.lock:
+            completed_job_list = [job for job in self.render_queue.completed_job_list if job.cancelled == False]
+        pending_job_list = self.render_queue.get_pending_jobs()
+
+        now = time.monotonic()
+        running_list = [job for job in pending_job_list if job.start_time is not None]
+        queued_list = [job for job in pending_job_list if job.start_time is None]
+
+        progress['rendered'] = len(completed_job_list)
+        progress['failed'] = len([job for job in completed_job_list if job.return_code != 0])
+        progress['render_total'] = len(completed_job_list) + len(pending_job_list)
+        progress['running_list'] = [(job, now - job.start_time) for job in sorted(running_list, key = lambda job: job.start_time)]
+        progress['queued_count'] = len(queued_list)
+
+        # The predicted times come from the render history of similar parts
+        # Only estimated for local renders since the number of remote render workers is not known
+        if len(self.render_queue.worker_list) > 0:
+            remaining_time = sum(job.predicted_time for job in queued_list)
+            remaining_time += sum(max(job.predicted_time - elapsed_time, 0.0) for (job, elapsed_time) in progress['running_list'])
+            progress['eta'] = remaining_time / self.render_queue.jobs
+
+        return progress
+
+
+    def get_summary_line(self):
+        progress = self.get_progress()
+
+        summary_line = 'Generated %d%s parts' % (progress['generated'], '' if progress['part_total'] is None else '/%d' % (progress['part_total']))
+
+        if self.render_queue is not None:
+            summary_line += ', rendered %d/%d' % (progress['rendered'], progress['render_total'])
+
+            if progress['failed'] > 0:
+                summary_line += ' (%d failed)' % (progress['failed'])
+
+            summary_line += ', %d running, %d queued' % (len(progress['running_list']), progress['queued_count'])
+
+            if progress['eta'] is not None and progress['rendered'] < progress['render_total']:
+                summary_line += ', ETA %s' % (format_duration(progress['eta']))
+
+        return summary_line
+
+
+    def get_running_line(self, job, elapsed_time):
+        running_line = '  %s %s' % (Path(job.stl_file_name).name, format_duration(elapsed_time))
+
+        if job.predicted_time > 0:
+            running_line += ' / ~%s' % (format_duration(job.predicted_time))
+
+            if elapsed_time > job.predicted_time * self.SLOW_FACTOR:
+                running_line += ' (slow)'
+
+        return running_line
+
+
+    def get_lines(self):
+        progress = self.get_progress()
+
+        line_list = [self.get_summary_line()]
+
+        for (job, elapsed_time) in progress['running_list'][:self.MAX_RUNNING_LINES]:
+            line_list.append(self.get_running_line(job, elapsed_time))
+
+        if len(progress['running_list']) > self.MAX_RUNNING_LINES:
+            line_list.append('  ... %d more running' % (len(progress['running_list']) - self.MAX_RUNNING_LINES))
+
+        return line_list
+
+
+    def clear(self):
+        # Erase the live view. The cursor is left where the view started
+        if self.drawn_line_count > 0:
+            self.stdout.write('\x1b[%dF\x1b[J' % (self.drawn_line_count))
+            self.drawn_line_count = 0
+
+
+    def draw(self):
+        if self.stop_event.is_set():
+            return
+
+        # Lines longer than the terminal would wrap and break clearing the view
+        terminal_width = shutil.get_terminal_size().columns
+        line_list = [line[:terminal_width - 1] for line in self.get_lines()]
+
+        self.stdout.write('\n'.join(line_list) + '\n')
+        self.stdout.flush()
+        self.drawn_line_count = len(line_list)
+
+
+    def print_plain(self):
+        progress = self.get_progress()
+        plain_line = 'Progress: ' + self.get_summary_line()
+
+        # Only print when something changed or renders are still running so a wedged run is visible
+        if plain_line == self.last_plain_line and len(progress['running_list']) == 0:
+            return
+
+        self.last_plain_line = plain_line
+        print(plain_line)
+
+        for (job, elapsed_time) in progress['running_list']:
+            if job.predicted_time > 0 and elapsed_time > job.predicted_time * self.SLOW_FACTOR:
+                print('  Slow render:' + self.get_running_line(job, elapsed_time)[1:])
@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+
+from atomic_file import FileLock, get_temp_file_name, link_or_copy_atomic, remove_file, replace_file
+
+
+
+class RenderCache():
+    """
+    Content addressed cache of rendered STL files
+
+    STL files are stored under a key built from the SCAD text, the number of fragments and the
+    OpenSCAD version. Cache hits are materialized with a hardlink when possible and a copy otherwise.
+    The least recently used entries are removed once the cache grows past max_size_mb
+
+    ...
+
+    Attributes
+    ----------
+    cache_folder : str, default ~/.cache/keyboard_stl_generator/stl
+        The folder the cached STL files are stored in
+
+    max_size_mb : float, default 1024
+        The maximum size of the cache in megabytes
+
+    Methods
+    -------
+    get_key(scad_file_name, fragments)
+        Get the cache key for a SCAD file
+    fetch(key, stl_file_name)
+        Materialize a cached STL at stl_file_name. Returns True on a cache hit
+    store(key, stl_file_name)
+        Add a rendered STL to the cache and evict old entries if the cache is too large
+    get_lock()
+        Get the advisory lock shared by every run using the cache folder
+    """
+
+    DEFAULT_CACHE_FOLDER = Path('~/.cache/keyboard_stl_generator/stl')
+
+    # Advisory lock file in the cache folder held while entries are added or evicted
+    LOCK_FILE_NAME = '.lock'
+
+    # Lines that SolidPython adds to the SCAD output that do not change the geometry
+    GENERATED_HEADER_PATTERN = re.compile(r'^// Generated by SolidPython .*\n', re.MULTILINE)
+    SOURCE_CODE_COMMENT_PATTERN = re.compile(r'/\*{10,}\n\*+\s+SolidPython code:\s+\*+\n.*\Z', re.DOTALL)
+
+    def __init__(self, cache_folder = None, max_size_mb = 1024):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        if cache_folder is None:
+            cache_folder = self.DEFAULT_CACHE_FOLDER
+
+        self.cache_folder = Path(cache_folder).expanduser()
+        self.cache_folder.mkdir(parents = True, exist_ok = True)
+
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+
+        self.openscad_version = None
+
+        self.hit_count = 0
+        self.miss_count = 0
+
+
+    @classmethod
+    def normalize_scad_text(cls, scad_text):
+        # Remove the generation time stamp and the embedded generator source
+        scad_text = cls.GENERATED_HEADER_PATTERN.sub('', scad_text)
+        scad_text = cls.SOURCE_CODE_COMMENT_PATTERN.sub('', scad_text)
+
+        return scad_text.strip()
+
+
+    def get_openscad_version(self):
+        if self.openscad_version is None:
+            try:
+                result = subprocess.run(['openscad', '--version'], capture_output = True, text = True)
+                # OpenSCAD prints its version on stderr
+                self.openscad_version = (result.stderr + result.stdout).strip()
+            except OSError:
+                self.openscad_version = 'unknown'
+
+            self.logger.debug('openscad_version: %s', self.openscad_version)
+
+        return self.openscad_version
+
+
+    def get_key(self, scad_file_name, fragments):
+        with open(scad_file_name, encoding = 'utf-8') as f:
+            scad_text = f.read()
+
+        key_hash = hashlib.sha256()
+        key_hash.update(self.normalize_scad_text(scad_text).encode('utf-8'))
+        key_hash.update(('\n$fn = %s;\n' % (str(fragments))).encode('utf-8'))
+        key_hash.update(self.get_openscad_version().encode('utf-8'))
+
+        return key_hash.hexdigest()
+
+
+    def get_entry_path(self, key):
+        return self.cache_folder / (key + '.stl')
+
+
+    def fetch(self, key, stl_file_name):
+        entry_path = self.get_entry_path(key)
+
+        if entry_path.is_file() == False:
+            self.miss_count += 1
+            return False
+
+        try:
+            # Touch the entry so eviction removes the least recently used entries first
+            os.utime(entry_path)
+
+            self.materialize(entry_path, stl_file_name)
+        except FileNotFoundError:
+            # Evicted by another run since it was found
+            self.miss_count += 1
+            return False
+
+        self.logger.debug('Cache hit %s for %s', key, stl_file_name)
+        self.hit_count += 1
+
+        return True
+
+
+    def materialize(self, entry_path, stl_file_name):
+        link_or_copy_atomic(entry_path, stl_file_name)
+
+
+    def store(self, key, stl_file_name):
+        entry_path = self.get_entry_path(key)
+
+        if Path(stl_file_name).is_file() == False:
+            return
+
+        # Copy to a temp file first so a partial copy is never seen as a cache entry
+        # The cache is shared by every run, so adding entries and evicting are done holding the cache lock
+        try:
+            with self.get_lock():
+                temp_file_name = get_temp_file_name(entry_path)
+                try:
+                    shutil.copyfile(stl_file_name, temp_file_name)
+                except OSError:
+                    remove_file(temp_file_name)
+                    raise
+                replace_file(temp_file_name, entry_path)
+
+                self.evict()
+        except OSError as err:
+            self.logger.warning('Failed to add %s to render cache: %s', stl_file_name, str(err))
+
+
+    def get_lock(self):
+        return FileLock(self.cache_folder / self.LOCK_FILE_NAME)
+
+
+    def evict(self):
+        entry_list = []
+        total_size = 0
+
+        for entry_path in self.cache_folder.glob('*.stl'):
+            try:
+                entry_stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+
+            entry_list.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+            total_size += entry_stat.st_size
+
+        if total_size <= self.max_size_bytes:
+            return
+
+        # Oldest entries first
+        for (mtime, size, entry_path) in sorted(entry_list):
+            if total_size <= self.max_size_bytes:
+                break
+
+            self.logger.debug('Evict render cache entry %s', entry_path.name)
+            try:
+                entry_path.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
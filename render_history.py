@@ -0,0 +1,161 @@
+import json
+import logging
+import threading
+from pathlib import Path
+
+from atomic_file import FileLock, write_text_atomic
+
+
+
+class RenderHistory():
+    """
+    Store of previous STL render times used to predict how long a render will take
+
+    Render times are keyed by part kind, layout size (number of keys in the part) and number of fragments
+
+    ...
+
+    Attributes
+    ----------
+    history_file : str, default ~/.cache/keyboard_stl_generator/render_history.json
+        The JSON file render times are stored in
+
+    Methods
+    -------
+    get_key(part_name, key_count, fragments)
+        Get the history key for a part
+    record(part_name, key_count, fragments, render_time, stats = None)
+        Record the time a render took and the OpenSCAD statistics of the render
+    predict(part_name, key_count, fragments)
+        Get the predicted render time of a part in seconds
+    save()
+        Write the history to the history file
+    """
+
+    DEFAULT_HISTORY_FILE = Path('~/.cache/keyboard_stl_generator/render_history.json')
+
+    # Weight given to the newest render time when updating the average for a key
+    SMOOTHING = 0.5
+
+    # Relative cost of each part kind used when there is no history for a part
+    # The all assembly includes the screw hole bodies and the bottom cover on top of the top assembly
+    PART_COST_WEIGHT_DICT = {
+        'all': 4.0,
+        'top': 3.0,
+        'bottom': 1.5,
+        'plate': 1.0,
+        'cable_holder_all': 0.2,
+        'cable_holder_main': 0.1,
+        'cable_holder_clamp': 0.1
+    }
+    DEFAULT_PART_COST_WEIGHT = 1.0
+
+    # Estimated seconds per key for a plate rendered with 8 fragments
+    SECONDS_PER_KEY = 0.5
+    DEFAULT_FRAGMENTS = 8
+
+    def __init__(self, history_file = None):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        if history_file is None:
+            history_file = self.DEFAULT_HISTORY_FILE
+
+        self.history_file = Path(history_file).expanduser()
+
+        self.lock = threading.Lock()
+
+        self.history = {}
+        self.load()
+
+        # Keys recorded by this run. Only these replace the saved entries when the history is saved
+        self.recorded_key_set = set()
+
+
+    def load(self):
+        if self.history_file.is_file() == False:
+            return
+
+        try:
+            with open(self.history_file, encoding = 'utf-8') as f:
+                self.history = json.load(f)
+        except (OSError, ValueError) as err:
+            self.logger.warning('Failed to read render history file %s: %s', self.history_file, str(err))
+            self.history = {}
+
+
+    def save(self):
+        self.history_file.parent.mkdir(parents = True, exist_ok = True)
+
+        # Other runs may have saved the history since it was loaded. Their entries are kept and only the
+        # entries recorded by this run are replaced, holding the lock so two runs can not lose each other's entries
+        with FileLock(self.history_file.with_name(self.history_file.name + '.lock')):
+            with self.lock:
+                history = self.history
+                self.load()
+                for key in self.recorded_key_set:
+                    self.history[key] = history[key]
+                for key in history.keys() - self.history.keys():
+                    self.history[key] = history[key]
+
+                write_text_atomic(self.history_file, json.dumps(self.history, indent = 4, sort_keys = True))
+
+
+    def get_key(self, part_name, key_count, fragments):
+        return '%s|%d|%d' % (part_name, key_count, fragments)
+
+
+    def record(self, part_name, key_count, fragments, render_time, stats = None):
+        key = self.get_key(part_name, key_count, fragments)
+
+        with self.lock:
+            entry = self.history.get(key)
+
+            if entry is None:
+                entry = {
+                    'part_name': part_name,
+                    'key_count': key_count,
+                    'fragments': fragments,
+                    'render_time': render_time,
+                    'count': 0
+                }
+                self.history[key] = entry
+            else:
+                entry['render_time'] = (self.SMOOTHING * render_time) + ((1 - self.SMOOTHING) * entry['render_time'])
+
+            entry['count'] += 1
+            self.recorded_key_set.add(key)
+
+            # OpenSCAD statistics of the latest render, such as the vertex and facet counts
+            if stats is not None and len(stats) > 0:
+                entry['stats'] = stats
+
+        self.logger.debug('Recorded render time %s: %f', key, render_time)
+
+
+    def predict(self, part_name, key_count, fragments):
+        key = self.get_key(part_name, key_count, fragments)
+
+        with self.lock:
+            # Exact match
+            if key in self.history.keys():
+                return self.history[key]['render_time']
+
+            # Scale the closest recorded layout size of the same part kind and fragment count by key count
+            similar_entry_list = [
+                entry for entry in self.history.values()
+                if entry['part_name'] == part_name and entry['fragments'] == fragments and entry['key_count'] > 0
+            ]
+
+        if len(similar_entry_list) > 0:
+            closest_entry = min(similar_entry_list, key = lambda entry: abs(entry['key_count'] - key_count))
+            return closest_entry['render_time'] * (max(key_count, 1) / closest_entry['key_count'])
+
+        return self.estimate(part_name, key_count, fragments)
+
+
+    def estimate(self, part_name, key_count, fragments):
+        part_cost_weight = self.PART_COST_WEIGHT_DICT.get(part_name, self.DEFAULT_PART_COST_WEIGHT)
+        fragment_factor = max(fragments, 1) / self.DEFAULT_FRAGMENTS
+
+        return part_cost_weight * max(key_count, 1) * self.SECONDS_PER_KEY * fragment_factor
@@ -0,0 +1,530 @@
+import itertools
+import logging
+import math
+import os
+import queue
+import subprocess
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Memory limits are only available on POSIX systems. Setting them on another process needs Linux
+    resource = None
+
+from atomic_file import get_temp_file_name, remove_file, replace_file
+from render_cache import RenderCache
+from render_history import RenderHistory
+from openscad_output import parse_openscad_output, get_output_tail, get_stats_text
+
+
+
+class RenderJob():
+
+    STATUS_OK = 'ok'
+    STATUS_FAILED = 'failed'
+    STATUS_TIMEOUT = 'timeout'
+    STATUS_KILLED = 'killed'
+    STATUS_ERROR = 'error'
+    STATUS_CANCELLED = 'cancelled'
+
+    # Statuses a render with a lower $fn can fix. OpenSCAD failing to start is not retried
+    RETRY_STATUS_LIST = [STATUS_FAILED, STATUS_TIMEOUT, STATUS_KILLED]
+
+    def __init__(self, scad_file_name, stl_file_name, fragments = None, part_name = None, key_count = 0):
+
+        self.scad_file_name = scad_file_name
+        self.stl_file_name = stl_file_name
+        self.fragments = fragments
+        self.part_name = part_name
+        self.key_count = key_count
+
+        self.predicted_time = 0.0
+
+        self.cache_key = None
+        self.cache_hit = False
+
+        self.return_code = None
+        self.status = None
+        self.start_time = None
+        self.end_time = None
+
+        # The $fn used for the last attempt when it was lowered to retry a failed render
+        self.fallback_fragments = None
+
+        # One dict per attempt with the fragments, status, return code, wall time and OpenSCAD statistics
+        self.attempt_list = []
+
+        # OpenSCAD stdout and stderr of the last attempt and the statistics parsed from it
+        self.output = ''
+        self.stats = {}
+
+        # The running OpenSCAD process so a stale render can be cancelled
+        self.process = None
+        self.cancelled = False
+
+        # Set once the render queue has completed the job
+        self.completed_event = threading.Event()
+
+
+    def get_command_list(self, fragments = None, stl_file_name = None):
+        if stl_file_name is None:
+            stl_file_name = self.stl_file_name
+
+        command_list = ['openscad', '-o', '%s' % (stl_file_name)]
+
+        # A -D assignment overrides the $fn set in the file header
+        if fragments is not None:
+            command_list += ['-D', '$fn=%d' % (fragments)]
+
+        return command_list + ['%s' % (self.scad_file_name)]
+
+    def cancel(self):
+        # Stop the job. A queued job is skipped and a running OpenSCAD process is killed
+        self.cancelled = True
+
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def set_memory_limit(self, process, memory_limit_mb):
+        # Limit the address space of the OpenSCAD process so a runaway render fails instead of swapping
+        # The limit is set from the parent after the process started. A preexec_fn is not safe while other
+        # render threads are running, as the child can deadlock before exec
+        logger = logging.getLogger().getChild(__name__)
+
+        if resource is None or hasattr(resource, 'prlimit') == False:
+            logger.warning('Memory limit not supported on this system. %s rendered without a limit', self.scad_file_name)
+            return
+
+        memory_limit_bytes = int(memory_limit_mb * 1024 * 1024)
+
+        try:
+            resource.prlimit(process.pid, resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+        except (OSError, ValueError) as err:
+            # The process can already have exited
+            logger.warning('Failed to set the memory limit of openscad for %s: %s', self.scad_file_name, str(err))
+
+    def run(self, timeout = None, memory_limit_mb = None, fragments = None):
+        if self.cancelled == True:
+            self.status = self.STATUS_CANCELLED
+            self.return_code = -1
+            self.end_time = time.monotonic()
+            if self.start_time is None:
+                self.start_time = self.end_time
+            return self.return_code
+
+        attempt_start_time = time.monotonic()
+        if self.start_time is None:
+            self.start_time = attempt_start_time
+
+        self.output = ''
+        self.stats = {}
+
+        # OpenSCAD writes to a temporary file that replaces the STL file only when the render succeeds. Readers never
+        # see a partly written STL file and a hardlinked cache entry is never overwritten in place
+        # OpenSCAD picks the export format from the file extension so the temporary file also ends in .stl
+        temp_stl_file_name = None
+
+        try:
+            temp_stl_file_name = get_temp_file_name(self.stl_file_name, suffix = '.stl')
+
+            # Output is captured per job so the output of concurrent renders is not interleaved
+            process = subprocess.Popen(self.get_command_list(fragments, temp_stl_file_name), stdout = subprocess.PIPE, stderr = subprocess.STDOUT, text = True, errors = 'replace')
+            self.process = process
+
+            if memory_limit_mb is not None:
+                self.set_memory_limit(process, memory_limit_mb)
+        except OSError as err:
+            logging.getLogger().getChild(__name__).error('Failed to start openscad for %s: %s', self.scad_file_name, str(err))
+            process = None
+            self.return_code = -1
+            self.status = self.STATUS_ERROR
+
+        if process is not None:
+            try:
+                # Block on the process exiting instead of polling it
+                (self.output, unused_stderr) = process.communicate(timeout = timeout)
+                self.return_code = process.returncode
+
+                if self.return_code == 0:
+                    self.status = self.STATUS_OK
+                elif self.return_code < 0:
+                    # Killed by a signal. Usually an abort after hitting the memory limit
+                    self.status = self.STATUS_KILLED
+                else:
+                    self.status = self.STATUS_FAILED
+            except subprocess.TimeoutExpired:
+                process.kill()
+                self.output = self.read_remaining_output(process)
+                self.return_code = process.wait()
+                self.status = self.STATUS_TIMEOUT
+
+            self.stats = parse_openscad_output(self.output)
+
+            self.process = None
+
+            if self.cancelled == True:
+                self.status = self.STATUS_CANCELLED
+
+        if temp_stl_file_name is not None:
+            # OpenSCAD does not write a file for empty geometry so the empty temporary file is not used
+            if self.status == self.STATUS_OK and os.path.getsize(temp_stl_file_name) > 0:
+                replace_file(temp_stl_file_name, self.stl_file_name)
+            else:
+                remove_file(temp_stl_file_name)
+
+        self.end_time = time.monotonic()
+
+        self.attempt_list.append({
+            'fragments': fragments if fragments is not None else self.fragments,
+            'status': self.status,
+            'return_code': self.return_code,
+            'wall_time': self.end_time - attempt_start_time,
+            'stats': self.stats
+        })
+
+        return self.return_code
+
+    def run_with_retries(self, timeout = None, memory_limit_mb = None, retries = 0, retry_callback = None):
+        # Run the render and retry a failed, timed out or killed render up to retries times, halving $fn each time
+        # retry_callback is called with the job, the retry number and the new $fn before each retry
+        fragments = None
+        for attempt in range(retries + 1):
+            self.run(timeout, memory_limit_mb, fragments)
+
+            if self.status not in self.RETRY_STATUS_LIST or attempt == retries:
+                break
+
+            # Retry with lower quality curves
+            fragments = self.get_fallback_fragments(fragments)
+            self.fallback_fragments = fragments
+
+            if retry_callback is not None:
+                retry_callback(self, attempt + 1, fragments)
+
+        return self.return_code
+
+    def get_fallback_fragments(self, fragments = None):
+        if fragments is None:
+            fragments = self.fragments
+
+        if fragments is None:
+            return None
+
+        return max(fragments // 2, 3)
+
+    def read_remaining_output(self, process):
+        # Read the output of a killed process. A child process that inherited the pipe can keep it open, so stop waiting after a second
+        try:
+            (output, unused_stderr) = process.communicate(timeout = 1)
+        except subprocess.TimeoutExpired:
+            output = ''
+            process.stdout.close()
+
+        return output or ''
+
+    def get_wall_time(self):
+        if self.start_time is None or self.end_time is None:
+            return None
+
+        return self.end_time - self.start_time
+
+
+
+class RenderQueue():
+    """
+    Render SCAD files to STL files using a bounded pool of OpenSCAD processes
+
+    ...
+
+    Attributes
+    ----------
+    jobs : int, default os.cpu_count()
+        The maximum number of OpenSCAD processes that will be run at the same time
+
+    render_cache : RenderCache, default None
+        Cache of previously rendered STL files. Cached files are used instead of running OpenSCAD
+
+    render_history : RenderHistory, default None
+        Previous render times. Queued jobs are started longest predicted render time first
+
+    timeout : float, default None
+        Seconds a render may run before it is killed. None waits forever
+
+    memory_limit_mb : float, default None
+        Address space limit applied to each OpenSCAD process in megabytes
+
+    retries : int, default 1
+        The number of times a failed, timed out or killed render is retried. Each retry halves $fn
+
+    quiet : bool, default False
+        Do not print the progress of each render. Progress is still logged
+
+    completion_callback : callable, default None
+        Called with each RenderJob that completes, including cache hits but not cancelled renders
+
+    Methods
+    -------
+    start()
+        Start the worker threads. Jobs added after this are rendered as soon as a worker is free
+    add(scad_file_name, stl_file_name, fragments = None, part_name = None, key_count = 0)
+        Add a SCAD file to the queue of files to be rendered. A queued or running render of the same STL file is cancelled
+    cancel(stl_file_name)
+        Cancel the queued or running render of an STL file. Returns True if a render was cancelled
+    is_active(stl_file_name)
+        Check if an STL file is queued or being rendered
+    get_pending_jobs()
+        Get the queued and running jobs
+    trim_completed_jobs()
+        Drop cancelled jobs and all but the latest completed job of each STL file from the completed jobs
+    remove_completed_jobs(job_list)
+        Drop the jobs in job_list from the completed jobs
+    join()
+        Wait for all queued renders to complete and return the list of completed RenderJob objects
+    """
+
+    def __init__(self, jobs = None, render_cache: RenderCache = None, render_history: RenderHistory = None, timeout = None, memory_limit_mb = None, retries = 1, quiet = False):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        if jobs is None or jobs < 1:
+            jobs = os.cpu_count() or 1
+
+        self.jobs = jobs
+
+        self.render_cache = render_cache
+        self.render_history = render_history
+
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.retries = retries
+        self.quiet = quiet
+
+        # Jobs are ordered by negative predicted render time then by the order they were added
+        self.job_queue = queue.PriorityQueue()
+        self.job_sequence = itertools.count()
+        self.worker_list = []
+        self.completed_job_list = []
+
+        self.lock = threading.Lock()
+        self.running_count = 0
+
+        # Queued and running jobs by STL file name
+        self.active_job_dict = {}
+
+        self.completion_callback = None
+
+
+    def start(self):
+        if len(self.worker_list) > 0:
+            return
+
+        self.logger.debug('Start %d render workers', self.jobs)
+        for worker_number in range(self.jobs):
+            worker = threading.Thread(target = self.worker, name = 'render_worker_%d' % (worker_number), daemon = True)
+            worker.start()
+            self.worker_list.append(worker)
+
+
+    def add(self, scad_file_name, stl_file_name, fragments = None, part_name = None, key_count = 0):
+        # A render of an older version of the SCAD file is stale
+        self.cancel(stl_file_name)
+
+        job = RenderJob(scad_file_name, stl_file_name, fragments, part_name, key_count)
+
+        if self.render_cache is not None:
+            job.cache_key = self.render_cache.get_key(scad_file_name, fragments)
+
+            if self.render_cache.fetch(job.cache_key, stl_file_name) == True:
+                job.cache_hit = True
+                job.return_code = 0
+                job.status = RenderJob.STATUS_OK
+                job.start_time = job.end_time = time.monotonic()
+
+                with self.lock:
+                    self.completed_job_list.append(job)
+                self.notify_complete(job)
+
+                self.logger.info('Render Cache Hit: file: %s', stl_file_name)
+                self.print_status('Render Cache Hit: file: %s' % (stl_file_name))
+                return job
+
+        if self.render_history is not None and part_name is not None:
+            job.predicted_time = self.render_history.predict(part_name, key_count, fragments)
+
+        self.enqueue(job)
+
+        return job
+
+
+    def cancel(self, stl_file_name):
+        with self.lock:
+            job = self.active_job_dict.pop(str(stl_file_name), None)
+
+        if job is None:
+            return False
+
+        job.cancel()
+
+        self.logger.info('Render Cancelled: file: %s', stl_file_name)
+        self.print_status('Render Cancelled: file: %s' % (stl_file_name))
+
+        return True
+
+
+    def is_active(self, stl_file_name):
+        with self.lock:
+            return str(stl_file_name) in self.active_job_dict
+
+
+    def get_pending_jobs(self):
+        with self.lock:
+            return list(self.active_job_dict.values())
+
+
+    def trim_completed_jobs(self):
+        # A long running watch renders the same files over and over. Only the latest render of each file is kept
+        with self.lock:
+            latest_job_dict = {}
+            for job in self.completed_job_list:
+                if job.status != RenderJob.STATUS_CANCELLED:
+                    latest_job_dict.pop(str(job.stl_file_name), None)
+                    latest_job_dict[str(job.stl_file_name)] = job
+
+            self.completed_job_list = list(latest_job_dict.values())
+
+
+    def remove_completed_jobs(self, job_list):
+        # A resident server drops the renders of the jobs it removed
+        with self.lock:
+            self.completed_job_list = [job for job in self.completed_job_list if job not in job_list]
+
+
+    def enqueue(self, job: RenderJob):
+        with self.lock:
+            self.active_job_dict[str(job.stl_file_name)] = job
+
+        self.job_queue.put((-job.predicted_time, next(self.job_sequence), job))
+        self.logger.info('Queued render of %s, predicted time: %.2fs, queue depth: %d', job.stl_file_name, job.predicted_time, self.job_queue.qsize())
+
+
+    def join(self):
+        self.start()
+
+        # Wait for every queued job to be taken and completed
+        self.job_queue.join()
+
+        # Stop the workers by sending one sentinel per worker
+        for worker in self.worker_list:
+            self.job_queue.put((math.inf, next(self.job_sequence), None))
+
+        for worker in self.worker_list:
+            worker.join()
+
+        self.worker_list = []
+
+        if self.render_history is not None:
+            self.render_history.save()
+
+        return self.completed_job_list
+
+
+    def worker(self):
+        while True:
+            (priority, sequence, job) = self.job_queue.get()
+
+            if job is None:
+                self.job_queue.task_done()
+                break
+
+            # Cancelled jobs are left in the queue and skipped when they are taken
+            if job.cancelled == True:
+                self.job_queue.task_done()
+                continue
+
+            try:
+                self.render(job)
+            finally:
+                self.job_queue.task_done()
+
+
+    def render(self, job: RenderJob):
+        with self.lock:
+            self.running_count += 1
+            running_count = self.running_count
+
+        queue_depth = self.job_queue.qsize()
+        self.logger.info('Render Start: file: %s, running: %d, queued: %d', job.stl_file_name, running_count, queue_depth)
+        self.print_status('Render Start: file: %s (running: %d, queued: %d)' % (job.stl_file_name, running_count, queue_depth))
+
+        job.run_with_retries(self.timeout, self.memory_limit_mb, self.retries, self.print_retry)
+
+        with self.lock:
+            self.running_count -= 1
+
+        self.complete(job)
+
+
+    def print_status(self, text):
+        if self.quiet == False:
+            print(text)
+
+
+    def print_retry(self, job: RenderJob, retry_number, fragments):
+        self.logger.warning('Render %s: file: %s, retry with $fn = %s', job.status, job.stl_file_name, str(fragments))
+        self.print_status('Render %s: file: %s (retry %d with $fn = %s)' % (job.status.capitalize(), job.stl_file_name, retry_number, str(fragments)))
+
+
+    def notify_complete(self, job: RenderJob):
+        if self.completion_callback is not None:
+            try:
+                self.completion_callback(job)
+            except Exception:
+                self.logger.exception('Render completion callback failed for %s', job.stl_file_name)
+
+        job.completed_event.set()
+
+
+    def complete(self, job: RenderJob):
+        with self.lock:
+            if self.active_job_dict.get(str(job.stl_file_name)) is job:
+                del self.active_job_dict[str(job.stl_file_name)]
+
+        if job.status == RenderJob.STATUS_CANCELLED:
+            # A newer render of the same file replaces this one
+            self.logger.info('Render Stopped: file: %s, wall time: %.2fs', job.stl_file_name, job.get_wall_time())
+            job.completed_event.set()
+            return
+
+        # Reduced quality renders are not stored as the render for the requested $fn
+        full_quality = job.return_code == 0 and job.fallback_fragments is None
+
+        if full_quality and self.render_cache is not None:
+            self.render_cache.store(job.cache_key, job.stl_file_name)
+
+        if full_quality and self.render_history is not None and job.part_name is not None:
+            self.render_history.record(job.part_name, job.key_count, job.fragments, job.get_wall_time(), job.stats)
+
+        if job.output != '':
+            self.logger.debug('OpenSCAD output for %s:\n%s', job.stl_file_name, job.output)
+
+        with self.lock:
+            self.completed_job_list.append(job)
+        self.notify_complete(job)
+
+        if job.return_code == 0 and job.fallback_fragments is not None:
+            self.logger.warning('Render Complete: file: %s, reduced $fn: %d, wall time: %.2fs', job.stl_file_name, job.fallback_fragments, job.get_wall_time())
+            self.print_status('Render Complete: file: %s (%.2fs, reduced $fn = %d%s)' % (job.stl_file_name, job.get_wall_time(), job.fallback_fragments, get_stats_text(job.stats)))
+        elif job.return_code == 0:
+            self.logger.info('Render Complete: file: %s, wall time: %.2fs, stats: %s', job.stl_file_name, job.get_wall_time(), str(job.stats))
+            self.print_status('Render Complete: file: %s (%.2fs%s)' % (job.stl_file_name, job.get_wall_time(), get_stats_text(job.stats)))
+        else:
+            self.logger.error('Render Failed: file: %s, status: %s, return code: %d, wall time: %.2fs', job.stl_file_name, job.status, job.return_code, job.get_wall_time())
+            self.print_status('Render Failed: file: %s (%s, return code %d, %.2fs)' % (job.stl_file_name, job.status, job.return_code, job.get_wall_time()))
+
+            # The captured OpenSCAD output shows why the render failed
+            output_tail = get_output_tail(job.output)
+            if output_tail != '':
+                self.print_status('  ' + output_tail.replace('\n', '\n  '))
@@ -38,6 +38,14 @@ class RotationCollection:
     def get_item(self, rotation, x_offset, y_offset, rx = None, ry = None) -> Cell:
         return self.rotation_collection[rotation].get_item(rotation, x_offset, y_offset, rx, ry)
 
+    def get_item_count(self):
+        item_count = 0
+
+        for rotation in self.get_rotation_list():
+            item_count += self.rotation_collection[rotation].get_item_count()
+
+        return item_count
+
     def get_rx_list(self, rotation):
         return self.rotation_collection[rotation].get_rx_list()
 
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+from atomic_file import write_text_atomic
+from render_cache import RenderCache
+from source_hash import get_source_hash
+
+
+
+class RunCheckpoint():
+    """
+    Manifest of the SCAD files written and the STL files rendered by a run so an interrupted run can be resumed
+
+    The manifest is saved at most every save_interval seconds while SCAD writes and renders are recorded, and
+    when save is called at the end of the run. An interrupted run loses at most the records of the last
+    save_interval seconds, which a resumed run builds again. A SCAD file is complete when the run
+    inputs are unchanged and the file on disk still has the recorded hash. An STL file is complete when its
+    render exited with return code 0, the STL file on disk still has the recorded hash and it was rendered
+    from SCAD text identical to the current SCAD text
+
+    ...
+
+    Attributes
+    ----------
+    manifest_file : str
+        The JSON file the checkpoint is stored in
+
+    input_hash : str
+        Hash of the run inputs from get_input_hash. SCAD files recorded with other inputs are not complete
+
+    resume : bool, default False
+        Load the existing manifest. A new empty manifest is started otherwise
+
+    save_interval : float, default 1.0
+        The minimum number of seconds between saves of the manifest while records are added
+
+    Methods
+    -------
+    get_input_hash(keyboard_layout_dict, parameter_dict, fragments, source_folder, extra = None)
+        Get a hash of everything that changes the generated SCAD text
+    get_scad_hash(scad_text)
+        Get the hash of the normalized SCAD text
+    record_scad(scad_file_name, scad_text)
+        Record a written SCAD file
+    record_stl(stl_file_name, scad_hash, return_code, status)
+        Record the result of a render
+    record_job(job)
+        Record the result of a completed RenderJob. Used as the render queue completion callback
+    is_scad_complete(scad_file_name)
+        Check if a SCAD file was written by a run with the same inputs and is unchanged on disk
+    is_render_complete(stl_file_name, scad_text)
+        Check if an STL file was rendered successfully from the same SCAD text and is unchanged on disk
+    save()
+        Write the manifest to the manifest file if it has unsaved records
+    """
+
+    def __init__(self, manifest_file, input_hash, resume = False, save_interval = 1.0):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.manifest_file = Path(manifest_file)
+        self.input_hash = input_hash
+
+        self.save_interval = save_interval
+
+        self.lock = threading.Lock()
+
+        # Records added since the manifest was last saved and the time of that save
+        self.unsaved = False
+        self.last_save_time = None
+
+        self.loaded_input_hash = None
+        self.scad_dict = {}
+        self.stl_dict = {}
+
+        if resume == True:
+            self.load()
+
+
+    @classmethod
+    def get_input_hash(cls, keyboard_layout_dict, parameter_dict, fragments, source_folder, extra = None):
+        input_hash = hashlib.sha256()
+        input_hash.update(json.dumps([keyboard_layout_dict, parameter_dict, fragments, extra], sort_keys = True, default = str).encode('utf-8'))
+
+        # A change to the generator code can change every part
+        input_hash.update(get_source_hash(source_folder).encode('utf-8'))
+
+        return input_hash.hexdigest()
+
+
+    @classmethod
+    def get_scad_hash(cls, scad_text):
+        return hashlib.sha256(RenderCache.normalize_scad_text(scad_text).encode('utf-8')).hexdigest()
+
+
+    def get_file_hash(self, file_name):
+        file_hash = hashlib.sha256()
+
+        try:
+            with open(file_name, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    file_hash.update(chunk)
+        except OSError:
+            return None
+
+        return file_hash.hexdigest()
+
+
+    def load(self):
+        if self.manifest_file.is_file() == False:
+            self.logger.info('No checkpoint %s. Starting a new run', self.manifest_file)
+            return
+
+        try:
+            with open(self.manifest_file, encoding = 'utf-8') as f:
+                manifest_dict = json.load(f)
+        except (OSError, ValueError) as err:
+            self.logger.warning('Failed to read checkpoint %s: %s', self.manifest_file, str(err))
+            return
+
+        self.loaded_input_hash = manifest_dict.get('input_hash')
+        self.scad_dict = manifest_dict.get('scad', {})
+        self.stl_dict = manifest_dict.get('stl', {})
+
+        if self.loaded_input_hash != self.input_hash:
+            self.logger.info('Inputs changed since checkpoint %s. SCAD files are generated again', self.manifest_file)
+
+
+    def save(self):
+        with self.lock:
+            if self.unsaved == False:
+                return
+
+            manifest_dict = {
+                'input_hash': self.input_hash,
+                'scad': self.scad_dict,
+                'stl': self.stl_dict
+            }
+
+            # Replace the manifest in one step so an interrupted run never leaves a partial manifest
+            write_text_atomic(self.manifest_file, json.dumps(manifest_dict, indent = 4, sort_keys = True))
+
+            self.unsaved = False
+            self.last_save_time = time.monotonic()
+
+
+    def save_if_due(self):
+        # Rewriting the whole manifest for every record is slow for runs with many parts
+        with self.lock:
+            self.unsaved = True
+            due = self.last_save_time is None or time.monotonic() - self.last_save_time >= self.save_interval
+
+        if due == True:
+            self.save()
+
+
+    def record_scad(self, scad_file_name, scad_text):
+        with self.lock:
+            self.scad_dict[str(scad_file_name)] = {
+                'hash': self.get_scad_hash(scad_text)
+            }
+
+        self.save_if_due()
+
+
+    def record_stl(self, stl_file_name, scad_hash, return_code, status):
+        stl_hash = None
+        if return_code == 0:
+            stl_hash = self.get_file_hash(stl_file_name)
+
+        with self.lock:
+            self.stl_dict[str(stl_file_name)] = {
+                'scad_hash': scad_hash,
+                'hash': stl_hash,
+                'return_code': return_code,
+                'status': status
+            }
+
+        self.save_if_due()
+
+
+    def record_job(self, job):
+        with self.lock:
+            scad_entry = self.scad_dict.get(str(job.scad_file_name))
+
+        scad_hash = None
+        if scad_entry is not None:
+            scad_hash = scad_entry['hash']
+
+        self.record_stl(job.stl_file_name, scad_hash, job.return_code, job.status)
+
+
+    def is_scad_complete(self, scad_file_name):
+        if self.loaded_input_hash != self.input_hash:
+            return False
+
+        with self.lock:
+            scad_entry = self.scad_dict.get(str(scad_file_name))
+
+        if scad_entry is None:
+            return False
+
+        try:
+            scad_text = Path(scad_file_name).read_text(encoding = 'utf-8')
+        except (OSError, UnicodeDecodeError):
+            return False
+
+        return self.get_scad_hash(scad_text) == scad_entry['hash']
+
+
+    def is_render_complete(self, stl_file_name, scad_text):
+        with self.lock:
+            stl_entry = self.stl_dict.get(str(stl_file_name))
+
+        if stl_entry is None or stl_entry['return_code'] != 0 or stl_entry['hash'] is None:
+            return False
+
+        if stl_entry['scad_hash'] != self.get_scad_hash(scad_text):
+            return False
+
+        return self.get_file_hash(stl_file_name) == stl_entry['hash']
@@ -0,0 +1,152 @@
+import contextlib
+import datetime
+import json
+import logging
+import time
+from pathlib import Path
+
+from atomic_file import write_text_atomic
+
+
+
+class RunReport():
+    """
+    Machine readable report of a run with per phase timings and the files it produced
+
+    Phases are timed with the wall clock and the CPU time of the calling thread. Phases can be nested,
+    for example the neighbor computation and split_keyboard are part of process_keyboard_layout
+
+    ...
+
+    Attributes
+    ----------
+    report_file : str
+        The JSON file the report is written to
+
+    Methods
+    -------
+    set_context(**context)
+        Set values such as the layout name that are added to every phase and part recorded after this
+    time_phase(name, **info)
+        Context manager that records the wall and CPU time of the code it wraps
+    take_phases()
+        Remove and return the phases recorded so far
+    add_phases(phase_list)
+        Add phases recorded by the run report of another process
+    record_sections(top_section_count, bottom_section_count)
+        Record the section counts of the current layout
+    record_scad(section, part_name, scad_file_name, stl_file_name, scad_text)
+        Record a generated SCAD file and its size
+    record_render(job)
+        Record the result of a completed RenderJob
+    record_copy(stl_file_name, primary_stl_file_name)
+        Record an STL file copied from an identical part instead of rendered
+    write(**summary)
+        Write the report file
+    """
+
+    REPORT_VERSION = 1
+
+    def __init__(self, report_file):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.report_file = Path(report_file)
+
+        self.start_time = datetime.datetime.now().isoformat(timespec = 'seconds')
+        self.start_wall_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+
+        self.context = {}
+        self.phase_list = []
+        self.section_list = []
+        self.part_dict = {}
+
+
+    def set_context(self, **context):
+        self.context = context
+
+
+    @contextlib.contextmanager
+    def time_phase(self, name, **info):
+        phase = dict(self.context)
+        phase.update(info)
+        phase['name'] = name
+
+        start_wall_time = time.perf_counter()
+        start_cpu_time = time.thread_time()
+        try:
+            yield phase
+        finally:
+            phase['wall_time'] = time.perf_counter() - start_wall_time
+            phase['cpu_time'] = time.thread_time() - start_cpu_time
+            self.phase_list.append(phase)
+
+
+    def take_phases(self):
+        # Generation worker processes send their phases back with each part
+        phase_list = self.phase_list
+        self.phase_list = []
+
+        return phase_list
+
+
+    def add_phases(self, phase_list):
+        self.phase_list.extend(phase_list)
+
+
+    def record_sections(self, top_section_count, bottom_section_count):
+        sections = dict(self.context)
+        sections['top_section_count'] = top_section_count
+        sections['bottom_section_count'] = bottom_section_count
+        self.section_list.append(sections)
+
+
+    def get_part(self, stl_file_name):
+        return self.part_dict.setdefault(str(stl_file_name), dict(self.context, stl_file = str(stl_file_name)))
+
+
+    def record_scad(self, section, part_name, scad_file_name, stl_file_name, scad_text):
+        part = self.get_part(stl_file_name)
+        part['section'] = section
+        part['part_name'] = part_name
+        part['scad_file'] = str(scad_file_name)
+        part['scad_bytes'] = len(scad_text.encode('utf-8'))
+
+
+    def record_render(self, job):
+        part = self.get_part(job.stl_file_name)
+        part['render'] = {
+            'wall_time': job.get_wall_time(),
+            'return_code': job.return_code,
+            'status': job.status,
+            'cache_hit': job.cache_hit,
+            'fragments': job.fragments,
+            'fallback_fragments': job.fallback_fragments,
+            'attempts': len(job.attempt_list),
+            'stats': job.stats
+        }
+
+
+    def record_copy(self, stl_file_name, primary_stl_file_name):
+        part = self.get_part(stl_file_name)
+        part['copied_from'] = str(primary_stl_file_name)
+
+
+    def write(self, **summary):
+        report_dict = {
+            'version': self.REPORT_VERSION,
+            'start_time': self.start_time,
+            'wall_time': time.perf_counter() - self.start_wall_time,
+            'cpu_time': time.process_time() - self.start_cpu_time,
+            'summary': summary,
+            'phases': self.phase_list,
+            'sections': self.section_list,
+            'parts': list(self.part_dict.values())
+        }
+
+        self.report_file.parent.mkdir(parents = True, exist_ok = True)
+
+        write_text_atomic(self.report_file, json.dumps(report_dict, indent = 4, default = str))
+
+        self.logger.info('Wrote run report %s', self.report_file)
@@ -0,0 +1,121 @@
+import datetime
+import importlib.metadata
+import logging
+from pathlib import Path
+
+from solid import scad_render
+
+from atomic_file import write_text_atomic
+from render_cache import RenderCache
+
+
+
+class ScadWriter():
+    """
+    Write SolidPython objects to SCAD files
+
+    The output matches scad_render_to_file. When incremental is True a file is only written if its
+    geometry differs from the file already on disk, so unchanged files keep their modification time
+
+    ...
+
+    Attributes
+    ----------
+    fragments : int, default 8
+        The number of fragments written to the $fn header of each file
+
+    incremental : bool, default False
+        Leave SCAD files that have not changed untouched
+
+    source_file : str, default None
+        The generator source file to embed in a comment at the end of each SCAD file
+
+    Methods
+    -------
+    render(solid_object)
+        Get the full SCAD file text for a SolidPython object
+    write(solid_object, scad_file_name)
+        Write a SolidPython object to a SCAD file. Returns True if the file was written
+    write_text(scad_text, scad_file_name)
+        Write SCAD text from render to a SCAD file. Returns True if the file was written
+    """
+
+    def __init__(self, fragments = 8, incremental = False, source_file = None):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.fragments = fragments
+        self.incremental = incremental
+        self.source_file = source_file
+
+        self.file_header = f'$fn = {self.fragments};'
+
+        # Looking up the SolidPython version and reading the source file are only done once
+        self.solidpython_version = self.get_solidpython_version()
+        self.source_code_comment = ''
+        if self.source_file is not None:
+            self.source_code_comment = self.get_source_code_comment(self.source_file)
+
+        self.written_list = []
+        self.skipped_list = []
+
+
+    @staticmethod
+    def get_solidpython_version():
+        try:
+            return importlib.metadata.version('solidpython')
+        except importlib.metadata.PackageNotFoundError:
+            return '<Unknown>'
+
+
+    @staticmethod
+    def get_source_code_comment(source_file):
+        # The generator source in a comment at the end of the file, in the format scad_render_to_file uses
+        source_code = Path(source_file).read_text()
+
+        return ('\n'
+            '/***********************************************\n'
+            '*********      SolidPython code:      **********\n'
+            '************************************************\n'
+            ' \n'
+            f'{source_code} \n'
+            ' \n'
+            '************************************************/\n')
+
+
+    def render(self, solid_object):
+        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        header = f'// Generated by SolidPython {self.solidpython_version} on {date}\n' + self.file_header
+
+        return scad_render(solid_object, header) + self.source_code_comment
+
+
+    def is_unchanged(self, scad_text, scad_file_name):
+        scad_file_path = Path(scad_file_name)
+
+        if scad_file_path.is_file() == False:
+            return False
+
+        try:
+            existing_scad_text = scad_file_path.read_text(encoding = 'utf-8')
+        except (OSError, UnicodeDecodeError):
+            return False
+
+        return RenderCache.normalize_scad_text(existing_scad_text) == RenderCache.normalize_scad_text(scad_text)
+
+
+    def write(self, solid_object, scad_file_name):
+        return self.write_text(self.render(solid_object), scad_file_name)
+
+
+    def write_text(self, scad_text, scad_file_name):
+        if self.incremental == True and self.is_unchanged(scad_text, scad_file_name):
+            self.logger.info('SCAD file unchanged %s', scad_file_name)
+            self.skipped_list.append(scad_file_name)
+            return False
+
+        # Written to a temporary file and renamed so OpenSCAD never reads a partly written file
+        write_text_atomic(scad_file_name, scad_text)
+        self.written_list.append(scad_file_name)
+
+        return True
@@ -0,0 +1,22 @@
+import hashlib
+from pathlib import Path
+
+
+# Source hashes by folder. The source files of a running generator do not change, so each folder is hashed once
+source_hash_dict = {}
+
+
+def get_source_hash(source_folder):
+    # Hash of the names and contents of the generator source files in source_folder. A change to the generator
+    # code can change every processed layout and every part
+    source_folder = Path(source_folder).resolve()
+
+    if source_folder not in source_hash_dict:
+        source_hash = hashlib.sha256()
+        for source_file_path in sorted(source_folder.glob('*.py')):
+            source_hash.update(source_file_path.name.encode('utf-8'))
+            source_hash.update(source_file_path.read_bytes())
+
+        source_hash_dict[source_folder] = source_hash.hexdigest()
+
+    return source_hash_dict[source_folder]
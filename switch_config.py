@@ -30,6 +30,10 @@ class SwitchConfig():
     COSTAR_NOTCH_SWITCH_SIDE_X_OFFSET = 1.65
     SIDE_NOTCH_FAR_SIDE_X_OFFSET = 4.2
 
+    # Cutout polygon points shared by every SwitchConfig in the process. The points only depend on
+    # the kerf, the switch or stabilizer type and the key width, so they stay valid between builds
+    POLY_INFO_CACHE = {}
+
     def __init__(self, kerf = 0.0,  switch_type = 'mx_openable', stabilizer_type = 'cherry_costar', custom_shape = False, custom_shape_points = None, custom_shape_path = None):
 
         self.logger = logging.getLogger().getChild(__name__)
@@ -89,7 +93,10 @@ class SwitchConfig():
         
         self.logger.info(self.switch_type)
         if self.switch_type in self.switch_type_function_dict.keys():
-            return self.switch_type_function_dict[self.switch_type]()
+            cache_key = ('switch', self.kerf, self.switch_type, str(self.custom_shape_points))
+            if cache_key not in self.POLY_INFO_CACHE:
+                self.POLY_INFO_CACHE[cache_key] = self.switch_type_function_dict[self.switch_type]()
+            return self.POLY_INFO_CACHE[cache_key]
         else:
             raise ValueError('switch type %s is not a valid switch type' % (self.switch_type))
 
@@ -97,7 +104,10 @@ class SwitchConfig():
 
     def get_stab_poly_info(self, key_width = 1.0):
         if self.stabilizer_type in self.stab_type_function_dict.keys():
-            return self.stab_type_function_dict[self.stabilizer_type](key_width)
+            cache_key = ('stab', self.kerf, self.stabilizer_type, key_width)
+            if cache_key not in self.POLY_INFO_CACHE:
+                self.POLY_INFO_CACHE[cache_key] = self.stab_type_function_dict[self.stabilizer_type](key_width)
+            return self.POLY_INFO_CACHE[cache_key]
         else:
             raise ValueError('stabilizer type %s is not a valid stabilizer type' % (self.stabilizer_type))
         
@@ -0,0 +1,47 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from layout_file import parse_layout_text, read_layout_file
+
+
+LAYOUT_FOLDER = Path(__file__).resolve().parent.parent / 'layout_files'
+
+
+def test_one_row_raw_layout():
+    keyboard_layout_dict = parse_layout_text('[{w:1.5},"Tab","Q","W",{w:2.25},"Enter"]')
+
+    assert keyboard_layout_dict == [[{'w': 1.5}, 'Tab', 'Q', 'W', {'w': 2.25}, 'Enter']]
+
+
+def test_raw_layout():
+    keyboard_layout_dict = parse_layout_text('["Esc","F1"],\n[{w:1.5},"Tab","Q"]')
+
+    assert keyboard_layout_dict == [['Esc', 'F1'], [{'w': 1.5}, 'Tab', 'Q']]
+
+
+def test_json_layout_with_metadata():
+    keyboard_layout_dict = parse_layout_text('[{"name":"test"},["Esc","F1"],[{"w":1.5},"Tab"]]')
+
+    assert keyboard_layout_dict == [{'name': 'test'}, ['Esc', 'F1'], [{'w': 1.5}, 'Tab']]
+
+
+def test_json_layout_with_one_row():
+    keyboard_layout_dict = parse_layout_text('[["Esc","F1"]]')
+
+    assert keyboard_layout_dict == [['Esc', 'F1']]
+
+
+@pytest.mark.parametrize('layout_file', sorted(LAYOUT_FOLDER.glob('*.json')), ids = lambda path: path.name)
+def test_layout_files(layout_file):
+    keyboard_layout_dict = read_layout_file(layout_file)
+
+    try:
+        with open(layout_file) as f:
+            expected_layout = json.load(f)
+    except json.JSONDecodeError:
+        # Raw keyboard-layout-editor output. Every top level item is a row
+        assert all(isinstance(row, list) for row in keyboard_layout_dict)
+    else:
+        assert keyboard_layout_dict == expected_layout
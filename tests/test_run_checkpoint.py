@@ -0,0 +1,63 @@
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+
+REPO_FOLDER = Path(__file__).resolve().parent.parent
+
+# Stands in for OpenSCAD. Writes a small STL file to the -o argument
+FAKE_OPENSCAD = '''#!%s
+import sys
+
+arg_list = sys.argv[1:]
+if '--version' in arg_list:
+    sys.stderr.write('OpenSCAD version test\\n')
+    sys.exit(0)
+
+with open(arg_list[arg_list.index('-o') + 1], 'w') as f:
+    f.write('solid test\\nendsolid test\\n')
+'''
+
+
+@pytest.fixture
+def run_generator(tmp_path):
+    bin_folder = tmp_path / 'bin'
+    bin_folder.mkdir()
+    openscad_path = bin_folder / 'openscad'
+    openscad_path.write_text(FAKE_OPENSCAD % (sys.executable))
+    openscad_path.chmod(0o755)
+
+    layout_file = tmp_path / 'small_test_layout.json'
+    shutil.copyfile(REPO_FOLDER / 'layout_files' / 'small_test_layout.json', layout_file)
+
+    env = dict(os.environ)
+    env['PATH'] = str(bin_folder) + os.pathsep + env.get('PATH', '')
+    env['HOME'] = str(tmp_path / 'home')
+
+    def run(*extra_argument_list):
+        result = subprocess.run(
+            [sys.executable, str(REPO_FOLDER / 'keyboard_stl_generator.py'), '-i', str(layout_file), '-r', '--no-progress', '--no-render-cache', '--no-layout-cache'] + list(extra_argument_list),
+            cwd = tmp_path, env = env, capture_output = True, text = True
+        )
+        assert result.returncode == 0, result.stdout + result.stderr
+        return result.stdout
+
+    return run
+
+
+def test_resume_after_incremental_run(run_generator):
+    first_output = run_generator()
+    render_count = first_output.count('Render Start:')
+    assert render_count > 0
+
+    # Every render is skipped because the scad files are unchanged
+    incremental_output = run_generator('--incremental')
+    assert 'Render Start:' not in incremental_output
+
+    resume_output = run_generator('--resume')
+    assert 'Render Start:' not in resume_output
+    assert 'Resume: %d renders were already complete' % (render_count) in resume_output